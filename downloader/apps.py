@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class DownloaderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'downloader'
+
+    def ready(self):
+        from .jobs import JOB_RESUME_ON_STARTUP, job_journal, serves_requests
+
+        # picks up the jobs a previous run of the server didn't finish
+        if JOB_RESUME_ON_STARTUP and serves_requests():
+            job_journal.start_resuming()
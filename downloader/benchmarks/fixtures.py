@@ -0,0 +1,94 @@
+import copy
+import json
+import os
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+VIDEO_URL = 'https://www.youtube.com/watch?v={}'
+PLAYLIST_URL = 'https://www.youtube.com/playlist?list={}'
+
+
+def load_fixture(name: str) -> dict:
+    """
+    Recorded info dict from the fixtures directory.
+
+    Fixtures are what `yt-dlp -J <url>` prints (with the format URLs
+    pointing at {media}), so real recordings can be dropped in next to the
+    bundled ones.
+    """
+    with open(os.path.join(FIXTURES_DIR, f'{name}.json'), encoding='utf-8') as file:
+        return json.load(file)
+
+
+class FixtureVideoIE(InfoExtractor):
+    """Answers every YouTube video URL with the recorded video, its streams served locally"""
+
+    IE_NAME = 'benchmark:video'
+    _VALID_URL = r'https?://(?:www\.)?youtube\.com/watch\?v=(?P<id>[0-9A-Za-z_-]{11})'
+
+    info = None
+    media_url = None
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        info = copy.deepcopy(self.info)
+        info.update({
+            'id': video_id,
+            'title': f"{info['title']} {video_id}",
+            'webpage_url': url,
+        })
+        for format in info['formats']:
+            format['url'] = format['url'].replace('{media}', self.media_url)
+        return info
+
+
+class FixturePlaylistIE(InfoExtractor):
+    """Answers every YouTube playlist URL with the recorded flat playlist"""
+
+    IE_NAME = 'benchmark:playlist'
+    _VALID_URL = r'https?://(?:www\.)?youtube\.com/(?:playlist\?|watch\?.*?&)list=(?P<id>[\w-]+)'
+
+    info = None
+
+    def _real_extract(self, url):
+        info = copy.deepcopy(self.info)
+        info['id'] = self._match_id(url)
+        entries = info.pop('entries')
+        return self.playlist_result(
+            (self.url_result(entry['url'], video_id=entry['id'], video_title=entry.get('title')) for entry in entries),
+            info['id'],
+            info.get('title'),
+            playlist_count=len(entries),
+        )
+
+
+def install_fixtures(media_url: str, video: dict = None, playlist: dict = None):
+    """
+    Make every YoutubeDL instance created from now on answer YouTube URLs
+    from the fixtures instead of the network.
+
+    Args:
+        media_url (str): Base URL the recorded streams are served from
+        video (dict): Video info dict, defaults to the bundled video_info fixture
+        playlist (dict): Flat playlist info dict, defaults to the bundled playlist_info fixture
+    """
+    FixtureVideoIE.info = video or load_fixture('video_info')
+    FixtureVideoIE.media_url = media_url.rstrip('/')
+    FixturePlaylistIE.info = playlist or load_fixture('playlist_info')
+
+    add_default_info_extractors = yt_dlp.YoutubeDL.add_default_info_extractors
+    if getattr(add_default_info_extractors, 'benchmark_fixtures', False):
+        return
+
+    def add_fixture_info_extractors(ydl):
+        # registered first so they win over the real YouTube extractors
+        ydl.add_info_extractor(FixturePlaylistIE())
+        ydl.add_info_extractor(FixtureVideoIE())
+        add_default_info_extractors(ydl)
+
+    add_fixture_info_extractors.benchmark_fixtures = True
+    yt_dlp.YoutubeDL.add_default_info_extractors = add_fixture_info_extractors
+
@@ -0,0 +1,147 @@
+import functools
+import os
+import re
+import shutil
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import ffmpeg
+
+# file names the recorded formats point at, relative to {media}
+MEDIA_FILES = {
+    'video.mp4': 'video',
+    'video.webm': 'video',
+    'audio.m4a': 'audio',
+    'audio.webm': 'audio',
+}
+
+
+def has_ffmpeg() -> bool:
+    """Whether the ffmpeg binary is on PATH, needed for real media and merging"""
+    return shutil.which('ffmpeg') is not None
+
+
+def generate_media(media_dir: str, size_mb: float, duration: int = 30) -> dict:
+    """
+    Write the streams the fixtures point at.
+
+    With ffmpeg these are real DASH-style video only and audio only files
+    (test pattern and sine tone) so they can be merged; without it they are
+    random bytes of the same size, enough for download benchmarks.
+
+    Args:
+        media_dir (str): Directory to write to
+        size_mb (float): Approximate size of each video stream
+        duration (int): Length of the generated media in seconds
+
+    Returns:
+        dict: Path of each generated file by name
+    """
+    os.makedirs(media_dir, exist_ok=True)
+    paths = {}
+    for name, stream_type in MEDIA_FILES.items():
+        path = os.path.join(media_dir, name)
+        target = int(size_mb * 1024 * 1024) if stream_type == 'video' else int(size_mb * 1024 * 1024 / 16)
+        if has_ffmpeg():
+            _encode(path, stream_type, target, duration)
+        else:
+            with open(path, 'wb') as file:
+                remaining = target
+                while remaining > 0:
+                    chunk = os.urandom(min(remaining, 1024 * 1024))
+                    file.write(chunk)
+                    remaining -= len(chunk)
+        paths[name] = path
+    return paths
+
+
+def _encode(path, stream_type, target_bytes, duration):
+    ext = os.path.splitext(path)[1]
+    # bitrate that lands the file close to the target size
+    bitrate = max(int(target_bytes * 8 / duration), 32000)
+    if stream_type == 'video':
+        source = ffmpeg.input(f'testsrc2=size=1280x720:rate=30:duration={duration}', f='lavfi')
+        codec = 'libx264' if ext == '.mp4' else 'libvpx-vp9'
+        stream = ffmpeg.output(source, path, vcodec=codec, video_bitrate=bitrate, an=None, preset='ultrafast', loglevel='error')
+    else:
+        source = ffmpeg.input(f'sine=frequency=440:duration={duration}', f='lavfi')
+        codec = 'aac' if ext == '.m4a' else 'libopus'
+        stream = ffmpeg.output(source, path, acodec=codec, audio_bitrate=min(bitrate, 320000), vn=None, loglevel='error')
+    ffmpeg.run(stream, overwrite_output=True)
+
+
+RANGE_PATTERN = re.compile(r'bytes=(\d+)-(\d*)')
+
+
+class _MediaHandler(SimpleHTTPRequestHandler):
+    # keep-alive and single byte ranges, like the stream hosts
+    protocol_version = 'HTTP/1.1'
+
+    def send_head(self):
+        self.range_length = None
+        match = RANGE_PATTERN.fullmatch(self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if not match or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        start = int(match[1])
+        end = min(int(match[2]) if match[2] else size - 1, size - 1)
+        if start > end:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        file = open(path, 'rb')
+        file.seek(start)
+        self.range_length = end - start + 1
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(self.range_length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        return file
+
+    def copyfile(self, source, outputfile):
+        if self.range_length is None:
+            return super().copyfile(source, outputfile)
+        remaining = self.range_length
+        while remaining > 0:
+            data = source.read(min(remaining, 64 * 1024))
+            if not data:
+                break
+            outputfile.write(data)
+            remaining -= len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MediaServer:
+    """
+    Local HTTP stand-in for the stream hosts, serving a directory with
+    keep-alive and Range support.
+
+    Used as a context manager; url is the base URL to put in place of
+    {media} in the fixtures.
+    """
+
+    def __init__(self, media_dir: str, host: str = '127.0.0.1', port: int = 0):
+        handler = functools.partial(_MediaHandler, directory=media_dir)
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='benchmark-media', daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
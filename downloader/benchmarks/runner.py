@@ -0,0 +1,385 @@
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.test import Client
+
+from .. import utils
+from ..cache import download_cache, video_info_cache
+from ..formats import FormatIndex
+from ..metrics import REGISTRY, MemoryMetricsStore
+from ..models import CachedDownload, PlaylistVideo
+from ..progress import progress_store
+from ..workspace import workspaces
+from .fixtures import PLAYLIST_URL, VIDEO_URL, install_fixtures, load_fixture
+from .media import MediaServer, generate_media, has_ffmpeg
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+STAGES = [
+    'extract_cold',
+    'extract_warm',
+    'build_video_details',
+    'select_format',
+    'playlist_first_page',
+    'playlist_full',
+    'download_video',
+    'download_single_connection',
+    'merge_video_audio',
+    'zip_stream',
+    'start_download',
+    'download_playlist',
+]
+
+VIDEO_ID = 'benchvideo1'
+PLAYLIST_ID = 'PLbenchmark'
+VIDEO_FORMAT_ID = '137'
+AUDIO_FORMAT_ID = '140'
+# end to end jobs time out after this many seconds
+JOB_TIMEOUT = 300
+
+
+def get_commit() -> str:
+    """Short SHA of the checked out commit, None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class BenchmarkRunner:
+    """
+    Times the download pipeline end to end without touching the network.
+
+    YouTube is answered from the recorded fixtures and the streams are
+    served by a local HTTP server, so results only depend on this code and
+    the machine it runs on. Each stage runs a number of times and reports
+    the median and minimum wall time, the throughput for stages that move
+    bytes and the peak RSS of the process once the stage is done.
+
+    Expects the database to be a throwaway one (see the benchmark command)
+    since the end to end stages write playlist, history and cache rows.
+
+    Args:
+        workdir (str): Scratch directory for media, downloads and the download cache
+        runs (int): Timed runs per stage
+        media_mb (float): Size of each generated video stream
+        playlist_size (int): Videos in the benchmarked playlist
+        stages (list): Stages to run, defaults to all of STAGES
+    """
+
+    def __init__(self, workdir: str, runs: int = 5, media_mb: float = 20, playlist_size: int = 5, stages: list = None):
+        self.workdir = workdir
+        self.runs = runs
+        self.media_mb = media_mb
+        self.playlist_size = playlist_size
+        self.stages = stages or STAGES
+        self.ffmpeg = has_ffmpeg()
+        self.info = load_fixture('video_info')
+        self.playlist = load_fixture('playlist_info')
+        self.client = Client()
+        self.media = {}
+        self.media_url = None
+
+    def run(self, log=print) -> dict:
+        """
+        Run the selected stages.
+
+        Args:
+            log (callable): Called with one line per finished stage
+
+        Returns:
+            dict: 'meta' (commit, time, machine, parameters) and 'stages' (results by stage name)
+        """
+        results = {
+            'meta': {
+                'commit': get_commit(),
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'ffmpeg': self.ffmpeg,
+                'runs': self.runs,
+                'media_mb': self.media_mb,
+                'playlist_size': self.playlist_size,
+            },
+            'stages': {},
+        }
+        download_cache.cache_dir = os.path.join(self.workdir, 'download_cache')
+        # keep benchmark samples out of the host's metrics
+        REGISTRY.store = MemoryMetricsStore()
+        self.media = generate_media(os.path.join(self.workdir, 'media'), self.media_mb)
+
+        with MediaServer(os.path.join(self.workdir, 'media')) as server:
+            self.media_url = server.url
+            install_fixtures(server.url, self.info, self.playlist)
+            for stage in self.stages:
+                result = getattr(self, f'bench_{stage}')()
+                results['stages'][stage] = result
+                log(format_result(stage, result))
+        return results
+
+    def measure(self, func, setup=None, teardown=None) -> dict:
+        """
+        Time func over self.runs runs, after one untimed warm up run.
+
+        Args:
+            func (callable): Timed code, stages that move data return the number of bytes
+            setup (callable): Untimed, called before every run
+            teardown (callable): Untimed, called after every run
+
+        Returns:
+            dict: Wall times in seconds, throughput and peak RSS
+        """
+        times = []
+        moved = None
+        for run in range(self.runs + 1):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            moved = func()
+            elapsed = time.perf_counter() - started
+            if teardown:
+                teardown()
+            if run:
+                times.append(elapsed)
+
+        median = statistics.median(times)
+        result = {
+            'median_s': round(median, 6),
+            'min_s': round(min(times), 6),
+            'max_s': round(max(times), 6),
+            'runs': len(times),
+        }
+        if isinstance(moved, int) and moved:
+            result['bytes'] = moved
+            result['mb_per_s'] = round(moved / (1024 * 1024) / median, 2)
+        result['peak_rss_mb'] = peak_rss_mb()
+        return result
+
+    def bench_extract_cold(self):
+        url = VIDEO_URL.format(VIDEO_ID)
+        return self.measure(
+            lambda: utils.extract_video_info(url),
+            setup=lambda: video_info_cache.invalidate(VIDEO_ID)
+        )
+
+    def bench_extract_warm(self):
+        url = VIDEO_URL.format(VIDEO_ID)
+        utils.extract_video_info(url)
+        return self.measure(lambda: utils.extract_video_info(url))
+
+    def bench_build_video_details(self):
+        url = VIDEO_URL.format(VIDEO_ID)
+        return self.measure(lambda: utils.build_video_details(self.info, url))
+
+    def bench_select_format(self):
+        def select():
+            index = FormatIndex.from_info(self.info)
+            for rule in settings.PLAYLIST_FORMAT_RULES.values():
+                index.select(rule)
+        return self.measure(select)
+
+    def bench_playlist_first_page(self):
+        url = PLAYLIST_URL.format(PLAYLIST_ID)
+        return self.measure(lambda: utils.extract_playlist_info(url))
+
+    def bench_playlist_full(self):
+        url = PLAYLIST_URL.format(PLAYLIST_ID)
+        return self.measure(lambda: utils.extract_playlist_info(url, count=None))
+
+    def bench_download_video(self, transport=None):
+        url = VIDEO_URL.format(VIDEO_ID)
+        download_dir = os.path.join(self.workdir, 'downloads')
+
+        def download():
+            paths = utils.download_video(
+                url, VIDEO_FORMAT_ID, download_dir, AUDIO_FORMAT_ID, 'benchmark_download', transport=transport
+            )
+            if not all(paths):
+                raise RuntimeError('Benchmark download failed')
+            return sum(os.path.getsize(path) for path in paths)
+
+        return self.measure(
+            download,
+            teardown=lambda: shutil.rmtree(download_dir, ignore_errors=True)
+        )
+
+    def bench_download_single_connection(self):
+        # the same download without byte ranges, what yt-dlp does on its own
+        return self.bench_download_video(transport={'connections': 1})
+
+    def bench_merge_video_audio(self):
+        if not self.ffmpeg:
+            return {'skipped': 'ffmpeg not found'}
+        formats = FormatIndex.from_info(self.info).by_id
+        plan = utils.plan_merge(formats[VIDEO_FORMAT_ID].format, formats[AUDIO_FORMAT_ID].format)
+        output_path = os.path.join(self.workdir, f"merged.{plan['container']}")
+
+        def merge():
+            if not utils.merge_video_audio(
+                self.media['video.mp4'], self.media['audio.m4a'], output_path, 'benchmark_merge', plan
+            ):
+                raise RuntimeError('Benchmark merge failed')
+            return os.path.getsize(self.media['video.mp4']) + os.path.getsize(self.media['audio.m4a'])
+
+        return self.measure(merge, teardown=lambda: os.remove(output_path))
+
+    def bench_zip_stream(self):
+        members_dir = os.path.join(self.workdir, 'zip')
+        members = []
+
+        def copy_members():
+            # the archive deletes its members as it goes
+            os.makedirs(members_dir, exist_ok=True)
+            members.clear()
+            for position in range(1, self.playlist_size + 1):
+                path = os.path.join(members_dir, f'{position}.mp4')
+                shutil.copyfile(self.media['video.mp4'], path)
+                members.append((path, f"{position:03d} - video.mp4"))
+
+        def build():
+            total = sum(os.path.getsize(path) for path, arcname in members)
+            for chunk in utils.iter_zip_stream(list(members)):
+                pass
+            return total
+
+        return self.measure(build, setup=copy_members)
+
+    def bench_start_download(self):
+        url = VIDEO_URL.format(VIDEO_ID)
+        # without ffmpeg the job can't merge, so download a single stream instead
+        format_id = f'{VIDEO_FORMAT_ID}+{AUDIO_FORMAT_ID}' if self.ffmpeg else VIDEO_FORMAT_ID
+        download_id = utils.make_download_id(url, *format_id.split('+'))
+
+        def reset():
+            # start from scratch: no metadata, no cached file, no job to attach to
+            video_info_cache.invalidate(VIDEO_ID)
+            CachedDownload.objects.all().delete()
+            shutil.rmtree(download_cache.cache_dir, ignore_errors=True)
+            progress_store.delete(download_id)
+
+        def download():
+            response = self.client.post('/start-download/', {'url': url, 'format_id': format_id})
+            if response.status_code != 200:
+                raise RuntimeError(f'start-download returned {response.status_code}')
+            progress = self.wait_for(download_id)
+            return os.path.getsize(progress['file_path'])
+
+        result = self.measure(download, setup=reset)
+        result['format_id'] = format_id
+        progress_store.delete(download_id)
+        return result
+
+    def bench_download_playlist(self):
+        # without ffmpeg the items can't be merged, so download audio only
+        format_type = 'video' if self.ffmpeg else 'audio'
+        job_id = utils.make_playlist_job_id(PLAYLIST_ID, format_type)
+        zip_files = []
+
+        def reset():
+            PlaylistVideo.objects.filter(playlist_id=PLAYLIST_ID).delete()
+            for entry in self.playlist['entries'][:self.playlist_size]:
+                video_info_cache.invalidate(entry['id'])
+            progress_store.delete(job_id)
+
+        def download():
+            # list it the way a user does, then download it
+            response = self.client.get('/', {'url': PLAYLIST_URL.format(PLAYLIST_ID)})
+            if response.status_code != 200:
+                raise RuntimeError(f'Listing the playlist returned {response.status_code}')
+            response = self.client.post('/download-playlist/', {'playlist_id': PLAYLIST_ID, 'format_type': format_type})
+            if response.status_code != 200:
+                raise RuntimeError(f'download-playlist returned {response.status_code}')
+            progress = self.wait_for(response.json()['job_id'])
+            zip_files.append(progress['zip_file'])
+            return os.path.getsize(progress['zip_file'])
+
+        def cleanup():
+            while zip_files:
+                workspaces.release(os.path.dirname(zip_files.pop()))
+
+        # extraction stages list the whole recording, downloads only the first videos
+        playlist = dict(self.playlist, entries=self.playlist['entries'][:self.playlist_size])
+        install_fixtures(self.media_url, self.info, playlist)
+        try:
+            result = self.measure(download, setup=reset, teardown=cleanup)
+        finally:
+            install_fixtures(self.media_url, self.info, self.playlist)
+        result['format_type'] = format_type
+        progress_store.delete(job_id)
+        return result
+
+    def wait_for(self, job_id: str) -> dict:
+        """Poll a job's progress entry until it has finished"""
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            progress = progress_store.get(job_id) or {}
+            if progress.get('status') == 'completed':
+                return progress
+            if progress.get('status') in ('error', 'failed'):
+                raise RuntimeError(f"Benchmark job {job_id} failed: {progress.get('error')}")
+            time.sleep(0.01)
+        raise RuntimeError(f'Benchmark job {job_id} timed out')
+
+
+def format_result(stage: str, result: dict) -> str:
+    """One line summary of a stage result"""
+    if 'skipped' in result:
+        return f"{stage:<22} skipped ({result['skipped']})"
+    line = f"{stage:<22} median {result['median_s'] * 1000:10.2f} ms  min {result['min_s'] * 1000:10.2f} ms"
+    if 'mb_per_s' in result:
+        line += f"  {result['mb_per_s']:8.1f} MB/s"
+    if result.get('peak_rss_mb') is not None:
+        line += f"  peak RSS {result['peak_rss_mb']} MB"
+    return line
+
+
+def compare_results(baseline: dict, current: dict) -> list:
+    """
+    Median time of every stage next to a previous run.
+
+    Args:
+        baseline (dict): Earlier results, as saved by the benchmark command
+        current (dict): New results
+
+    Returns:
+        list: One line per stage present in both
+    """
+    lines = [f"Compared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')})"]
+    for stage, result in current['stages'].items():
+        before = baseline['stages'].get(stage)
+        if not before or 'median_s' not in before or 'median_s' not in result:
+            continue
+        change = (result['median_s'] - before['median_s']) / before['median_s'] * 100 if before['median_s'] else 0
+        lines.append(
+            f"{stage:<22} {before['median_s'] * 1000:10.2f} ms -> {result['median_s'] * 1000:10.2f} ms  ({change:+.1f}%)"
+        )
+    return lines
+
+
+def make_workdir() -> str:
+    """Scratch directory for a benchmark run"""
+    return tempfile.mkdtemp(prefix='yt-benchmark-')
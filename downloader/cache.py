@@ -0,0 +1,388 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .metrics import CACHE_REQUESTS
+
+
+class MetadataCache:
+    """
+    Two-tier cache for extracted video metadata.
+
+    Entries are keyed by canonical video ID. The first tier is an in-process
+    LRU dict, the second one is the VideoInfoCache table so that every worker
+    process (and restarts) can reuse a lookup. Every entry carries its own
+    expiry because the stream URLs inside the format list are signed and stop
+    working after a few hours.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: int = 3600, db_max_entries: int = 5000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_max_entries = db_max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_writes = 0
+        self.stats = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expired': 0,
+        }
+
+    def get(self, video_id: str) -> dict:
+        """
+        Look up an entry, promoting database hits into memory.
+
+        Args:
+            video_id (str): Canonical video ID
+
+        Returns:
+            dict: Cached entry or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(video_id)
+            if item is not None:
+                expires_at, entry = item
+                if expires_at > now:
+                    self._entries.move_to_end(video_id)
+                    self.stats['memory_hits'] += 1
+                    CACHE_REQUESTS.inc(cache='metadata', result='memory_hit')
+                    return entry
+                del self._entries[video_id]
+                self.stats['expired'] += 1
+
+        entry, expires_at = self._db_get(video_id)
+        with self._lock:
+            if entry is None:
+                self.stats['misses'] += 1
+                CACHE_REQUESTS.inc(cache='metadata', result='miss')
+                return None
+            self.stats['db_hits'] += 1
+            self._remember(video_id, entry, expires_at)
+        CACHE_REQUESTS.inc(cache='metadata', result='db_hit')
+        return entry
+
+    def peek_many(self, video_ids: list) -> dict:
+        """
+        Cached entries of several videos, without counting the lookups or touching the LRU order.
+
+        Meant for polling what has been cached so far (e.g. by the format
+        prefetch), which would otherwise flood the stats with misses. The
+        videos not in memory are looked up with a single query.
+
+        Args:
+            video_ids (list): Canonical video IDs
+
+        Returns:
+            dict: Entry by video ID, for the videos that are cached
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            for video_id in video_ids:
+                item = self._entries.get(video_id)
+                if item is not None and item[0] > now:
+                    found[video_id] = item[1]
+        missing = [video_id for video_id in video_ids if video_id not in found]
+        if missing:
+            found.update(self._db_get_many(missing))
+        return found
+
+    def set(self, video_id: str, entry: dict, ttl: int = None):
+        """
+        Store an entry in both tiers.
+
+        Args:
+            video_id (str): Canonical video ID
+            entry (dict): JSON serializable payload
+            ttl (int): Lifetime in seconds, defaults to the cache TTL
+        """
+        expires_at = time.time() + (ttl or self.ttl)
+        with self._lock:
+            self._remember(video_id, entry, expires_at)
+        self._db_set(video_id, entry, expires_at)
+
+    def invalidate(self, video_id: str):
+        """Drop an entry from both tiers"""
+        from .models import VideoInfoCache
+
+        with self._lock:
+            self._entries.pop(video_id, None)
+        try:
+            VideoInfoCache.objects.filter(video_id=video_id).delete()
+        except Exception:
+            print(f"Metadata cache invalidate failed: \n{traceback.format_exc()}")
+
+    def clear(self):
+        """Empty the in-process tier and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def get_stats(self) -> dict:
+        """
+        Snapshot of the hit/miss counters.
+
+        Returns:
+            dict: Counters plus current size and hit ratio
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['db_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, video_id, entry, expires_at):
+        # caller holds self._lock
+        self._entries[video_id] = (expires_at, entry)
+        self._entries.move_to_end(video_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _db_get(self, video_id):
+        from .models import VideoInfoCache
+
+        try:
+            row = VideoInfoCache.objects.filter(
+                video_id=video_id,
+                expires_at__gt=timezone.now()
+            ).only('payload', 'expires_at').first()
+        except Exception:
+            print(f"Metadata cache read failed: \n{traceback.format_exc()}")
+            return None, None
+        if row is None:
+            return None, None
+        return row.payload, row.expires_at.timestamp()
+
+    def _db_get_many(self, video_ids):
+        from .models import VideoInfoCache
+
+        try:
+            rows = VideoInfoCache.objects.filter(expires_at__gt=timezone.now()).values_list('video_id', 'payload')
+            # stays under SQLite's limit on query parameters
+            return {
+                video_id: payload
+                for start in range(0, len(video_ids), 500)
+                for video_id, payload in rows.filter(video_id__in=video_ids[start:start + 500])
+            }
+        except Exception:
+            print(f"Metadata cache read failed: \n{traceback.format_exc()}")
+            return {}
+
+    def _db_set(self, video_id, entry, expires_at):
+        from .models import VideoInfoCache
+
+        try:
+            VideoInfoCache.objects.update_or_create(
+                video_id=video_id,
+                defaults={
+                    'payload': entry,
+                    'expires_at': timezone.now() + timedelta(seconds=expires_at - time.time()),
+                }
+            )
+            self._db_writes += 1
+            # pruning needs a COUNT(*) so only do it every few writes
+            if self._db_writes % 50 == 0:
+                self._db_prune()
+        except Exception:
+            print(f"Metadata cache write failed: \n{traceback.format_exc()}")
+
+    def _db_prune(self):
+        from .models import VideoInfoCache
+
+        VideoInfoCache.objects.filter(expires_at__lte=timezone.now()).delete()
+        overflow = VideoInfoCache.objects.count() - self.db_max_entries
+        if overflow > 0:
+            stale_ids = VideoInfoCache.objects.order_by('expires_at').values_list('id', flat=True)[:overflow]
+            VideoInfoCache.objects.filter(id__in=list(stale_ids)).delete()
+            with self._lock:
+                self.stats['evictions'] += overflow
+
+
+video_info_cache = MetadataCache(
+    max_entries=getattr(settings, 'VIDEO_INFO_CACHE_MAX_ENTRIES', 256),
+    ttl=getattr(settings, 'VIDEO_INFO_CACHE_TTL', 3600),
+    db_max_entries=getattr(settings, 'VIDEO_INFO_CACHE_DB_MAX_ENTRIES', 5000),
+)
+
+
+class DownloadCache:
+    """
+    Content-addressed store of finished downloads.
+
+    A file is identified by (video ID, video format, audio format, container)
+    and stored under the sha1 of that key, so a hit can be served straight from
+    disk without touching yt-dlp or ffmpeg. When the files on disk go over the
+    byte budget the least recently served ones are evicted first, except for
+    those served in the last pin_seconds: a lookup hands out a path that is
+    opened a moment later (by this or another worker), and the file must still
+    be there by then. Once open, removing it doesn't affect the transfer.
+
+    Args:
+        cache_dir (str): Directory the files are kept in
+        max_bytes (int): Byte budget
+        pin_seconds (int): Seconds a served or stored file is safe from eviction
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, pin_seconds: int = 60):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.pin_seconds = pin_seconds
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+    @staticmethod
+    def make_key(video_id: str, video_format_id: str, audio_format_id: str, container: str) -> str:
+        """sha1 of the download key, used as the file name on disk"""
+        raw = '|'.join([video_id, video_format_id, audio_format_id or '', container])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def lookup(self, video_id: str, video_format_id: str, audio_format_id: str, container: str):
+        """
+        Find a finished download and mark it as served.
+
+        Args:
+            video_id (str): Canonical video ID
+            video_format_id (str): yt-dlp video (or audio only) format ID
+            audio_format_id (str): yt-dlp audio format ID, None for single stream downloads
+            container (str): Output file extension
+
+        Returns:
+            CachedDownload: The cache row or None on a miss
+        """
+        from .models import CachedDownload
+
+        try:
+            entry = CachedDownload.objects.filter(
+                video_id=video_id,
+                video_format_id=video_format_id,
+                audio_format_id=audio_format_id or '',
+                container=container
+            ).first()
+            if entry is not None and not os.path.exists(entry.file_path):
+                # removed behind our back, forget about it
+                entry.delete()
+                entry = None
+            if entry is None:
+                with self._lock:
+                    self.stats['misses'] += 1
+                CACHE_REQUESTS.inc(cache='download', result='miss')
+                return None
+
+            CachedDownload.objects.filter(pk=entry.pk).update(
+                hits=F('hits') + 1,
+                last_served=timezone.now()
+            )
+            with self._lock:
+                self.stats['hits'] += 1
+            CACHE_REQUESTS.inc(cache='download', result='hit')
+            return entry
+        except Exception:
+            print(f"Download cache lookup failed: \n{traceback.format_exc()}")
+            return None
+
+    def store(self, video_id: str, video_format_id: str, audio_format_id: str, container: str,
+              path: str, filename: str = None):
+        """
+        Move a finished file into the cache.
+
+        Args:
+            video_id (str): Canonical video ID
+            video_format_id (str): yt-dlp video (or audio only) format ID
+            audio_format_id (str): yt-dlp audio format ID, None for single stream downloads
+            container (str): Output file extension
+            path (str): Finished file, it is moved so the caller must not delete it
+            filename (str): Name the file is served under, defaults to the basename of path
+
+        Returns:
+            CachedDownload: The cache row, or None if the file couldn't be stored or is bigger
+            than the whole budget, it's left where it is then
+        """
+        from .models import CachedDownload
+
+        try:
+            if os.path.getsize(path) > self.max_bytes:
+                return None
+            os.makedirs(self.cache_dir, exist_ok=True)
+            key = self.make_key(video_id, video_format_id, audio_format_id, container)
+            cached_path = os.path.join(self.cache_dir, f"{key}.{container}")
+            shutil.move(path, cached_path)
+
+            entry, _ = CachedDownload.objects.update_or_create(
+                video_id=video_id,
+                video_format_id=video_format_id,
+                audio_format_id=audio_format_id or '',
+                container=container,
+                defaults={
+                    'file_path': cached_path,
+                    'filename': filename or os.path.basename(path),
+                    'size': os.path.getsize(cached_path),
+                    'last_served': timezone.now(),
+                }
+            )
+            # the file that was just stored is what the caller is about to serve
+            self.evict(keep=entry.pk)
+            return entry
+        except Exception:
+            print(f"Download cache store failed: \n{traceback.format_exc()}")
+            return None
+
+    def evict(self, keep: int = None):
+        """
+        Delete least recently served files until the cache fits its byte budget.
+
+        Files served or stored in the last pin_seconds are kept, even if the
+        cache stays over budget until they age out.
+
+        Args:
+            keep (int): Primary key of an entry that must not be evicted
+        """
+        from .models import CachedDownload
+
+        with self._lock:
+            total = CachedDownload.objects.aggregate(total=Sum('size'))['total'] or 0
+            if total <= self.max_bytes:
+                return
+            entries = CachedDownload.objects.filter(
+                last_served__lt=timezone.now() - timedelta(seconds=self.pin_seconds)
+            )
+            if keep is not None:
+                entries = entries.exclude(pk=keep)
+            for entry in entries.order_by('last_served').only('id', 'file_path', 'size').iterator():
+                if total <= self.max_bytes:
+                    break
+                try:
+                    if os.path.exists(entry.file_path):
+                        os.remove(entry.file_path)
+                except OSError:
+                    print(f"Error evicting cached download: \n{traceback.format_exc()}")
+                    continue
+                entry.delete()
+                total -= entry.size
+                self.stats['evictions'] += 1
+
+
+download_cache = DownloadCache(
+    cache_dir=getattr(settings, 'DOWNLOAD_CACHE_DIR', os.path.join(settings.BASE_DIR, 'download_cache')),
+    max_bytes=getattr(settings, 'DOWNLOAD_CACHE_MAX_BYTES', 10 * 1024 ** 3),
+    pin_seconds=getattr(settings, 'DOWNLOAD_CACHE_PIN_SECONDS', 60),
+)
@@ -0,0 +1,236 @@
+# codec families every container can hold without transcoding, mkv takes anything
+CODEC_FAMILIES = {
+    'avc1': 'h264', 'avc3': 'h264', 'h264': 'h264',
+    'hev1': 'h265', 'hvc1': 'h265', 'h265': 'h265',
+    'vp09': 'vp9', 'vp9': 'vp9', 'vp8': 'vp8',
+    'av01': 'av1', 'av1': 'av1',
+    'mp4a': 'aac', 'aac': 'aac', 'mp3': 'mp3',
+    'ac-3': 'ac3', 'ec-3': 'eac3',
+    'opus': 'opus', 'vorbis': 'vorbis',
+}
+CONTAINER_CODECS = {
+    'mp4': {'video': {'h264', 'h265', 'av1', 'vp9'}, 'audio': {'aac', 'mp3', 'ac3', 'eac3'}},
+    'webm': {'video': {'vp8', 'vp9', 'av1'}, 'audio': {'opus', 'vorbis'}},
+    'mkv': None,
+}
+# extensions yt-dlp uses for audio only streams, by the container they belong to
+AUDIO_CONTAINERS = {'m4a': 'mp4', 'mp4': 'mp4', 'webm': 'webm'}
+
+
+def codec_family(codec: str) -> str:
+    """Normalize a yt-dlp codec string ('avc1.640028', 'mp4a.40.2', ...) to its family"""
+    codec = (codec or 'none').lower().split('.')[0]
+    return CODEC_FAMILIES.get(codec, codec)
+
+
+def container_fits(container: str, stream_type: str, codec: str) -> bool:
+    """Whether container can hold a stream of codec family codec without transcoding"""
+    supported = CONTAINER_CODECS.get(container)
+    if supported is None:
+        # matroska takes anything
+        return container == 'mkv'
+    return codec in supported[stream_type]
+
+
+class IndexedFormat:
+    """A yt-dlp format with the fields selection needs parsed once"""
+
+    __slots__ = ('format', 'format_id', 'ext', 'container', 'height', 'fps', 'vcodec', 'acodec', 'tbr', 'abr', 'size')
+
+    def __init__(self, format: dict, duration: float = None):
+        self.format = format
+        self.format_id = format.get('format_id', '')
+        self.ext = format.get('ext', '')
+        self.container = AUDIO_CONTAINERS.get(self.ext, self.ext)
+        self.height = format.get('height') or 0
+        self.fps = format.get('fps') or 0
+        self.vcodec = codec_family(format.get('vcodec'))
+        self.acodec = codec_family(format.get('acodec'))
+        self.tbr = format.get('tbr') or 0
+        self.abr = format.get('abr') or (self.tbr if self.vcodec == 'none' else 0)
+        self.size = format.get('filesize') or format.get('filesize_approx') or 0
+        if not self.size and self.tbr and duration:
+            # kbit/s over the whole video
+            self.size = int(self.tbr * 125 * duration)
+
+
+class FormatIndex:
+    """
+    Formats of one video, split into video only, audio only and muxed streams.
+
+    Built in a single pass over the format list, after which any number of
+    selection rules can be evaluated against it. Nothing here depends on
+    Django, so it can be run against recorded info dicts.
+
+    Args:
+        formats (list): yt-dlp format dicts
+        duration (float): Video duration, used to estimate unknown sizes
+    """
+
+    def __init__(self, formats: list, duration: float = None):
+        self.by_id = {}
+        self.video = []
+        self.audio = []
+        self.muxed = []
+        for format in formats:
+            indexed = IndexedFormat(format, duration)
+            has_video = indexed.vcodec != 'none'
+            has_audio = indexed.acodec != 'none'
+            if not has_video and not has_audio:
+                # storyboards and the like
+                continue
+            self.by_id[indexed.format_id] = indexed
+            if has_video and has_audio:
+                self.muxed.append(indexed)
+            elif has_video:
+                self.video.append(indexed)
+            else:
+                self.audio.append(indexed)
+
+    @classmethod
+    def from_info(cls, info_dict: dict) -> 'FormatIndex':
+        """Index the formats of a yt-dlp info dict"""
+        return cls(info_dict.get('formats') or [], info_dict.get('duration'))
+
+    def best_audio(self, rule: dict = None, container: str = None, max_size: int = None) -> IndexedFormat:
+        """
+        Best audio only format under a rule.
+
+        The rule's max_size caps the whole download, so it's left to select();
+        max_size caps the audio alone, e.g. what's left of the cap next to a video.
+
+        Args:
+            rule (dict): Selection rule, only its audio keys are used
+            container (str): Prefer audio the container can hold without transcoding
+            max_size (int): Size cap in bytes of the audio, formats of unknown size are skipped
+
+        Returns:
+            IndexedFormat: The format, or None if none qualifies
+        """
+        rule = rule or {}
+        min_abr = rule.get('min_abr') or 0
+        codec = rule.get('codec')
+        preferred_container = rule.get('container')
+        best = None
+        best_key = None
+        for audio in self.audio:
+            if audio.abr < min_abr or not _fits_size({'max_size': max_size}, audio.size):
+                continue
+            key = (
+                container is None or container_fits(container, 'audio', audio.acodec),
+                codec is None or audio.acodec == codec,
+                preferred_container is None or audio.container == preferred_container,
+                audio.abr,
+                audio.size,
+            )
+            if best_key is None or key > best_key:
+                best, best_key = audio, key
+        return best
+
+    def select(self, rule: dict) -> dict:
+        """
+        Pick the best format under a declarative rule.
+
+        Rules are plain dicts, so the same one can be applied to every video
+        of a playlist or kept in settings, e.g. {'type': 'video',
+        'max_height': 1080, 'container': 'mp4'} or, for the best video under
+        50 MB, {'type': 'video', 'max_size': 50 * 1024 * 1024}.
+
+        Hard limits (max_height, max_size, min_abr) filter formats out,
+        preferences (codec, container) rank the remaining ones before
+        resolution and bitrate do.
+
+        Args:
+            rule (dict): Any of
+                type (str): 'video' (merged with the best fitting audio) or 'audio'
+                max_height (int): Tallest video allowed
+                codec (str): Preferred codec family ('h264', 'vp9', 'av1', 'aac', 'opus', ...)
+                container (str): Preferred container ('mp4', 'webm')
+                max_size (int): Size cap in bytes of the whole download, formats of unknown size are skipped
+                min_abr (float): Lowest audio bitrate allowed, in kbps
+                audio (bool): False to pick a video without an audio stream
+
+        Returns:
+            dict: 'format_id' ('video+audio' for merged downloads),
+                'video_format_id', 'audio_format_id' (None for a single
+                stream), 'height', 'ext' and 'size' (0 if unknown), or None
+                if no format matches
+        """
+        if rule.get('type', 'video') == 'audio':
+            audio = self.best_audio(rule, max_size=rule.get('max_size'))
+            return _selection(audio, None) if audio else None
+
+        max_height = rule.get('max_height')
+        codec = rule.get('codec')
+        preferred_container = rule.get('container')
+        with_audio = rule.get('audio', True)
+        max_size = rule.get('max_size')
+        # the best audio only depends on the container, not on the video
+        audio_by_container = {}
+
+        best = None
+        best_key = None
+        for video in self.video + self.muxed:
+            if max_height and video.height > max_height:
+                continue
+            audio = None
+            if with_audio and video.acodec == 'none':
+                if video.container not in audio_by_container:
+                    audio_by_container[video.container] = self.best_audio(rule, video.container)
+                audio = audio_by_container[video.container]
+                if audio is not None and max_size and video.size and not _fits_size(rule, _total_size(video, audio)):
+                    # a smaller audio may still fit next to this video
+                    audio = self.best_audio(rule, video.container, max_size=max_size - video.size)
+                if audio is None:
+                    continue
+            if not _fits_size(rule, _total_size(video, audio)):
+                continue
+            key = (
+                codec is None or video.vcodec == codec,
+                preferred_container is None or video.container == preferred_container,
+                video.height,
+                video.fps,
+                video.tbr,
+            )
+            if best_key is None or key > best_key:
+                best, best_key = (video, audio), key
+        if best is None:
+            return None
+        return _selection(*best)
+
+
+def _total_size(primary, audio):
+    # 0 (unknown) unless the size of every stream is known
+    if audio is None:
+        return primary.size
+    return primary.size + audio.size if primary.size and audio.size else 0
+
+
+def _fits_size(rule, size):
+    max_size = (rule or {}).get('max_size')
+    return not max_size or 0 < size <= max_size
+
+
+def _selection(primary, audio):
+    return {
+        'format_id': f"{primary.format_id}+{audio.format_id}" if audio else primary.format_id,
+        'video_format_id': primary.format_id,
+        'audio_format_id': audio.format_id if audio else None,
+        'height': primary.height,
+        'ext': primary.ext,
+        'size': _total_size(primary, audio),
+    }
+
+
+def select_format(info_dict: dict, rule: dict) -> dict:
+    """
+    Apply a selection rule to a yt-dlp info dict.
+
+    Args:
+        info_dict (dict): yt-dlp info dict
+        rule (dict): Selection rule
+
+    Returns:
+        dict: FormatIndex.select result, None if no format matches
+    """
+    return FormatIndex.from_info(info_dict).select(rule)
@@ -0,0 +1,133 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .models import VideoHistory
+
+HISTORY_PAGE_SIZE = getattr(settings, 'HISTORY_PAGE_SIZE', 10)
+HISTORY_CACHE_TTL = getattr(settings, 'HISTORY_CACHE_TTL', 30)
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def make_cursor(item: VideoHistory) -> str:
+    """Opaque pagination cursor pointing at a history entry"""
+    return f"{item.lookup_date.astimezone(timezone.utc).strftime(CURSOR_FORMAT)}-{item.pk}"
+
+
+def parse_cursor(cursor: str):
+    """
+    Reverse of make_cursor.
+
+    Returns:
+        tuple: (lookup_date, id), or None if the cursor is missing or malformed
+    """
+    try:
+        timestamp, pk = cursor.split('-')
+        return datetime.strptime(timestamp, CURSOR_FORMAT).replace(tzinfo=timezone.utc), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_history_page(before: str = None, after: str = None, per_page: int = HISTORY_PAGE_SIZE) -> dict:
+    """
+    One page of history, newest first, using keyset pagination.
+
+    Pages are addressed by the entry they start after (older) or before
+    (newer) instead of a page number, so every page is a range scan on the
+    (lookup_date, id) index and no COUNT(*) is needed.
+
+    Args:
+        before (str): Cursor of the last entry of the previous page, to go to older entries
+        after (str): Cursor of the first entry of the next page, to go back to newer entries
+        per_page (int): Entries per page
+
+    Returns:
+        dict: items, plus previous_cursor/next_cursor (None at either end)
+    """
+    queryset = VideoHistory.objects.only('title', 'url', 'thumbnail', 'lookup_date')
+    newer = parse_cursor(after)
+    older = parse_cursor(before)
+    if newer:
+        date, pk = newer
+        # walk the index upwards from the cursor, then flip back to newest first
+        items = list(
+            queryset.filter(lookup_date__gte=date)
+            .exclude(lookup_date=date, id__lte=pk)
+            .order_by('lookup_date', 'id')[:per_page + 1]
+        )
+        has_newer = len(items) > per_page
+        items = items[:per_page][::-1]
+        has_older = True
+    else:
+        if older:
+            date, pk = older
+            queryset = queryset.filter(lookup_date__lte=date).exclude(lookup_date=date, id__gte=pk)
+        items = list(queryset.order_by('-lookup_date', '-id')[:per_page + 1])
+        has_older = len(items) > per_page
+        items = items[:per_page]
+        has_newer = older is not None
+
+    return {
+        'items': items,
+        'previous_cursor': make_cursor(items[0]) if items and has_newer else None,
+        'next_cursor': make_cursor(items[-1]) if items and has_older else None,
+    }
+
+
+def render_history(before: str = None, after: str = None) -> str:
+    """
+    Rendered history section, cached for HISTORY_CACHE_TTL seconds.
+
+    Cache keys carry the newest entry of the history, read from the
+    database (one row off the history_recent_idx index), so a lookup made
+    by any worker process shows up on the next page load whatever cache
+    backend each process has, instead of after the TTL.
+
+    Returns:
+        str: HTML fragment, empty if there is no history yet
+    """
+    key = f"history:{get_history_version()}:{before or ''}:{after or ''}"
+    html = cache.get(key)
+    if html is None:
+        page = get_history_page(before, after)
+        html = render_to_string('downloader/history.html', {'history': page}) if page['items'] else ''
+        cache.set(key, html, HISTORY_CACHE_TTL)
+    return html
+
+
+def get_history_version() -> str:
+    """
+    Version of the history, changes whenever a lookup is recorded.
+
+    touch_history moves the looked up video to the top with a new
+    lookup_date, so the newest entry identifies the state of the history.
+
+    Returns:
+        str: Cursor of the newest entry, empty if there is no history yet
+    """
+    newest = VideoHistory.objects.only('lookup_date').order_by('-lookup_date', '-id').first()
+    return make_cursor(newest) if newest else ''
+
+
+def touch_history(video_id: str, url: str, title: str, thumbnail: str):
+    """
+    Record a video lookup, moving it to the top of the history.
+
+    A single INSERT ... ON CONFLICT DO UPDATE, so concurrent lookups of the
+    same video can't create duplicates.
+
+    Args:
+        video_id (str): Canonical video ID from utils.get_video_id
+        url (str): URL the video was looked up with
+        title (str): Video title
+        thumbnail (str): Thumbnail URL
+    """
+    VideoHistory.objects.bulk_create(
+        [VideoHistory(video_id=video_id, url=url, title=title, thumbnail=thumbnail)],
+        update_conflicts=True,
+        unique_fields=['video_id'],
+        update_fields=['url', 'title', 'thumbnail', 'lookup_date'],
+    )
@@ -0,0 +1,326 @@
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DownloadJob, DownloadJobItem
+from .scheduler import QueueFull
+from .workspace import workspaces
+
+JOB_HEARTBEAT_INTERVAL = getattr(settings, 'JOB_HEARTBEAT_INTERVAL', 30)
+JOB_STALE_AFTER = getattr(settings, 'JOB_STALE_AFTER', 120)
+JOB_MAX_ATTEMPTS = getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+JOB_RESUME_ON_STARTUP = getattr(settings, 'JOB_RESUME_ON_STARTUP', True)
+JOB_RETENTION = getattr(settings, 'JOB_RETENTION', 7 * 24 * 3600)
+
+ACTIVE_STATES = ('queued', 'running')
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn')
+HOSTNAME = socket.gethostname()
+# tells this process apart from an earlier one that had the same pid, e.g. after a container restart
+PROCESS_NONCE = uuid.uuid4().hex
+
+
+def serves_requests() -> bool:
+    """
+    Whether this process is a web server, the only kind that takes over interrupted jobs.
+
+    Only known server entry points count (SERVER_PROGRAMS, and the process
+    runserver serves from), anything else (management commands, tests,
+    workers, scripts) may exit before it could finish a job. Servers started
+    some other way opt in with the JOB_RESUME=1 environment variable.
+    """
+    if os.environ.get('JOB_RESUME') == '1':
+        return True
+    program = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else ''
+    if program == '__main__.py':
+        # python -m uvicorn
+        program = os.path.basename(os.path.dirname(sys.argv[0]))
+    if program in SERVER_PROGRAMS:
+        return True
+    # runserver's autoreloader parent never runs a job
+    return program == 'manage.py' and sys.argv[1:2] == ['runserver'] and (
+        os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+    )
+
+
+class JobJournal:
+    """
+    Database record of the background jobs, so they outlive the process running them.
+
+    Every scheduled job gets a DownloadJob row with what's needed to run it
+    again (URL, formats, workspace) and the stage it got to; playlist jobs
+    also get a DownloadJobItem per video, marked as each one completes.
+
+    The process running a job refreshes its heartbeat (and the list of
+    partial files in its workspace) every heartbeat_interval seconds. In
+    web server processes the same thread claims the jobs whose process is
+    gone, i.e. whose heartbeat is older than stale_after or whose owner was
+    a process of this host that no longer exists, and hands them to
+    views.resume_job. Owners are host:pid:nonce, so a process restarted
+    with the pid of the one it replaces (containers) doesn't pass for it.
+    resume_job runs the jobs again in their old workspace, so
+    yt-dlp continues its .part files, segmented downloads skip the ranges
+    they finished and playlists skip the videos they completed.
+
+    Args:
+        heartbeat_interval (int): Seconds between heartbeats
+        stale_after (int): Seconds without a heartbeat after which a job is taken over
+        max_attempts (int): Times a job is resumed before it's given up, so a
+            job that takes its process down doesn't do so forever
+        retention (int): Seconds finished jobs are kept
+    """
+
+    def __init__(self, heartbeat_interval: int = 30, stale_after: int = 120, max_attempts: int = 3,
+                 retention: int = 7 * 24 * 3600):
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.resuming = False
+        self._owned = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def owner(self) -> str:
+        # a property, a forked worker gets its own pid and nonce
+        return f"{HOSTNAME}:{os.getpid()}:{PROCESS_NONCE}"
+
+    def record(self, job_id: str, kind: str, priority: int = 0, **fields) -> DownloadJob:
+        """
+        Record a job that is about to be queued, replacing a finished run of the same job.
+
+        Args:
+            job_id (str): Scheduler job ID
+            kind (str): 'video' or 'playlist'
+            priority (int): Scheduler priority
+            **fields: DownloadJob fields, e.g. url and video_format_id
+
+        Returns:
+            DownloadJob: The new row, None if the job is still queued or running (here or
+            in another process), it's left alone then
+        """
+        with transaction.atomic():
+            if DownloadJob.objects.select_for_update().filter(job_id=job_id, state__in=ACTIVE_STATES).exists():
+                return None
+            DownloadJob.objects.filter(job_id=job_id).delete()
+            job = DownloadJob.objects.create(
+                job_id=job_id,
+                kind=kind,
+                priority=priority,
+                owner=self.owner,
+                heartbeat_at=timezone.now(),
+                **fields
+            )
+        self._own(job_id)
+        return job
+
+    def discard(self, job_id: str):
+        """Forget a job that couldn't be queued"""
+        self._disown(job_id)
+        DownloadJob.objects.filter(job_id=job_id).delete()
+
+    def update(self, job_id: str, **fields) -> bool:
+        """
+        Update a job that is still queued or running.
+
+        Returns:
+            bool: False if there is no such job, e.g. a download run straight from a request
+        """
+        return DownloadJob.objects.filter(job_id=job_id, state__in=ACTIVE_STATES).update(**fields) > 0
+
+    def running(self, job_id: str, stage: str = ''):
+        self.update(job_id, state='running', stage=stage)
+
+    def finish(self, job_id: str, result: dict = None):
+        self._disown(job_id)
+        self.update(job_id, state='completed', stage='', result=result, partial_files={}, heartbeat_at=timezone.now())
+
+    def fail(self, job_id: str, error: str):
+        self._disown(job_id)
+        self.update(job_id, state='failed', error=error, heartbeat_at=timezone.now())
+
+    def set_items(self, job_id: str, videos: list):
+        """Add a pending item per playlist video, keeping the items that are already there"""
+        job = DownloadJob.objects.filter(job_id=job_id).only('pk').first()
+        if job is None:
+            return
+        DownloadJobItem.objects.bulk_create(
+            [DownloadJobItem(job=job, position=video.position, url=video.url) for video in videos],
+            batch_size=500,
+            ignore_conflicts=True
+        )
+
+    def item_done(self, job_id: str, position: int, file_path: str):
+        DownloadJobItem.objects.filter(job__job_id=job_id, position=position).update(
+            state='completed', file_path=file_path
+        )
+
+    def completed_items(self, job_id: str) -> dict:
+        """
+        Items an earlier run of a playlist job completed, whose files are still there.
+
+        Returns:
+            dict: File path by playlist position
+        """
+        items = DownloadJobItem.objects.filter(job__job_id=job_id, state='completed').values_list('position', 'file_path')
+        return {position: file_path for position, file_path in items if os.path.exists(file_path)}
+
+    def workspaces_in_use(self) -> list:
+        """
+        Workspaces of the queued and running jobs of every process, the janitor leaves them alone.
+
+        Returns:
+            list: Workspace paths
+        """
+        # called from the janitor thread
+        close_old_connections()
+        return list(
+            DownloadJob.objects.filter(state__in=ACTIVE_STATES).exclude(workspace='').values_list('workspace', flat=True)
+        )
+
+    def start_resuming(self):
+        """Take over interrupted jobs, now and whenever another process dies with jobs"""
+        with self._lock:
+            self.resuming = True
+            self._start()
+
+    def heartbeat(self):
+        """Tell the other processes this one still runs its jobs"""
+        with self._lock:
+            owned = list(self._owned)
+        if not owned:
+            return
+        now = timezone.now()
+        for job in DownloadJob.objects.filter(job_id__in=owned, state__in=ACTIVE_STATES).only('pk', 'workspace'):
+            partials = workspaces.partial_files(job.workspace) if job.workspace else {}
+            DownloadJob.objects.filter(pk=job.pk).update(heartbeat_at=now, owner=self.owner, partial_files=partials)
+
+    def resume_stale(self) -> int:
+        """
+        Claim the jobs of processes that are gone and queue them again.
+
+        Returns:
+            int: Number of jobs queued
+        """
+        # views imports this module
+        from .views import resume_job
+
+        now = timezone.now()
+        resumed = 0
+        for job in DownloadJob.objects.filter(state__in=ACTIVE_STATES).exclude(owner=self.owner):
+            if job.heartbeat_at > now - timedelta(seconds=self.stale_after) and _owner_alive(job.owner):
+                continue
+            # whoever updates the row first gets the job
+            claimed = DownloadJob.objects.filter(pk=job.pk, owner=job.owner, heartbeat_at=job.heartbeat_at).update(
+                owner=self.owner, heartbeat_at=now, attempts=F('attempts') + 1
+            )
+            if not claimed:
+                continue
+            job.attempts += 1
+            if job.attempts > self.max_attempts:
+                DownloadJob.objects.filter(pk=job.pk).update(state='failed', error='Interrupted too many times')
+                continue
+            self._own(job.job_id)
+            try:
+                resume_job(job)
+                resumed += 1
+                print(f"Resumed {job.kind} job {job.job_id} ({job.stage or job.state}, "
+                      f"{sum(job.partial_files.values())} bytes of partial files)")
+            except QueueFull:
+                # left for a later pass (of any process, this one included), without counting this one
+                self._disown(job.job_id)
+                DownloadJob.objects.filter(pk=job.pk).update(
+                    owner=job.owner,
+                    attempts=F('attempts') - 1,
+                    heartbeat_at=now - timedelta(seconds=self.stale_after)
+                )
+            except Exception as e:
+                print(f"Resuming job {job.job_id} failed: \n{traceback.format_exc()}")
+                self.fail(job.job_id, f"Could not be resumed: {e}")
+        return resumed
+
+    def purge(self):
+        """Drop finished jobs older than the retention"""
+        DownloadJob.objects.exclude(state__in=ACTIVE_STATES).filter(
+            heartbeat_at__lt=timezone.now() - timedelta(seconds=self.retention)
+        ).delete()
+
+    def _own(self, job_id):
+        with self._lock:
+            self._owned.add(job_id)
+            self._start()
+
+    def _disown(self, job_id):
+        with self._lock:
+            self._owned.discard(job_id)
+
+    def _start(self):
+        # caller holds self._lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run_forever, name='job-journal', daemon=True)
+            self._thread.start()
+
+    def _run_forever(self):
+        while True:
+            close_old_connections()
+            try:
+                self.heartbeat()
+                if self.resuming:
+                    self.resume_stale()
+                    self.purge()
+            except Exception:
+                print(f"Job journal pass failed: \n{traceback.format_exc()}")
+            time.sleep(self.heartbeat_interval)
+
+    def _after_fork(self):
+        # the parent's jobs are the parent's to heartbeat
+        self._owned = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+def _owner_alive(owner: str) -> bool:
+    # only processes of this host can be checked, the others have to go stale
+    host, pid, nonce = (owner.rsplit(':', 2) + ['', ''])[:3]
+    if host != HOSTNAME or not pid.isdigit():
+        return True
+    if int(pid) == os.getpid():
+        # our pid, so it's either us or a process this one replaced
+        return nonce == PROCESS_NONCE
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+job_journal = JobJournal(
+    heartbeat_interval=JOB_HEARTBEAT_INTERVAL,
+    stale_after=JOB_STALE_AFTER,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retention=JOB_RETENTION,
+)
+# the janitor can't sweep what an interrupted job is to be resumed with
+workspaces.in_use = job_journal.workspaces_in_use
+
+
+def _reset_after_fork():
+    global PROCESS_NONCE
+    PROCESS_NONCE = uuid.uuid4().hex
+    job_journal._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,72 @@
+import json
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from ...benchmarks.runner import STAGES, BenchmarkRunner, compare_results, make_workdir
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark extraction, downloads, merging and playlist ZIPs offline, "
+        "against recorded fixtures and a local media server"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Timed runs per stage')
+        parser.add_argument('--media-mb', type=float, default=20, help='Size of each generated video stream in MB')
+        parser.add_argument('--playlist-size', type=int, default=5, help='Videos in the benchmarked playlist')
+        parser.add_argument('--stages', nargs='+', choices=STAGES, help='Only run these stages')
+        parser.add_argument('--output', help='Results file, defaults to benchmark_results/<time>-<commit>.json')
+        parser.add_argument('--compare', metavar='FILE', help='Earlier results file to compare against')
+        parser.add_argument('--keep', action='store_true', help='Keep the scratch directory')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read {options['compare']}: {e}")
+
+        workdir = make_workdir()
+        # the end to end stages write rows, keep them out of the real database
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        setup_test_environment()
+        try:
+            runner = BenchmarkRunner(
+                workdir,
+                runs=options['runs'],
+                media_mb=options['media_mb'],
+                playlist_size=options['playlist_size'],
+                stages=options['stages'],
+            )
+            if not runner.ffmpeg:
+                self.stdout.write(self.style.WARNING('ffmpeg not found, merging stages are skipped or download single streams'))
+            results = runner.run(log=self.stdout.write)
+        finally:
+            teardown_test_environment()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if options['keep']:
+                self.stdout.write(f"Scratch files kept in {workdir}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'benchmark_results',
+            f"{results['meta']['timestamp'].replace(':', '')}-{results['meta']['commit'] or 'unknown'}.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        if baseline:
+            for line in compare_results(baseline, results):
+                self.stdout.write(line)
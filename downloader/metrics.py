@@ -0,0 +1,420 @@
+import atexit
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from django.conf import settings
+
+METRICS_FLUSH_INTERVAL = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+
+# seconds, stages range from cache lookups to multi-minute downloads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, math.inf)
+
+
+class MetricsStore(ABC):
+    """
+    Where the samples of every process end up before a scrape reads them.
+
+    Counters (including histogram buckets, sums and counts) are pushed as
+    increments and summed, gauges are pushed as the current value of each
+    process and summed over the processes that are still alive.
+    """
+
+    @abstractmethod
+    def push(self, increments: dict, gauges: dict):
+        """
+        Add one process's samples.
+
+        Args:
+            increments (dict): Amount to add, by (series name, labels)
+            gauges (dict): Current value of this process, by (series name, labels)
+        """
+
+    @abstractmethod
+    def collect(self) -> dict:
+        """
+        Aggregated samples.
+
+        Returns:
+            dict: Value by (series name, labels)
+        """
+
+    def reset(self):
+        """Called in a forked child, drops whatever can't be shared with the parent"""
+
+
+class MemoryMetricsStore(MetricsStore):
+    """Per-process store, a scrape only sees the worker that answers it"""
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def push(self, increments, gauges):
+        with self._lock:
+            for key, amount in increments.items():
+                self._counters[key] = self._counters.get(key, 0) + amount
+            self._gauges = dict(gauges)
+
+    def collect(self):
+        with self._lock:
+            return {**self._counters, **self._gauges}
+
+
+class SQLiteMetricsStore(MetricsStore):
+    """
+    Store in a WAL mode SQLite file, shared by every worker process on the host.
+
+    Counters are kept in rows with pid 0 and incremented in place; gauges
+    get a row per process that is refreshed on every flush and ignored once
+    it's older than stale_after (the process is gone).
+
+    The file is only opened (and created) on the first push or collect, so
+    processes that never record a metric, e.g. most management commands,
+    leave no database behind.
+    """
+
+    def __init__(self, path: str, stale_after: float = 60):
+        self.path = path
+        self.stale_after = stale_after
+        self._local = threading.local()
+        self._created = False
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            if not self._created:
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS samples ('
+                    'name TEXT NOT NULL, labels TEXT NOT NULL, pid INTEGER NOT NULL, '
+                    'value REAL NOT NULL, updated_at REAL NOT NULL, '
+                    'PRIMARY KEY (name, labels, pid))'
+                )
+                self._created = True
+            self._local.db = db
+        return db
+
+    def push(self, increments, gauges):
+        now = time.time()
+        pid = os.getpid()
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                'INSERT INTO samples (name, labels, pid, value, updated_at) VALUES (?, ?, 0, ?, ?) '
+                'ON CONFLICT (name, labels, pid) DO UPDATE SET '
+                'value = value + excluded.value, updated_at = excluded.updated_at',
+                [(name, json.dumps(labels), amount, now) for (name, labels), amount in increments.items()]
+            )
+            # series this process stopped reporting disappear with it
+            db.execute('DELETE FROM samples WHERE pid = ?', (pid,))
+            db.executemany(
+                'INSERT INTO samples (name, labels, pid, value, updated_at) VALUES (?, ?, ?, ?, ?)',
+                [(name, json.dumps(labels), pid, value, now) for (name, labels), value in gauges.items()]
+            )
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def collect(self):
+        db = self._connect()
+        db.execute('DELETE FROM samples WHERE pid != 0 AND updated_at < ?', (time.time() - self.stale_after,))
+        rows = db.execute('SELECT name, labels, SUM(value) FROM samples GROUP BY name, labels').fetchall()
+        return {
+            (name, tuple(tuple(pair) for pair in json.loads(labels))): value
+            for name, labels, value in rows
+        }
+
+    def reset(self):
+        # sqlite connections must not be used across a fork
+        self._local = threading.local()
+
+
+class MetricsRegistry:
+    """
+    Collects the samples of this process and pushes them to the store.
+
+    Metric updates only touch in-process dicts; they are pushed to the store
+    every flush_interval seconds by a background thread (and right before a
+    scrape), so instrumenting a hot path costs a dict update.
+    """
+
+    def __init__(self, store: MetricsStore, flush_interval: float = 5):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.metrics = []
+        self._increments = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def add(self, name: str, labels: tuple, amount: float):
+        """Increment a counter series"""
+        with self._lock:
+            key = (name, labels)
+            self._increments[key] = self._increments.get(key, 0) + amount
+            self._start_flusher()
+
+    def set(self, name: str, labels: tuple, value: float):
+        """Set a gauge series of this process"""
+        with self._lock:
+            self._gauges[(name, labels)] = value
+            self._start_flusher()
+
+    def flush(self):
+        """Push the samples gathered since the last flush"""
+        with self._lock:
+            increments, self._increments = self._increments, {}
+            gauges = dict(self._gauges)
+        if not increments and not gauges:
+            # nothing recorded, e.g. the exit of a management command
+            return
+        try:
+            self.store.push(increments, gauges)
+        except Exception:
+            print(f"Pushing metrics failed: \n{traceback.format_exc()}")
+            with self._lock:
+                # keep them for the next flush
+                for key, amount in increments.items():
+                    self._increments[key] = self._increments.get(key, 0) + amount
+
+    def render(self) -> str:
+        """
+        Every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: Exposition text, aggregated over every process sharing the store
+        """
+        self.flush()
+        samples = self.store.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(samples))
+        return '\n'.join(lines) + '\n'
+
+    def _start_flusher(self):
+        # caller holds self._lock
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_forever, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _after_fork(self):
+        # the parent's unflushed samples are the parent's to push
+        self._increments = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self.store.reset()
+
+
+class Metric:
+    """
+    Base of the metric types.
+
+    Label values are passed as keyword arguments to the update methods, e.g.
+    STAGE_FAILURES.inc(stage='merge').
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: MetricsRegistry = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def series_names(self) -> tuple:
+        return (self.name,)
+
+    def render(self, samples: dict) -> list:
+        """Exposition lines of this metric"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for series in self.series_names():
+            for (name, labels), value in sorted(
+                ((key, value) for key, value in samples.items() if key[0] == series),
+                key=lambda item: _sort_key(item[0][1])
+            ):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+    def _labels(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+
+class Counter(Metric):
+    """Monotonically increasing count, summed over processes"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        self.registry.add(self.name, self._labels(labels), amount)
+
+
+class Gauge(Metric):
+    """Current value, summed over the live processes"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.registry.set(self.name, self._labels(labels), value)
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets, summed over processes"""
+
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets) if buckets[-1] == math.inf else tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        labels = self._labels(labels)
+        for bound in self.buckets:
+            if value <= bound:
+                self.registry.add(f"{self.name}_bucket", labels + (('le', _format_value(bound)),), 1)
+        self.registry.add(f"{self.name}_sum", labels, value)
+        self.registry.add(f"{self.name}_count", labels, 1)
+
+    def series_names(self):
+        return (f"{self.name}_bucket", f"{self.name}_sum", f"{self.name}_count")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _sort_key(labels):
+    # buckets in numeric order after the other labels
+    return tuple(
+        (name, float(value.replace('+Inf', 'inf')) if name == 'le' else value)
+        for name, value in labels
+    )
+
+
+class StageTimer:
+    """Handed out by time_stage, lets code that reports errors through return values mark a failure"""
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+@contextmanager
+def time_stage(stage: str):
+    """
+    Time a pipeline stage into STAGE_SECONDS.
+
+    The stage is counted in STAGE_FAILURES if the block raises or calls
+    fail() on the yielded timer. A generator closed early (the client went
+    away) is timed but not counted as a failure.
+
+    Args:
+        stage (str): Stage name ('extract', 'video_fetch', 'merge', ...)
+
+    Yields:
+        StageTimer: Timer of the running stage
+    """
+    timer = StageTimer()
+    started = time.perf_counter()
+    try:
+        yield timer
+    except Exception:
+        timer.fail()
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+        if timer.failed:
+            STAGE_FAILURES.inc(stage=stage)
+
+
+def _create_store():
+    backend = getattr(settings, 'METRICS_BACKEND', 'sqlite')
+    if backend == 'sqlite':
+        path = getattr(settings, 'METRICS_SQLITE_PATH', os.path.join(settings.BASE_DIR, 'metrics.sqlite3'))
+        return SQLiteMetricsStore(str(path), stale_after=max(METRICS_FLUSH_INTERVAL * 3, 15))
+    return MemoryMetricsStore()
+
+
+REGISTRY = MetricsRegistry(_create_store(), flush_interval=METRICS_FLUSH_INTERVAL)
+atexit.register(REGISTRY.flush)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY._after_fork)
+
+STAGE_SECONDS = Histogram(
+    'ytdl_stage_duration_seconds',
+    'Time spent in each stage of the download pipeline.',
+    ['stage']
+)
+STAGE_FAILURES = Counter(
+    'ytdl_stage_failures_total',
+    'Pipeline stages that failed.',
+    ['stage']
+)
+DOWNLOADED_BYTES = Counter(
+    'ytdl_downloaded_bytes_total',
+    'Bytes fetched from the stream hosts.',
+    ['stream']
+)
+SERVED_BYTES = Counter(
+    'ytdl_served_bytes_total',
+    'Bytes sent, or handed to the web server to send, to clients.',
+    ['kind']
+)
+CACHE_REQUESTS = Counter(
+    'ytdl_cache_requests_total',
+    'Cache lookups by cache and result.',
+    ['cache', 'result']
+)
+JOBS = Gauge(
+    'ytdl_jobs',
+    'Download jobs by state.',
+    ['state']
+)
+THROTTLED_SECONDS = Counter(
+    'ytdl_throttled_seconds_total',
+    'Time downloads were held back by the bandwidth limit, by scheduler priority.',
+    ['priority']
+)
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-18 05:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0002_videoinfocache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedDownload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('video_id', models.CharField(max_length=64)),
+                ('video_format_id', models.CharField(max_length=50)),
+                ('audio_format_id', models.CharField(blank=True, default='', max_length=50)),
+                ('container', models.CharField(max_length=10)),
+                ('file_path', models.CharField(max_length=500)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(default=0)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_served', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'unique_together': {('video_id', 'video_format_id', 'audio_format_id', 'container')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-18 05:59
+
+import re
+
+from django.db import migrations
+
+LIST_ID_PATTERN = re.compile(r'[?&]list=([\w-]+)')
+
+
+def normalize_playlist_ids(apps, schema_editor):
+    """Key existing rows by list ID instead of the URL the playlist was opened with"""
+    PlaylistVideo = apps.get_model('downloader', 'PlaylistVideo')
+    seen = set()
+    # without order_by() Meta.ordering puts position in the DISTINCT, one ID per row
+    for playlist_id in PlaylistVideo.objects.values_list('playlist_id', flat=True).order_by().distinct():
+        match = LIST_ID_PATTERN.search(playlist_id)
+        list_id = match.group(1) if match else playlist_id
+        rows = PlaylistVideo.objects.filter(playlist_id=playlist_id)
+        if list_id in seen:
+            # the same playlist opened through another URL, one copy is enough
+            rows.delete()
+            continue
+        seen.add(list_id)
+        if list_id != playlist_id:
+            rows.update(playlist_id=list_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0003_cacheddownload'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_playlist_ids, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='playlistvideo',
+            unique_together={('playlist_id', 'position')},
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:10
+
+import re
+
+from django.db import migrations, models
+
+VIDEO_ID_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/|/v/)([0-9A-Za-z_-]{11})')
+
+
+def fill_video_ids(apps, schema_editor):
+    """Key existing history by video ID, keeping the latest lookup of each video"""
+    VideoHistory = apps.get_model('downloader', 'VideoHistory')
+    seen = set()
+    duplicates = []
+    for item in VideoHistory.objects.order_by('-lookup_date', '-id').iterator():
+        match = VIDEO_ID_PATTERN.search(item.url)
+        video_id = match.group(1) if match else item.url[:64]
+        if video_id in seen:
+            duplicates.append(item.pk)
+            continue
+        seen.add(video_id)
+        item.video_id = video_id
+        item.save(update_fields=['video_id'])
+    for start in range(0, len(duplicates), 500):
+        VideoHistory.objects.filter(pk__in=duplicates[start:start + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0004_playlistvideo_identity'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='videohistory',
+            options={'ordering': ['-lookup_date', '-id']},
+        ),
+        migrations.AddField(
+            model_name='videohistory',
+            name='video_id',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_video_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='videohistory',
+            name='video_id',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='videohistory',
+            index=models.Index(fields=['-lookup_date', '-id'], name='history_recent_idx'),
+        ),
+    ]
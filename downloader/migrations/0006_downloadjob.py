@@ -0,0 +1,56 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0005_videohistory_video_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(max_length=200, unique=True)),
+                ('kind', models.CharField(max_length=10)),
+                ('url', models.URLField(blank=True, default='', max_length=500)),
+                ('video_format_id', models.CharField(blank=True, default='', max_length=50)),
+                ('audio_format_id', models.CharField(blank=True, default='', max_length=50)),
+                ('format_type', models.CharField(blank=True, default='', max_length=10)),
+                ('audio_output', models.JSONField(blank=True, null=True)),
+                ('priority', models.IntegerField(default=0)),
+                ('state', models.CharField(default='queued', max_length=10)),
+                ('stage', models.CharField(blank=True, default='', max_length=20)),
+                ('workspace', models.CharField(blank=True, default='', max_length=500)),
+                ('partial_files', models.JSONField(blank=True, default=dict)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('attempts', models.IntegerField(default=0)),
+                ('owner', models.CharField(blank=True, default='', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('heartbeat_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['state', 'heartbeat_at'], name='job_resume_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DownloadJobItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('url', models.URLField(max_length=500)),
+                ('state', models.CharField(default='pending', max_length=10)),
+                ('file_path', models.CharField(blank=True, default='', max_length=500)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='downloader.downloadjob')),
+            ],
+            options={
+                'ordering': ['position'],
+                'unique_together': {('job', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0006_downloadjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='downloadjob',
+            name='owner',
+            field=models.CharField(blank=True, default='', max_length=150),
+        ),
+    ]
@@ -2,18 +2,25 @@
 from django.db import models
 
 class VideoHistory(models.Model):
+    # one row per video however its URL was written, see utils.get_video_id
+    video_id = models.CharField(max_length=64, unique=True)
     title = models.CharField(max_length=255)
     url = models.URLField()
     thumbnail = models.URLField()
     lookup_date = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        ordering = ['-lookup_date']
+        ordering = ['-lookup_date', '-id']
+        indexes = [
+            # keyset pagination walks this index, see history.get_history_page
+            models.Index(fields=['-lookup_date', '-id'], name='history_recent_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 class PlaylistVideo(models.Model):
+    # YouTube's list ID, not the URL the playlist was opened with
     playlist_id = models.CharField(max_length=100)
     title = models.CharField(max_length=255)
     url = models.URLField()
@@ -22,6 +29,82 @@ class PlaylistVideo(models.Model):
 
     class Meta:
         ordering = ['position']
+        # also the index for playlist_id lookups
+        unique_together = ['playlist_id', 'position']
 
     def __str__(self):
-        return f"{self.position}. {self.title}"
\ No newline at end of file
+        return f"{self.position}. {self.title}"
+
+class VideoInfoCache(models.Model):
+    video_id = models.CharField(max_length=64, unique=True)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.video_id
+
+class CachedDownload(models.Model):
+    video_id = models.CharField(max_length=64)
+    video_format_id = models.CharField(max_length=50)
+    audio_format_id = models.CharField(max_length=50, blank=True, default='')
+    container = models.CharField(max_length=10)
+    file_path = models.CharField(max_length=500)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_served = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ['video_id', 'video_format_id', 'audio_format_id', 'container']
+
+    def __str__(self):
+        return self.filename
+
+class DownloadJob(models.Model):
+    # the scheduler's job ID: utils.make_download_id of a video, utils.make_playlist_job_id of a playlist
+    job_id = models.CharField(max_length=200, unique=True)
+    kind = models.CharField(max_length=10)
+    url = models.URLField(max_length=500, blank=True, default='')
+    video_format_id = models.CharField(max_length=50, blank=True, default='')
+    audio_format_id = models.CharField(max_length=50, blank=True, default='')
+    format_type = models.CharField(max_length=10, blank=True, default='')
+    audio_output = models.JSONField(null=True, blank=True)
+    priority = models.IntegerField(default=0)
+    state = models.CharField(max_length=10, default='queued')
+    stage = models.CharField(max_length=20, blank=True, default='')
+    workspace = models.CharField(max_length=500, blank=True, default='')
+    # .part files in the workspace and their size at the last heartbeat
+    partial_files = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    # host:pid:nonce of the process running the job
+    owner = models.CharField(max_length=150, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # refreshed by the process running the job, a stale one means the process is gone
+    heartbeat_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # what the resume loop looks for, see jobs.JobJournal.resume_stale
+            models.Index(fields=['state', 'heartbeat_at'], name='job_resume_idx'),
+        ]
+
+    def __str__(self):
+        return self.job_id
+
+class DownloadJobItem(models.Model):
+    job = models.ForeignKey(DownloadJob, on_delete=models.CASCADE, related_name='items')
+    position = models.IntegerField()
+    url = models.URLField(max_length=500)
+    state = models.CharField(max_length=10, default='pending')
+    file_path = models.CharField(max_length=500, blank=True, default='')
+
+    class Meta:
+        ordering = ['position']
+        unique_together = ['job', 'position']
+
+    def __str__(self):
+        return f"{self.job_id} {self.position}"
@@ -0,0 +1,116 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import utils
+from .cache import video_info_cache
+from .progress import progress_store
+
+PLAYLIST_PREFETCH = getattr(settings, 'PLAYLIST_PREFETCH', True)
+PLAYLIST_PREFETCH_WORKERS = getattr(settings, 'PLAYLIST_PREFETCH_WORKERS', 2)
+
+
+class FormatPrefetcher:
+    """
+    Warms the metadata cache for the videos of a listed playlist.
+
+    Extractions run on a small pool shared by all playlists, so prefetching
+    never takes more than max_workers yt-dlp extractions at a time however
+    many playlists are open. A playlist's pending extractions are dropped
+    when it is cancelled, which is tracked in the progress store so a
+    cancel reaching any worker process stops the prefetch.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._futures = {}
+        # a future that's already done runs its callback, which takes the lock, right away
+        self._lock = threading.RLock()
+
+    def submit(self, playlist_id: str, urls: list) -> int:
+        """
+        Queue the extraction of the videos not cached yet.
+
+        Args:
+            playlist_id (str): Playlist the videos are listed in
+            urls (list): Video URLs, in the order they should be fetched
+
+        Returns:
+            int: Number of extractions queued
+        """
+        progress_store.set(self._job_id(playlist_id), {'status': 'running'})
+        cached = video_info_cache.peek_many([utils.get_video_id(url) for url in urls])
+        urls = [url for url in urls if utils.get_video_id(url) not in cached]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='format-prefetch'
+                )
+            futures = self._futures.setdefault(playlist_id, set())
+            for url in urls:
+                future = self._executor.submit(self._prefetch, playlist_id, url)
+                futures.add(future)
+                future.add_done_callback(lambda future, playlist_id=playlist_id: self._forget(playlist_id, future))
+        return len(urls)
+
+    def cancel(self, playlist_id: str):
+        """Drop the extractions still waiting for a playlist"""
+        progress_store.set(self._job_id(playlist_id), {'status': 'cancelled'})
+        with self._lock:
+            futures = self._futures.pop(playlist_id, set())
+        for future in futures:
+            future.cancel()
+
+    def is_cancelled(self, playlist_id: str) -> bool:
+        state = progress_store.get(self._job_id(playlist_id))
+        return state is not None and state['status'] == 'cancelled'
+
+    def _prefetch(self, playlist_id, url):
+        # another process may have cancelled it since it was queued
+        if self.is_cancelled(playlist_id):
+            return
+        try:
+            utils.get_video_info_dict(url)
+        except Exception:
+            print(f"Prefetching formats of {url} failed: \n{traceback.format_exc()}")
+
+    def _forget(self, playlist_id, future):
+        with self._lock:
+            futures = self._futures.get(playlist_id)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._futures[playlist_id]
+
+    def _job_id(self, playlist_id):
+        return f"prefetch_{playlist_id}"
+
+
+def get_resolutions(urls: list) -> dict:
+    """
+    Video resolutions available for the videos whose formats are cached.
+
+    Args:
+        urls (list): YouTube video URLs
+
+    Returns:
+        dict: Resolutions like '1920x1080', best first, by URL; videos not fetched yet are left out
+    """
+    video_ids = {url: utils.get_video_id(url) for url in urls}
+    entries = video_info_cache.peek_many(list(set(video_ids.values())))
+    resolutions = {}
+    for url, video_id in video_ids.items():
+        if video_id not in entries:
+            continue
+        resolutions[url] = []
+        for format in reversed(entries[video_id]['video_details']['formats']):
+            if format['type'] == 'video' and format['resolution'] not in resolutions[url]:
+                resolutions[url].append(format['resolution'])
+    return resolutions
+
+
+format_prefetcher = FormatPrefetcher(max_workers=PLAYLIST_PREFETCH_WORKERS)
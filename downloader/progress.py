@@ -0,0 +1,383 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from collections import deque
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# a job in one of these states won't change anymore and expires after PROGRESS_TTL
+FINAL_STATUSES = {'finished', 'completed', 'failed', 'error'}
+
+
+class ProgressStore(ABC):
+    """
+    Progress and job state of downloads, shared by every part of the app.
+
+    Entries are plain JSON serializable dicts keyed by job ID (a download ID
+    or a playlist ID). Finished jobs are dropped ttl seconds after their last
+    update, and jobs that stopped updating without finishing (a killed worker)
+    after stale_ttl seconds.
+    """
+
+    def __init__(self, ttl: int = 3600, stale_ttl: int = 24 * 3600):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    @abstractmethod
+    def get(self, job_id: str) -> dict:
+        """
+        Current state of a job.
+
+        Returns:
+            dict: A copy of the entry, or None if the job is unknown
+        """
+
+    @abstractmethod
+    def set(self, job_id: str, data: dict):
+        """Create or replace the entry of a job"""
+
+    @abstractmethod
+    def add(self, job_id: str, data: dict) -> bool:
+        """
+        Create the entry of a job unless a live one already exists.
+
+        Atomic across every process sharing the store, which makes it usable
+        to elect the one request that actually starts a job.
+
+        Returns:
+            bool: True if the entry was created
+        """
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> bool:
+        """
+        Merge fields into an existing entry.
+
+        Returns:
+            bool: False if the job is unknown, in which case nothing is stored
+        """
+
+    @abstractmethod
+    def delete(self, job_id: str):
+        """Forget a job"""
+
+    @abstractmethod
+    def expire(self):
+        """Drop entries that are past their TTL"""
+
+    def _lifetime(self, data: dict) -> int:
+        return self.ttl if data.get('status') in FINAL_STATUSES else self.stale_ttl
+
+
+class MemoryProgressStore(ProgressStore):
+    """Per-process store, only correct with a single worker process (e.g. runserver)"""
+
+    def __init__(self, ttl: int = 3600, stale_ttl: int = 24 * 3600):
+        super().__init__(ttl, stale_ttl)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._last_expire = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            item = self._entries.get(job_id)
+            if item is None or item[0] < time.time():
+                return None
+            return json.loads(json.dumps(item[1]))
+
+    def set(self, job_id, data):
+        with self._lock:
+            data = json.loads(json.dumps(data))
+            self._entries[job_id] = (time.time() + self._lifetime(data), data)
+        self._maybe_expire()
+
+    def add(self, job_id, data):
+        with self._lock:
+            item = self._entries.get(job_id)
+            if item is not None and item[0] >= time.time():
+                return False
+            data = json.loads(json.dumps(data))
+            self._entries[job_id] = (time.time() + self._lifetime(data), data)
+        return True
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            item = self._entries.get(job_id)
+            # an expired entry is gone, as it would be in the other stores
+            if item is None or item[0] < time.time():
+                return False
+            data = item[1]
+            data.update(json.loads(json.dumps(fields)))
+            self._entries[job_id] = (time.time() + self._lifetime(data), data)
+        return True
+
+    def delete(self, job_id):
+        with self._lock:
+            self._entries.pop(job_id, None)
+
+    def expire(self):
+        now = time.time()
+        with self._lock:
+            for job_id in [job_id for job_id, item in self._entries.items() if item[0] < now]:
+                del self._entries[job_id]
+            self._last_expire = now
+
+    def _maybe_expire(self):
+        if time.time() - self._last_expire > 60:
+            self.expire()
+
+
+class SQLiteProgressStore(ProgressStore):
+    """
+    Store in a SQLite database in WAL mode, shared by all worker processes on a host.
+
+    It is a separate file from the Django database so that the frequent
+    progress writes never contend with the app's own queries.
+    """
+
+    def __init__(self, path: str, ttl: int = 3600, stale_ttl: int = 24 * 3600):
+        super().__init__(ttl, stale_ttl)
+        self.path = path
+        self._local = threading.local()
+        self._last_expire = time.time()
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS progress ('
+                'job_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            db.execute('CREATE INDEX IF NOT EXISTS progress_expires_at ON progress (expires_at)')
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            'SELECT data FROM progress WHERE job_id = ? AND expires_at >= ?',
+            (job_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, job_id, data):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO progress (job_id, data, expires_at) VALUES (?, ?, ?)',
+            (job_id, json.dumps(data), time.time() + self._lifetime(data))
+        )
+        self._maybe_expire()
+
+    def add(self, job_id, data):
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('DELETE FROM progress WHERE job_id = ? AND expires_at < ?', (job_id, time.time()))
+            cursor = db.execute(
+                'INSERT OR IGNORE INTO progress (job_id, data, expires_at) VALUES (?, ?, ?)',
+                (job_id, json.dumps(data), time.time() + self._lifetime(data))
+            )
+            db.execute('COMMIT')
+            return cursor.rowcount == 1
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def update(self, job_id, **fields):
+        db = self._connect()
+        # IMMEDIATE takes the write lock up front so concurrent updates can't interleave
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                'SELECT data FROM progress WHERE job_id = ? AND expires_at >= ?',
+                (job_id, time.time())
+            ).fetchone()
+            if row is None:
+                db.execute('ROLLBACK')
+                return False
+            data = json.loads(row[0])
+            data.update(fields)
+            db.execute(
+                'UPDATE progress SET data = ?, expires_at = ? WHERE job_id = ?',
+                (json.dumps(data), time.time() + self._lifetime(data), job_id)
+            )
+            db.execute('COMMIT')
+            return True
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def delete(self, job_id):
+        self._connect().execute('DELETE FROM progress WHERE job_id = ?', (job_id,))
+
+    def expire(self):
+        self._connect().execute('DELETE FROM progress WHERE expires_at < ?', (time.time(),))
+        self._last_expire = time.time()
+
+    def _maybe_expire(self):
+        if time.time() - self._last_expire > 60:
+            try:
+                self.expire()
+            except sqlite3.OperationalError:
+                # another process holds the lock, it'll be done next time
+                pass
+
+
+class RedisProgressStore(ProgressStore):
+    """
+    Store in Redis, or any server speaking its protocol (Valkey, KeyDB, a local
+    stand-in), for multiple hosts. Expiry is left to the server.
+    """
+
+    def __init__(self, url: str, ttl: int = 3600, stale_ttl: int = 24 * 3600, prefix: str = 'progress:'):
+        super().__init__(ttl, stale_ttl)
+        try:
+            import redis
+        except ImportError as e:
+            raise ImproperlyConfigured("PROGRESS_BACKEND 'redis' needs the redis package (pip install redis)") from e
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, job_id):
+        raw = self.client.get(self.prefix + job_id)
+        return json.loads(raw) if raw else None
+
+    def set(self, job_id, data):
+        self.client.set(self.prefix + job_id, json.dumps(data), ex=self._lifetime(data))
+
+    def add(self, job_id, data):
+        return bool(self.client.set(self.prefix + job_id, json.dumps(data), ex=self._lifetime(data), nx=True))
+
+    def update(self, job_id, **fields):
+        key = self.prefix + job_id
+        updated = []
+
+        def apply(pipe):
+            raw = pipe.get(key)
+            if not raw:
+                return
+            data = json.loads(raw)
+            data.update(fields)
+            pipe.multi()
+            pipe.set(key, json.dumps(data), ex=self._lifetime(data))
+            updated.append(True)
+
+        self.client.transaction(apply, key)
+        return bool(updated)
+
+    def delete(self, job_id):
+        self.client.delete(self.prefix + job_id)
+
+    def expire(self):
+        pass
+
+
+class ProgressReporter:
+    """
+    Coalesces the progress updates of one job before they reach the store.
+
+    yt-dlp calls its progress hook for every chunk it downloads; report()
+    publishes at most max_rate times per second, with speed and ETA smoothed
+    over the last few seconds. Stage transitions and final states go through
+    publish(), which is never throttled.
+    """
+
+    def __init__(self, job_id: str, max_rate: float = None, window: float = 5.0, store: ProgressStore = None):
+        self.job_id = job_id
+        self.store = store or progress_store
+        self.interval = 1.0 / (max_rate or PROGRESS_PUBLISH_RATE)
+        self.window = window
+        self._samples = deque()
+        self._last_publish = 0.0
+        self._lock = threading.Lock()
+
+    def report(self, downloaded: int, total: int, scale: float = 100, **fields) -> bool:
+        """
+        Record the bytes done so far, publishing if the rate limit allows.
+
+        Args:
+            downloaded (int): Bytes downloaded
+            total (int): Expected total bytes, 0 if unknown
+            scale (float): Percentage the job reaches once total bytes are downloaded
+            **fields: Extra fields to publish along
+
+        Returns:
+            bool: True if the update was published
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, downloaded))
+            while len(self._samples) > 2 and now - self._samples[0][0] > self.window:
+                self._samples.popleft()
+            if now - self._last_publish < self.interval:
+                return False
+            self._last_publish = now
+            speed = self._speed()
+
+        fields.update({
+            'status': fields.get('status', 'downloading'),
+            'progress': min(downloaded / total, 1) * scale if total else 0,
+            'speed': speed,
+            'eta': int((total - downloaded) / speed) if speed and total > downloaded else 0,
+        })
+        self._write(fields)
+        return True
+
+    def publish(self, **fields):
+        """Publish a stage transition or final state right away"""
+        with self._lock:
+            self._last_publish = time.monotonic()
+        self._write(fields)
+
+    def _speed(self) -> float:
+        # caller holds self._lock, bytes per second over the sample window
+        if len(self._samples) < 2:
+            return 0
+        (start, start_bytes), (end, end_bytes) = self._samples[0], self._samples[-1]
+        if end <= start:
+            return 0
+        return max(end_bytes - start_bytes, 0) / (end - start)
+
+    def _write(self, fields):
+        # a failing store must not abort the download the hook is called from
+        try:
+            self.store.update(self.job_id, **fields)
+        except Exception:
+            print(f"Progress update for {self.job_id} failed: \n{traceback.format_exc()}")
+
+
+def get_progress_store() -> ProgressStore:
+    """
+    Progress store configured by PROGRESS_BACKEND.
+
+    Returns:
+        ProgressStore: 'memory', 'sqlite' or 'redis' backend
+
+    Raises:
+        ImproperlyConfigured: If the backend is unknown or can't be set up; falling back
+            to memory would quietly lose the progress of every other worker
+    """
+    backend = getattr(settings, 'PROGRESS_BACKEND', 'memory')
+    ttl = getattr(settings, 'PROGRESS_TTL', 3600)
+    if backend == 'memory':
+        return MemoryProgressStore(ttl)
+    if backend == 'sqlite':
+        path = getattr(settings, 'PROGRESS_SQLITE_PATH', os.path.join(settings.BASE_DIR, 'progress.sqlite3'))
+        return SQLiteProgressStore(str(path), ttl)
+    if backend == 'redis':
+        return RedisProgressStore(getattr(settings, 'PROGRESS_REDIS_URL', 'redis://localhost:6379/0'), ttl)
+    raise ImproperlyConfigured(f"Unknown PROGRESS_BACKEND {backend!r}, expected 'memory', 'sqlite' or 'redis'")
+
+
+progress_store = get_progress_store()
+
+PROGRESS_PUBLISH_RATE = getattr(settings, 'PROGRESS_PUBLISH_RATE', 2)
@@ -0,0 +1,196 @@
+import heapq
+import itertools
+import os
+import threading
+import traceback
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import JOBS
+from .workspace import workspaces
+
+# lower runs first
+PRIORITY_VIDEO = 0
+PRIORITY_PLAYLIST = 10
+
+
+class QueueFull(Exception):
+    """Raised when the scheduler is at capacity and can't accept another job"""
+
+
+class JobScheduler:
+    """
+    Bounded in-process job scheduler.
+
+    Jobs wait in a priority queue (FIFO within the same priority) and are run
+    by a fixed pool of worker threads. On top of that, network-bound and
+    CPU-bound stages each have their own slot limit, so a burst of requests
+    can't start more yt-dlp downloads or ffmpeg merges than the box can handle.
+
+    When admit is given, queued jobs only start while it returns True, e.g.
+    while there is scratch disk left; until then they stay queued and new
+    submissions run into max_queued.
+    """
+
+    def __init__(self, workers: int = 4, download_slots: int = 3, merge_slots: int = 2, max_queued: int = 100,
+                 admit=None):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.admit = admit
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._running = set()
+        self._threads = []
+        self._download_slots = threading.BoundedSemaphore(download_slots)
+        self._merge_slots = threading.BoundedSemaphore(merge_slots)
+
+    def submit(self, job_id: str, func, *args, priority: int = PRIORITY_VIDEO, **kwargs) -> int:
+        """
+        Queue a job.
+
+        Args:
+            job_id (str): ID used to report the queue position
+            func (callable): Called with *args and **kwargs on a worker thread
+            priority (int): PRIORITY_VIDEO or PRIORITY_PLAYLIST, lower runs first
+
+        Returns:
+            int: Position in the queue, 1 being the next job to run
+
+        Raises:
+            QueueFull: If max_queued jobs are already waiting
+        """
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                raise QueueFull(f"{len(self._queue)} jobs already queued")
+            heapq.heappush(self._queue, (priority, next(self._counter), job_id, func, args, kwargs))
+            self._publish_metrics()
+            self._start_workers()
+            self._cond.notify()
+            return self._position(job_id)
+
+    def reserve(self, job_id: str):
+        """
+        Account for a job that runs on the caller's thread, e.g. a response streamed while it downloads.
+
+        Such a job can't wait in the queue, it starts now or not at all: it's
+        turned down while max_queued jobs are waiting or admit refuses, and
+        otherwise counts as running until release(). Its downloads and merges
+        still take the download and merge slots like every other job's.
+
+        Args:
+            job_id (str): ID to release the job with, unique among running jobs
+
+        Raises:
+            QueueFull: If the scheduler can't take another job right now
+        """
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                raise QueueFull(f"{len(self._queue)} jobs already queued")
+            if not self._admitted():
+                raise QueueFull('No room for another job')
+            self._running.add(job_id)
+            self._publish_metrics()
+
+    def release(self, job_id: str):
+        """End a job started with reserve()"""
+        with self._cond:
+            self._running.discard(job_id)
+            self._publish_metrics()
+
+    def position(self, job_id: str) -> int:
+        """
+        Position of a job in the queue.
+
+        Args:
+            job_id (str): ID the job was submitted with
+
+        Returns:
+            int: 0 if the job is running, its 1-based queue position if waiting, None if unknown
+        """
+        with self._cond:
+            return self._position(job_id)
+
+    def stats(self) -> dict:
+        """Number of queued and running jobs"""
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'running': len(self._running),
+                'workers': self.workers,
+            }
+
+    @contextmanager
+    def download_slot(self):
+        """Hold one of the network-bound download slots"""
+        with self._download_slots:
+            yield
+
+    @contextmanager
+    def merge_slot(self):
+        """Hold one of the CPU-bound merge slots"""
+        with self._merge_slots:
+            yield
+
+    def _position(self, job_id):
+        # caller holds self._cond
+        if job_id in self._running:
+            return 0
+        for idx, item in enumerate(sorted(self._queue, key=lambda item: item[:2]), 1):
+            if item[2] == job_id:
+                return idx
+        return None
+
+    def _admitted(self):
+        # caller holds self._cond
+        if self.admit is None:
+            return True
+        try:
+            return self.admit()
+        except Exception:
+            print(f"Job admission check failed: \n{traceback.format_exc()}")
+            return True
+
+    def _publish_metrics(self):
+        # caller holds self._cond
+        JOBS.set(len(self._queue), state='queued')
+        JOBS.set(len(self._running), state='running')
+
+    def _start_workers(self):
+        # caller holds self._cond, threads are only started once there is work
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._worker,
+                name=f"download-worker-{len(self._threads)}",
+                daemon=True
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue or not self._admitted():
+                    # re-checked periodically, nothing notifies when disk space frees up
+                    self._cond.wait(None if not self._queue else 1)
+                _, _, job_id, func, args, kwargs = heapq.heappop(self._queue)
+                self._running.add(job_id)
+                self._publish_metrics()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                print(f"Job {job_id} failed: \n{traceback.format_exc()}")
+            finally:
+                with self._cond:
+                    self._running.discard(job_id)
+                    self._publish_metrics()
+
+
+job_scheduler = JobScheduler(
+    workers=getattr(settings, 'DOWNLOAD_WORKERS', 4),
+    download_slots=getattr(settings, 'DOWNLOAD_SLOTS', 3),
+    merge_slots=getattr(settings, 'MERGE_SLOTS', os.cpu_count() or 2),
+    max_queued=getattr(settings, 'DOWNLOAD_QUEUE_MAX', 100),
+    admit=workspaces.has_room,
+)
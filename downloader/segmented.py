@@ -0,0 +1,312 @@
+import http.client
+import json
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+from urllib.parse import urljoin, urlsplit
+
+from yt_dlp.utils import DownloadError
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# bytes read from a response at a time, each read is reported to the progress hooks
+READ_SIZE = 256 * 1024
+# bytes of a range written between two entries in the ranges file
+CHECKPOINT_SIZE = 1024 * 1024
+
+
+class RangeNotSupported(Exception):
+    """Raised when the server doesn't answer Range requests, the stream is then left to yt-dlp"""
+
+
+def can_segment(format: dict, connections: int, segment_size: int) -> bool:
+    """
+    Whether a format is worth fetching in byte ranges over several connections.
+
+    Only plain HTTP(S) streams of a known size qualify: fragmented (DASH
+    manifest, HLS) formats are already fetched a fragment at a time by
+    yt-dlp, and a size is needed to split on.
+
+    Args:
+        format (dict): yt-dlp format
+        connections (int): Connections the stream would be fetched over
+        segment_size (int): Bytes per range
+
+    Returns:
+        bool: True if the stream is big enough to be split in at least two ranges
+    """
+    size = format.get('filesize') or format.get('filesize_approx') or 0
+    return (
+        connections > 1
+        and format.get('protocol') in ('http', 'https')
+        and bool(format.get('url'))
+        and not format.get('fragments')
+        and size >= segment_size * 2
+    )
+
+
+class SegmentedDownload:
+    """
+    Fetch one stream in byte ranges over several keep-alive connections.
+
+    The file is preallocated at its full size and every range is written at
+    its offset with positional writes, so connections never wait on each
+    other. Each worker thread keeps its connection open and takes the next
+    range from a shared queue until there is none left; a range that fails
+    is retried on its own from the last byte written, on a fresh connection.
+
+    How far each range got is appended to path + '.ranges.part' next to
+    the .part file (every CHECKPOINT_SIZE bytes and when it's done), so a
+    download that failed or whose process died continues where each range
+    left off when it's run again on the same path.
+
+    Progress goes to yt-dlp style progress hooks ({'status', 'downloaded_bytes',
+    'total_bytes', 'filename', ...}), serialized, so hooks that pace the
+    download (see transport.Flow) hold back every connection.
+
+    Args:
+        url (str): Stream URL
+        headers (dict): Request headers, e.g. the format's http_headers
+        connections (int): Number of connections
+        segment_size (int): Bytes per range
+        retries (int): Attempts per range after the first one
+        progress_hooks (list): yt-dlp progress hooks
+        timeout (float): Socket timeout in seconds
+    """
+
+    def __init__(self, url: str, headers: dict = None, connections: int = 4, segment_size: int = 4 * 1024 * 1024,
+                 retries: int = 3, progress_hooks: list = None, timeout: float = 20):
+        self.url = url
+        self.headers = {key: value for key, value in (headers or {}).items() if key.lower() != 'range'}
+        self.connections = max(1, connections)
+        self.segment_size = max(READ_SIZE, segment_size)
+        self.retries = retries
+        self.progress_hooks = progress_hooks or []
+        self.timeout = timeout
+        self.total = None
+        self.downloaded = 0
+        # bytes an earlier run left behind, they don't count towards the speed
+        self.restored = 0
+        self._started = None
+        self._lock = threading.Lock()
+        self._hook_lock = threading.Lock()
+        self._failed = threading.Event()
+
+    def download(self, path: str, info_dict: dict = None) -> str:
+        """
+        Download the stream to path, through path + '.part'.
+
+        Args:
+            path (str): Final path of the file
+            info_dict (dict): Passed to the progress hooks like yt-dlp does
+
+        Returns:
+            str: path
+
+        Raises:
+            RangeNotSupported: If the server ignores Range requests, nothing has been written then
+            DownloadError: If a range still failed after its retries, the finished ones are kept
+        """
+        self._started = time.monotonic()
+        part_path = f"{path}.part"
+        ranges_path = f"{path}.ranges.part"
+        if os.path.exists(path) and not os.path.exists(part_path):
+            # finished by an earlier run
+            self.total = self.downloaded = self.restored = os.path.getsize(path)
+            self._report(path, info_dict, status='finished')
+            return path
+
+        self.total = self._probe()
+        written = self._load_ranges(part_path, ranges_path)
+        segments = queue.SimpleQueue()
+        for start in range(0, self.total, self.segment_size):
+            end = min(start + self.segment_size, self.total) - 1
+            offset = written.get(start, start)
+            self.downloaded += offset - start
+            if offset <= end:
+                segments.put((start, offset, end))
+        self.restored = self.downloaded
+        errors = []
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT | (0 if written else os.O_TRUNC), 0o644)
+        try:
+            if not written:
+                _preallocate(fd, self.total)
+                with open(ranges_path, 'w') as file:
+                    file.write(json.dumps({'total': self.total, 'segment_size': self.segment_size}) + '\n')
+            workers = [
+                threading.Thread(
+                    target=self._worker,
+                    args=(fd, segments, errors, path, info_dict),
+                    name=f"segment-{index}",
+                    daemon=True
+                )
+                for index in range(min(self.connections, segments.qsize()))
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            os.close(fd)
+        if errors:
+            raise DownloadError(f"Segmented download of {path} failed: {errors[0]}")
+
+        os.replace(part_path, path)
+        _remove(ranges_path)
+        self._report(path, info_dict, status='finished')
+        return path
+
+    def _load_ranges(self, part_path, ranges_path):
+        # where each range of an earlier run got to, if it was the same file split the same way
+        written = {}
+        try:
+            with open(ranges_path) as file:
+                header = json.loads(file.readline())
+                for line in file:
+                    fields = line.split()
+                    # a line cut short by a crash doesn't count
+                    if line.endswith('\n') and len(fields) == 2 and all(field.isdigit() for field in fields):
+                        start, offset = map(int, fields)
+                        written[start] = max(written.get(start, start), offset)
+        except (OSError, ValueError):
+            return {}
+        if header != {'total': self.total, 'segment_size': self.segment_size} \
+                or not os.path.exists(part_path) or os.path.getsize(part_path) != self.total:
+            return {}
+        return written
+
+    def _checkpoint(self, path, start, offset):
+        with self._lock, open(f"{path}.ranges.part", 'a') as file:
+            file.write(f"{start} {offset}\n")
+
+    def _probe(self):
+        # one byte range request, tells whether ranges work and the real size, and follows redirects
+        for _ in range(5):
+            connection, target = self._connect(self.url)
+            try:
+                connection.request('GET', target, headers={**self.headers, 'Range': 'bytes=0-0'})
+                response = connection.getresponse()
+                if response.status in REDIRECT_STATUSES and response.getheader('Location'):
+                    self.url = urljoin(self.url, response.getheader('Location'))
+                    continue
+                if response.status == 200:
+                    raise RangeNotSupported(f"{urlsplit(self.url).netloc} ignored the Range header")
+                if response.status != 206:
+                    raise DownloadError(f"HTTP Error {response.status}: {response.reason}")
+                match = CONTENT_RANGE_PATTERN.fullmatch(response.getheader('Content-Range') or '')
+                if not match:
+                    raise RangeNotSupported(f"Unexpected Content-Range {response.getheader('Content-Range')}")
+                response.read()
+                return int(match[3])
+            except (OSError, http.client.HTTPException) as e:
+                raise DownloadError(f"Probing {urlsplit(self.url).netloc} failed: {e}") from e
+            finally:
+                connection.close()
+        raise DownloadError('Too many redirects')
+
+    def _connect(self, url):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        target = parts.path or '/'
+        if parts.query:
+            target = f"{target}?{parts.query}"
+        return connection_class(parts.netloc, timeout=self.timeout), target
+
+    def _worker(self, fd, segments, errors, path, info_dict):
+        connection, target = self._connect(self.url)
+        try:
+            while not self._failed.is_set():
+                try:
+                    start, offset, end = segments.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    connection = self._fetch_segment(connection, target, fd, start, offset, end, path, info_dict)
+                except Exception as e:
+                    print(f"Segment {start}-{end} failed: \n{traceback.format_exc()}")
+                    errors.append(e)
+                    # no point fetching the rest of a file that can't be completed
+                    self._failed.set()
+                    return
+        finally:
+            connection.close()
+
+    def _fetch_segment(self, connection, target, fd, start, offset, end, path, info_dict):
+        checkpoint = offset
+        for attempt in range(self.retries + 1):
+            try:
+                connection.request('GET', target, headers={**self.headers, 'Range': f'bytes={offset}-{end}'})
+                response = connection.getresponse()
+                match = CONTENT_RANGE_PATTERN.fullmatch(response.getheader('Content-Range') or '')
+                if response.status != 206 or not match or int(match[1]) != offset:
+                    response.read()
+                    raise DownloadError(f"HTTP Error {response.status}: {response.reason} for bytes {offset}-{end}")
+                while offset <= end:
+                    data = response.read(min(READ_SIZE, end - offset + 1))
+                    if not data:
+                        break
+                    os.pwrite(fd, data, offset)
+                    offset += len(data)
+                    self._add_progress(len(data), path, info_dict)
+                    if offset - checkpoint >= CHECKPOINT_SIZE and offset <= end:
+                        self._checkpoint(path, start, offset)
+                        checkpoint = offset
+                if offset > end:
+                    self._checkpoint(path, start, offset)
+                    return connection
+                raise http.client.IncompleteRead(b'', end - offset + 1)
+            except (OSError, http.client.HTTPException, DownloadError):
+                if attempt == self.retries or self._failed.is_set():
+                    raise
+                # the connection may be half way through a response, start over on a new one
+                connection.close()
+                connection, target = self._connect(self.url)
+                time.sleep(min(0.5 * 2 ** attempt, 5))
+        return connection
+
+    def _add_progress(self, amount, path, info_dict):
+        with self._lock:
+            self.downloaded += amount
+        self._report(path, info_dict, status='downloading')
+
+    def _report(self, path, info_dict, status):
+        with self._hook_lock:
+            elapsed = time.monotonic() - self._started
+            downloaded = self.downloaded
+            speed = (downloaded - self.restored) / elapsed if elapsed > 0 else None
+            d = {
+                'status': status,
+                'filename': path,
+                'tmpfilename': f"{path}.part",
+                'downloaded_bytes': downloaded,
+                'total_bytes': self.total,
+                'elapsed': elapsed,
+                'speed': speed,
+                'eta': (self.total - downloaded) / speed if speed else None,
+                'info_dict': info_dict,
+            }
+            for hook in self.progress_hooks:
+                hook(d)
+
+
+def _preallocate(fd, size):
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            # not supported by every filesystem
+            pass
+    os.ftruncate(fd, size)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
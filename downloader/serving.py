@@ -0,0 +1,188 @@
+import mimetypes
+import os
+import re
+import time
+
+from django.conf import settings
+from django.http import FileResponse, HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_etags, parse_http_date_safe
+
+from .metrics import SERVED_BYTES, STAGE_SECONDS
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# None serves files from Django, 'x-accel-redirect' (nginx) or 'x-sendfile'
+# (apache, lighttpd) hands them to the fronting web server instead
+FILE_SERVING_OFFLOAD = getattr(settings, 'FILE_SERVING_OFFLOAD', None)
+# nginx internal location that maps to BASE_DIR
+X_ACCEL_REDIRECT_PREFIX = getattr(settings, 'X_ACCEL_REDIRECT_PREFIX', '/protected/')
+
+
+def _parse_range(header: str, size: int):
+    """
+    Parse a single range Range header.
+
+    Returns:
+        tuple: (start, end) inclusive, None to serve the whole file, or False if unsatisfiable
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        # multiple ranges or garbage, serving the whole file is allowed
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # suffix range, the last N bytes
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _range_allowed(request: HttpRequest, etag: str, mtime: int) -> bool:
+    """If-Range: only honour the Range header if the client's copy is still current"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def _iter_file_range(path: str, start: int, length: int, chunk_size: int = 64 * 1024):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+class ClosingContent:
+    """
+    Content of a streaming response that calls on_close once the response is closed.
+
+    Django closes the iterator or file a streaming response was built from
+    when the server closes the response, i.e. once the body has been sent or
+    the client went away, whether or not iterating it ever started. Every
+    attribute but close() is the wrapped object's, so a wrapped file still
+    goes to FileResponse (and the server's sendfile) as a file.
+
+    Args:
+        content: Iterable or file object
+        on_close (callable): Called without arguments, once
+    """
+
+    def __init__(self, content, on_close):
+        self._content = content
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._content)
+
+    def __getattr__(self, name):
+        return getattr(self._content, name)
+
+    def close(self):
+        try:
+            if hasattr(self._content, 'close'):
+                self._content.close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
+def _track_transfer(content, kind: str, length: int) -> ClosingContent:
+    """Count a transfer in the metrics, timing it until the server closes the response"""
+    started = time.perf_counter()
+    SERVED_BYTES.inc(length, kind=kind)
+    return ClosingContent(
+        content,
+        lambda: STAGE_SECONDS.observe(time.perf_counter() - started, stage='serve')
+    )
+
+
+def serve_file(request: HttpRequest, path: str, filename: str) -> HttpResponse:
+    """
+    Serve a file as an attachment with Range and conditional request support.
+
+    Handles ETag/If-None-Match (304), Range/If-Range (206 or 416) and, when
+    FILE_SERVING_OFFLOAD is set, leaves the actual transfer to the web server
+    in front of Django so the worker is freed immediately.
+
+    Args:
+        request (HttpRequest): Incoming request
+        path (str): File to serve
+        filename (str): Name the browser saves the file under
+
+    Returns:
+        HttpResponse: 200, 206, 304 or 416 response
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    if FILE_SERVING_OFFLOAD:
+        # the web server handles ranges and conditionals itself
+        response = HttpResponse(content_type=content_type)
+        if FILE_SERVING_OFFLOAD == 'x-accel-redirect':
+            relative_path = os.path.relpath(path, settings.BASE_DIR).replace(os.sep, '/')
+            response['X-Accel-Redirect'] = X_ACCEL_REDIRECT_PREFIX + relative_path
+        else:
+            response['X-Sendfile'] = os.path.abspath(path)
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        response['ETag'] = etag
+        # the transfer is the web server's, only its size is ours to count
+        SERVED_BYTES.inc(size, kind='offload')
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and _range_allowed(request, etag, stat.st_mtime):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range and byte_range != (0, size - 1):
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _track_transfer(_iter_file_range(path, start, end - start + 1), 'file', end - start + 1),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    else:
+        # FileResponse lets the WSGI server use sendfile when it can
+        response = FileResponse(
+            _track_transfer(open(path, 'rb'), 'file', size),
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type
+        )
+        response['Content-Length'] = size
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    return response
@@ -0,0 +1,68 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function, callers arriving while it
+    runs wait for it and get the same result (or exception) instead of
+    starting their own. Nothing is remembered once the call returns, that is
+    left to the caches.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs), or wait for the run already in flight for key.
+
+        Args:
+            key (str): Identity of the operation
+            func (callable): Called on the current thread if no call for key is in flight
+
+        Returns:
+            Whatever func returned, shared by all callers
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key: str = None) -> bool:
+        """Whether a call for key, or any call if key is None, is running"""
+        with self._lock:
+            return key in self._calls if key is not None else bool(self._calls)
+
+
+# one yt-dlp extraction per video at a time
+extraction_flight = SingleFlight()
+# one download and merge per (video, formats) at a time
+download_flight = SingleFlight()
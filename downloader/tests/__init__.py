@@ -0,0 +1,4 @@
+from ..metrics import REGISTRY, MemoryMetricsStore
+
+# keep test samples out of the host's metrics
+REGISTRY.store = MemoryMetricsStore()
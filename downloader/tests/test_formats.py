@@ -0,0 +1,67 @@
+from django.test import SimpleTestCase
+
+from ..formats import FormatIndex, select_format
+
+MB = 1024 * 1024
+INFO = {
+    'duration': 100,
+    'formats': [
+        {'format_id': 'sb0', 'ext': 'mhtml', 'vcodec': 'none', 'acodec': 'none'},
+        {'format_id': '139', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.5', 'abr': 48, 'filesize': 4 * MB},
+        {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'filesize': 12 * MB},
+        {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 160, 'filesize': 14 * MB},
+        {'format_id': '136', 'ext': 'mp4', 'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': 720,
+         'filesize': 20 * MB},
+        {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080,
+         'filesize': 40 * MB},
+        {'format_id': '248', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none', 'height': 1080,
+         'filesize': 35 * MB},
+    ],
+}
+
+
+class SelectFormatTests(SimpleTestCase):
+    def select(self, **rule):
+        selection = select_format(INFO, rule)
+        return selection['format_id'] if selection else None
+
+    def test_index_skips_streamless_formats(self):
+        index = FormatIndex.from_info(INFO)
+
+        self.assertNotIn('sb0', index.by_id)
+        self.assertEqual(len(index.video), 3)
+        self.assertEqual(len(index.audio), 3)
+
+    def test_video_gets_the_audio_its_container_holds(self):
+        self.assertEqual(self.select(container='mp4'), '137+140')
+        self.assertEqual(self.select(codec='vp9'), '248+251')
+
+    def test_max_height(self):
+        self.assertEqual(self.select(max_height=720), '136+140')
+
+    def test_max_size_caps_the_pair(self):
+        # 137+140 is 52 MB, a smaller audio still fits next to the video
+        self.assertEqual(self.select(container='mp4', max_size=45 * MB), '137+139')
+        self.assertEqual(select_format(INFO, {'container': 'mp4', 'max_size': 45 * MB})['size'], 44 * MB)
+        self.assertIsNone(self.select(max_size=10 * MB))
+
+    def test_audio(self):
+        self.assertEqual(self.select(type='audio'), '251')
+        self.assertEqual(self.select(type='audio', container='mp4'), '140')
+        self.assertEqual(self.select(type='audio', max_size=5 * MB), '139')
+        self.assertEqual(self.select(type='audio', min_abr=200), None)
+
+    def test_video_without_audio(self):
+        selection = select_format(INFO, {'audio': False})
+
+        self.assertEqual(selection['format_id'], '137')
+        self.assertIsNone(selection['audio_format_id'])
+
+    def test_sizes_are_estimated_from_the_bitrate(self):
+        info = {'duration': 100, 'formats': [
+            {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2', 'height': 360, 'tbr': 800},
+        ]}
+
+        # 800 kbit/s for 100 seconds
+        self.assertEqual(select_format(info, {'max_size': 10 * MB})['size'], 10_000_000)
+        self.assertIsNone(select_format(info, {'max_size': 5 * MB}))
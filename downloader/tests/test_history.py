@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from ..history import get_history_page, make_cursor, parse_cursor, render_history, touch_history
+from ..models import VideoHistory
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class HistoryPageTests(TestCase):
+    def setUp(self):
+        # 7 entries, the last three looked up at the same moment
+        for index in range(7):
+            item = VideoHistory.objects.create(
+                video_id=f'video{index}',
+                title=f'Video {index}',
+                url=f'https://www.youtube.com/watch?v=video{index}',
+                thumbnail='https://i.ytimg.com/vi/x/default.jpg'
+            )
+            VideoHistory.objects.filter(pk=item.pk).update(lookup_date=START + timedelta(minutes=min(index, 4)))
+
+    def titles(self, page):
+        return [item.title for item in page['items']]
+
+    def test_walks_every_entry_once_in_both_directions(self):
+        first = get_history_page(per_page=3)
+        second = get_history_page(before=first['next_cursor'], per_page=3)
+        third = get_history_page(before=second['next_cursor'], per_page=3)
+
+        self.assertEqual(self.titles(first), ['Video 6', 'Video 5', 'Video 4'])
+        self.assertEqual(self.titles(second), ['Video 3', 'Video 2', 'Video 1'])
+        self.assertEqual(self.titles(third), ['Video 0'])
+        self.assertIsNone(first['previous_cursor'])
+        self.assertIsNone(third['next_cursor'])
+
+        back = get_history_page(after=third['previous_cursor'], per_page=3)
+        self.assertEqual(self.titles(back), self.titles(second))
+        back = get_history_page(after=back['previous_cursor'], per_page=3)
+        self.assertEqual(self.titles(back), self.titles(first))
+        self.assertIsNone(back['previous_cursor'])
+
+    def test_cursors(self):
+        item = VideoHistory.objects.get(video_id='video2')
+
+        self.assertEqual(parse_cursor(make_cursor(item)), (item.lookup_date, item.pk))
+        self.assertIsNone(parse_cursor('garbage'))
+        self.assertIsNone(parse_cursor(None))
+        # a malformed cursor is the first page
+        self.assertEqual(self.titles(get_history_page(before='garbage', per_page=1)), ['Video 6'])
+
+    def test_touch_moves_to_the_top_without_duplicates(self):
+        touch_history('video0', 'https://youtu.be/video0', 'Renamed', 'https://i.ytimg.com/vi/x/default.jpg')
+
+        self.assertEqual(VideoHistory.objects.filter(video_id='video0').count(), 1)
+        self.assertEqual(self.titles(get_history_page(per_page=1)), ['Renamed'])
+
+    def test_rendered_history_follows_new_lookups(self):
+        cache.clear()
+        self.assertIn('Video 6', render_history())
+
+        touch_history('video9', 'https://youtu.be/video9', 'Brand new', 'https://i.ytimg.com/vi/x/default.jpg')
+
+        self.assertIn('Brand new', render_history())
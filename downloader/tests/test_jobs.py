@@ -0,0 +1,168 @@
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import views
+from ..jobs import HOSTNAME, JobJournal
+from ..models import DownloadJob
+from ..scheduler import QueueFull
+from ..workspace import WorkspaceManager
+
+# this process's pid with another nonce, i.e. an earlier process that is gone
+DEAD_OWNER = f"{HOSTNAME}:{os.getpid()}:0123456789abcdef"
+
+
+@mock.patch.object(JobJournal, '_start')
+class JobJournalTests(TestCase):
+    def setUp(self):
+        self.journal = JobJournal(stale_after=120, max_attempts=2)
+
+    def add_job(self, job_id, owner=DEAD_OWNER, age=0, state='running', **fields):
+        return DownloadJob.objects.create(
+            job_id=job_id,
+            kind='video',
+            url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            state=state,
+            owner=owner,
+            heartbeat_at=timezone.now() - timedelta(seconds=age),
+            **fields
+        )
+
+    @mock.patch('downloader.views.resume_job')
+    def test_resumes_jobs_of_dead_processes(self, resume_job, _start):
+        self.add_job('dead')
+
+        self.assertEqual(self.journal.resume_stale(), 1)
+
+        self.assertEqual(resume_job.call_args.args[0].job_id, 'dead')
+        job = DownloadJob.objects.get(job_id='dead')
+        self.assertEqual(job.owner, self.journal.owner)
+        self.assertEqual(job.attempts, 1)
+
+    @mock.patch('downloader.views.resume_job')
+    def test_other_hosts_jobs_are_resumed_once_stale(self, resume_job, _start):
+        self.add_job('fresh', owner='elsewhere:1:abc', age=10)
+        self.add_job('stale', owner='elsewhere:2:abc', age=600)
+
+        self.assertEqual(self.journal.resume_stale(), 1)
+
+        self.assertEqual(resume_job.call_args.args[0].job_id, 'stale')
+        self.assertEqual(DownloadJob.objects.get(job_id='fresh').owner, 'elsewhere:1:abc')
+
+    @mock.patch('downloader.views.resume_job')
+    def test_finished_jobs_are_left_alone(self, resume_job, _start):
+        self.add_job('done', state='completed')
+        self.add_job('failed', state='failed')
+
+        self.assertEqual(self.journal.resume_stale(), 0)
+        resume_job.assert_not_called()
+
+    @mock.patch('downloader.views.resume_job')
+    def test_gives_up_after_max_attempts(self, resume_job, _start):
+        self.add_job('crashy', attempts=2)
+
+        self.assertEqual(self.journal.resume_stale(), 0)
+
+        resume_job.assert_not_called()
+        self.assertEqual(DownloadJob.objects.get(job_id='crashy').state, 'failed')
+
+    @mock.patch('downloader.views.resume_job', side_effect=QueueFull('full'))
+    def test_full_queue_leaves_the_job_for_a_later_pass(self, resume_job, _start):
+        self.add_job('waiting')
+
+        self.assertEqual(self.journal.resume_stale(), 0)
+        job = DownloadJob.objects.get(job_id='waiting')
+        self.assertEqual((job.state, job.attempts, job.owner), ('running', 0, DEAD_OWNER))
+
+        resume_job.side_effect = None
+        self.assertEqual(self.journal.resume_stale(), 1)
+
+    @mock.patch('downloader.views.resume_job', side_effect=ValueError('bad job'))
+    def test_jobs_that_cant_be_resumed_fail(self, resume_job, _start):
+        self.add_job('broken')
+
+        self.journal.resume_stale()
+
+        job = DownloadJob.objects.get(job_id='broken')
+        self.assertEqual(job.state, 'failed')
+        self.assertIn('bad job', job.error)
+
+    def test_record_leaves_active_jobs_alone(self, _start):
+        self.assertIsNotNone(self.journal.record('job', 'video', url='https://www.youtube.com/watch?v=a'))
+        self.assertIsNone(self.journal.record('job', 'video', url='https://www.youtube.com/watch?v=b'))
+
+        DownloadJob.objects.filter(job_id='job').update(state='completed')
+        self.assertIsNotNone(self.journal.record('job', 'video', url='https://www.youtube.com/watch?v=c'))
+        self.assertEqual(DownloadJob.objects.get(job_id='job').url, 'https://www.youtube.com/watch?v=c')
+
+
+@mock.patch.object(JobJournal, '_start')
+class InterruptedWorkspaceTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.journal = JobJournal()
+
+    def manager(self):
+        # a process of its own, with nothing in its active set
+        manager = WorkspaceManager(self.tmp.name, quota_bytes=10 ** 9, sweep_interval=60,
+                                   in_use=self.journal.workspaces_in_use)
+        manager._start_janitor = lambda: None
+        return manager
+
+    def interrupted_workspace(self, job_id, age):
+        """Workspace of a process that died age seconds ago, with a partial download in it"""
+        path = self.manager().create(job_id)
+        partial = os.path.join(path, 'video.mp4.part')
+        with open(partial, 'wb') as f:
+            f.write(b'x' * 100)
+        past = time.time() - age
+        os.utime(partial, (past, past))
+        marker = os.path.join(path, '.workspace.json')
+        with open(marker, 'w') as f:
+            f.write(f'{{"job_id": "{job_id}", "expires_at": {past}, "state": "running"}}')
+        return path, partial
+
+    def test_sweep_then_resume(self, _start):
+        # down for an hour, far past the workspace expiry
+        path, partial = self.interrupted_workspace('job', age=3600)
+        DownloadJob.objects.create(
+            job_id='job',
+            kind='video',
+            url='https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            video_format_id='137',
+            state='running',
+            owner=DEAD_OWNER,
+            workspace=path,
+            heartbeat_at=timezone.now() - timedelta(hours=1)
+        )
+        orphan, _ = self.interrupted_workspace('gone', age=3600)
+        manager = self.manager()
+
+        manager.sweep()
+
+        self.assertTrue(os.path.exists(partial))
+        self.assertFalse(os.path.exists(orphan))
+
+        scheduler = mock.Mock()
+        with mock.patch.object(views, 'workspaces', manager), mock.patch.object(views, 'job_scheduler', scheduler):
+            self.assertEqual(self.journal.resume_stale(), 1)
+
+        self.assertEqual(scheduler.submit.call_args.args[-1], path)
+        self.assertEqual(manager.partial_files(path), {'video.mp4.part': 100})
+        self.assertEqual(DownloadJob.objects.get(job_id='job').workspace, path)
+
+    def test_finished_jobs_workspaces_are_swept(self, _start):
+        path, _ = self.interrupted_workspace('job', age=3600)
+        DownloadJob.objects.create(
+            job_id='job', kind='video', state='failed', workspace=path, heartbeat_at=timezone.now()
+        )
+
+        self.manager().sweep()
+
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,55 @@
+from django.test import SimpleTestCase
+
+from ..formats import codec_family, container_fits
+from ..utils import get_merged_path, plan_merge
+
+H264 = {'ext': 'mp4', 'vcodec': 'avc1.640028'}
+VP9 = {'ext': 'webm', 'vcodec': 'vp9'}
+AAC = {'ext': 'm4a', 'acodec': 'mp4a.40.2'}
+OPUS = {'ext': 'webm', 'acodec': 'opus'}
+
+
+class PlanMergeTests(SimpleTestCase):
+    def test_codec_families(self):
+        self.assertEqual(codec_family('avc1.640028'), 'h264')
+        self.assertEqual(codec_family('vp09.00.40.08'), 'vp9')
+        self.assertEqual(codec_family('mp4a.40.2'), 'aac')
+        self.assertEqual(codec_family(None), 'none')
+        self.assertTrue(container_fits('mkv', 'audio', 'anything'))
+        self.assertFalse(container_fits('webm', 'audio', 'aac'))
+
+    def test_copies_into_the_video_container(self):
+        plan = plan_merge(H264, AAC)
+
+        self.assertEqual(plan, {
+            'container': 'mp4',
+            'vcodec': 'copy',
+            'acodec': 'copy',
+            'operation': 'remux',
+            'video_codec': 'h264',
+            'audio_codec': 'aac',
+        })
+        self.assertEqual(plan_merge(VP9, OPUS)['container'], 'webm')
+
+    def test_falls_back_to_a_container_that_holds_both(self):
+        # vp9 fits mp4 but opus doesn't, neither fits with aac in webm
+        self.assertEqual(plan_merge(VP9, AAC)['container'], 'mp4')
+        self.assertEqual(plan_merge(H264, OPUS)['container'], 'mkv')
+        self.assertEqual(plan_merge(H264, OPUS)['operation'], 'remux')
+
+    def test_forced_container_transcodes_what_doesnt_fit(self):
+        plan = plan_merge(VP9, OPUS, container='mp4')
+
+        self.assertEqual(plan['operation'], 'transcode')
+        self.assertEqual((plan['vcodec'], plan['acodec']), ('copy', 'aac'))
+
+        plan = plan_merge({'ext': 'mp4', 'vcodec': 'h265'}, AAC, container='webm')
+        self.assertEqual((plan['vcodec'], plan['acodec']), ('libvpx-vp9', 'libopus'))
+
+    def test_forced_container_that_fits_is_a_remux(self):
+        self.assertEqual(plan_merge(H264, AAC, container='mkv')['operation'], 'remux')
+
+    def test_merged_path(self):
+        self.assertEqual(get_merged_path('/tmp/Title_video.webm', 'mp4'), '/tmp/Title.mp4')
+        self.assertEqual(get_merged_path('/tmp/Title_video.mp4'), '/tmp/Title.mp4')
+        self.assertNotEqual(get_merged_path('/tmp/Title.mp4'), '/tmp/Title.mp4')
@@ -0,0 +1,79 @@
+import time
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from ..cache import MetadataCache
+from ..models import VideoInfoCache
+
+
+class MetadataCacheTests(TestCase):
+    def setUp(self):
+        self.cache = MetadataCache(max_entries=2, ttl=60, db_max_entries=3)
+
+    def test_set_then_get_is_a_memory_hit(self):
+        self.cache.set('video1', {'title': 'One'})
+
+        self.assertEqual(self.cache.get('video1'), {'title': 'One'})
+        self.assertEqual(self.cache.get_stats()['memory_hits'], 1)
+
+    def test_database_tier_survives_the_process_tier(self):
+        self.cache.set('video1', {'title': 'One'})
+        self.cache.clear()
+
+        self.assertEqual(self.cache.get('video1'), {'title': 'One'})
+        self.assertEqual(self.cache.get('video1'), {'title': 'One'})
+        stats = self.cache.get_stats()
+        # the database hit is promoted into memory
+        self.assertEqual((stats['db_hits'], stats['memory_hits']), (1, 1))
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get('unknown'))
+        self.assertEqual(self.cache.get_stats()['misses'], 1)
+
+    def test_lru_evicts_the_least_recently_used_from_memory(self):
+        self.cache.set('video1', {'title': 'One'})
+        self.cache.set('video2', {'title': 'Two'})
+        self.cache.get('video1')
+        self.cache.set('video3', {'title': 'Three'})
+
+        self.assertEqual(list(self.cache._entries), ['video1', 'video3'])
+        self.assertEqual(self.cache.get_stats()['evictions'], 1)
+        # still in the database tier
+        self.assertEqual(self.cache.get('video2'), {'title': 'Two'})
+
+    def test_expired_entries_are_misses_in_both_tiers(self):
+        self.cache.set('video1', {'title': 'One'})
+        expires_at, entry = self.cache._entries['video1']
+        self.cache._entries['video1'] = (time.time() - 1, entry)
+        VideoInfoCache.objects.filter(video_id='video1').update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertIsNone(self.cache.get('video1'))
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['expired'], stats['misses']), (1, 1))
+
+    def test_invalidate_drops_both_tiers(self):
+        self.cache.set('video1', {'title': 'One'})
+        self.cache.invalidate('video1')
+
+        self.assertNotIn('video1', self.cache._entries)
+        self.assertFalse(VideoInfoCache.objects.filter(video_id='video1').exists())
+        self.assertIsNone(self.cache.get('video1'))
+
+    def test_db_prune_drops_expired_then_the_soonest_to_expire(self):
+        now = timezone.now()
+        for index, video_id in enumerate(['old', 'video1', 'video2', 'video3', 'video4']):
+            VideoInfoCache.objects.create(
+                video_id=video_id,
+                payload={},
+                expires_at=now + timedelta(seconds=-10 if video_id == 'old' else 100 * index)
+            )
+
+        self.cache._db_prune()
+
+        self.assertEqual(
+            set(VideoInfoCache.objects.values_list('video_id', flat=True)),
+            {'video2', 'video3', 'video4'}
+        )
+        self.assertEqual(self.cache.get_stats()['evictions'], 1)
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..metrics import (
+    Counter, Gauge, Histogram, MemoryMetricsStore, MetricsRegistry, MetricsStore, SQLiteMetricsStore
+)
+
+
+class MetricsStoreTests(SimpleTestCase):
+    def test_stores_must_implement_push_and_collect(self):
+        class Partial(MetricsStore):
+            def push(self, increments, gauges):
+                pass
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+    def test_sqlite_store_sums_over_processes(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'metrics.sqlite3')
+        store = SQLiteMetricsStore(path, stale_after=60)
+        key = ('jobs', (('state', 'running'),))
+
+        store.push({('downloads', ()): 2}, {key: 3})
+        # another worker process
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            SQLiteMetricsStore(path).push({('downloads', ()): 5}, {key: 1})
+
+        self.assertEqual(store.collect(), {('downloads', ()): 7, key: 4})
+
+        # a process that stopped flushing is gone, its gauges with it
+        with mock.patch('time.time', return_value=time.time() + 120):
+            self.assertEqual(store.collect(), {('downloads', ()): 7})
+
+    def test_sqlite_store_is_created_on_first_use(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'metrics.sqlite3')
+
+        SQLiteMetricsStore(path)
+
+        self.assertFalse(os.path.exists(path))
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry(MemoryMetricsStore(), flush_interval=3600)
+
+    def test_render(self):
+        served = Counter('served_bytes_total', 'Bytes served', ('kind',), registry=self.registry)
+        jobs = Gauge('jobs', 'Jobs', ('state',), registry=self.registry)
+        stages = Histogram('stage_seconds', 'Stage time', ('stage',), buckets=(1, 10), registry=self.registry)
+
+        served.inc(100, kind='file')
+        served.inc(50, kind='file')
+        jobs.set(2, state='running')
+        stages.observe(0.5, stage='merge')
+        stages.observe(5, stage='merge')
+
+        self.assertEqual(self.registry.render().splitlines(), [
+            '# HELP served_bytes_total Bytes served',
+            '# TYPE served_bytes_total counter',
+            'served_bytes_total{kind="file"} 150',
+            '# HELP jobs Jobs',
+            '# TYPE jobs gauge',
+            'jobs{state="running"} 2',
+            '# HELP stage_seconds Stage time',
+            '# TYPE stage_seconds histogram',
+            'stage_seconds_bucket{stage="merge",le="1"} 1',
+            'stage_seconds_bucket{stage="merge",le="10"} 2',
+            'stage_seconds_bucket{stage="merge",le="+Inf"} 2',
+            'stage_seconds_sum{stage="merge"} 5.5',
+            'stage_seconds_count{stage="merge"} 2',
+        ])
+
+    def test_labels_are_checked(self):
+        counter = Counter('requests_total', 'Requests', ('result',), registry=self.registry)
+
+        with self.assertRaises(ValueError):
+            counter.inc(kind='file')
+
+    def test_failed_push_is_kept_for_the_next_flush(self):
+        counter = Counter('requests_total', 'Requests', registry=self.registry)
+        counter.inc(3)
+
+        with mock.patch.object(self.registry.store, 'push', side_effect=OSError('locked')):
+            self.registry.flush()
+        self.registry.flush()
+
+        self.assertEqual(self.registry.store.collect(), {('requests_total', ()): 3})
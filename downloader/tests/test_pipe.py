@@ -0,0 +1,133 @@
+import io
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from .. import utils, views
+from ..progress import progress_store
+from ..scheduler import JobScheduler
+
+URL = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+INFO = {
+    'info': {
+        'formats': [
+            {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none',
+             'url': 'https://media.example/137', 'filesize': 300},
+            {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2',
+             'url': 'https://media.example/140', 'filesize': 100},
+        ]
+    },
+    'video_details': {'title': 'Video'},
+}
+
+
+class FakeProcess:
+    def __init__(self, output=b'', returncode=0):
+        self.stdout = io.BytesIO(output)
+        self.returncode = returncode
+        self.killed = False
+
+    def poll(self):
+        return self.returncode if self.stdout.tell() == len(self.stdout.getvalue()) else None
+
+    def wait(self):
+        return self.returncode
+
+    def kill(self):
+        self.killed = True
+
+
+class PipedDownloadTests(SimpleTestCase):
+    def setUp(self):
+        self.scheduler = JobScheduler(download_slots=1)
+        self.info = mock.Mock(return_value=INFO)
+        self.invalidate = mock.Mock()
+        self.processes = []
+        for patcher in (
+            mock.patch.object(utils, 'job_scheduler', self.scheduler),
+            mock.patch.object(utils, 'get_video_info_dict', self.info),
+            mock.patch.object(utils, 'get_format', lambda url, format_id: next(
+                f for f in INFO['info']['formats'] if f['format_id'] == format_id)),
+            mock.patch.object(utils.video_info_cache, 'invalidate', self.invalidate),
+            mock.patch.object(utils.ffmpeg, 'run_async', side_effect=lambda *args, **kwargs: self.processes.pop(0)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def assertSlotFree(self):
+        self.assertTrue(self.scheduler._download_slots.acquire(blocking=False))
+        self.scheduler._download_slots.release()
+
+    def test_streams_ffmpeg_output(self):
+        self.processes = [FakeProcess(b'x' * 10)]
+        pipe = utils.PipedDownload(URL, '137', '140', chunk_size=4)
+
+        pipe.start()
+        self.assertFalse(self.scheduler._download_slots.acquire(blocking=False))
+        output = b''.join(pipe)
+
+        self.assertEqual(output, b'x' * 10)
+        self.assertEqual(pipe.plan['container'], 'mp4')
+        self.assertEqual(progress_store.get(pipe.download_id)['status'], 'finished')
+        self.assertSlotFree()
+
+    def test_failure_before_output_is_retried_with_fresh_metadata(self):
+        self.processes = [FakeProcess(returncode=1), FakeProcess(b'data')]
+        pipe = utils.PipedDownload(URL, '137', '140')
+
+        pipe.start()
+
+        self.assertEqual(b''.join(pipe), b'data')
+        self.invalidate.assert_called_once_with('dQw4w9WgXcQ')
+        self.assertEqual(self.info.call_args_list[-1], mock.call(URL, use_cache=False))
+
+    def test_failure_is_raised_before_the_response(self):
+        self.processes = [FakeProcess(returncode=1), FakeProcess(returncode=1)]
+        pipe = utils.PipedDownload(URL, '137', '140')
+
+        with self.assertRaises(utils.PipeFailed):
+            pipe.start()
+
+        self.assertEqual(progress_store.get(pipe.download_id)['status'], 'error')
+        self.assertSlotFree()
+
+    def test_unknown_format(self):
+        pipe = utils.PipedDownload(URL, '999')
+
+        with self.assertRaisesMessage(utils.PipeFailed, 'Unknown format 999'):
+            pipe.start()
+        self.assertSlotFree()
+
+    def test_close_stops_ffmpeg(self):
+        process = FakeProcess(b'x' * 10)
+        self.processes = [process]
+        pipe = utils.PipedDownload(URL, '137', '140', chunk_size=4)
+        pipe.start()
+
+        # the client goes away after the first chunk
+        next(iter(pipe))
+        pipe.close()
+        pipe.close()
+
+        self.assertTrue(process.killed)
+        self.assertSlotFree()
+
+
+@mock.patch.object(views, 'DOWNLOAD_PIPE_MODE', True)
+class PipedDownloadViewTests(SimpleTestCase):
+    def post(self, format_id):
+        request = RequestFactory().post('/', {'url': URL, 'format_id': format_id})
+        return views.download_vid(request)
+
+    @mock.patch.object(utils, 'get_output_plan', return_value={'container': '', 'operation': 'none'})
+    def test_unknown_format(self, get_output_plan):
+        self.assertEqual(self.post('999').status_code, 400)
+
+    @mock.patch.object(utils, 'get_output_plan', return_value={'container': 'mp4', 'operation': 'remux'})
+    @mock.patch.object(views.download_cache, 'lookup', return_value=None)
+    @mock.patch.object(utils.PipedDownload, 'start', side_effect=utils.PipeFailed('ffmpeg exited with 1'))
+    def test_failed_pipe_is_an_error_status(self, start, lookup, get_output_plan):
+        response = self.post('137+140')
+
+        self.assertEqual(response.status_code, 502)
+        self.assertIn(b'ffmpeg exited with 1', response.content)
@@ -0,0 +1,94 @@
+import importlib
+
+from django.apps import apps
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..models import PlaylistVideo
+from ..views import save_playlist_videos
+
+normalize_playlist_ids = importlib.import_module(
+    'downloader.migrations.0004_playlistvideo_identity'
+).normalize_playlist_ids
+
+
+def video(position, title=None):
+    return {
+        'position': position,
+        'title': title or f'Video {position}',
+        'url': f'https://www.youtube.com/watch?v=video{position}',
+        'thumbnail': f'https://i.ytimg.com/vi/video{position}/default.jpg',
+    }
+
+
+class SavePlaylistVideosTests(TestCase):
+    def stored(self, playlist_id='PL1'):
+        return list(PlaylistVideo.objects.filter(playlist_id=playlist_id).values_list('position', 'title'))
+
+    def test_first_save(self):
+        save_playlist_videos('PL1', [video(1), video(2)])
+
+        self.assertEqual(self.stored(), [(1, 'Video 1'), (2, 'Video 2')])
+
+    def test_unchanged_playlist_writes_nothing(self):
+        save_playlist_videos('PL1', [video(1), video(2)])
+
+        with CaptureQueriesContext(connection) as queries:
+            save_playlist_videos('PL1', [video(1), video(2)])
+
+        writes = [q['sql'] for q in queries if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [])
+
+    def test_changed_new_and_removed_entries(self):
+        save_playlist_videos('PL1', [video(1), video(2), video(3)])
+        original = PlaylistVideo.objects.get(playlist_id='PL1', position=1).pk
+
+        save_playlist_videos('PL1', [video(1, 'Renamed'), video(2)])
+
+        self.assertEqual(self.stored(), [(1, 'Renamed'), (2, 'Video 2')])
+        # rows are updated in place
+        self.assertEqual(PlaylistVideo.objects.get(playlist_id='PL1', position=1).pk, original)
+
+    def test_pages_only_touch_their_positions(self):
+        save_playlist_videos('PL1', [video(1), video(2)], last_page=False)
+        save_playlist_videos('PL1', [video(3), video(4)], last_page=False)
+
+        self.assertEqual([position for position, _ in self.stored()], [1, 2, 3, 4])
+
+        # a shorter last page drops what's stored past it
+        save_playlist_videos('PL1', [video(3)], last_page=True)
+        self.assertEqual([position for position, _ in self.stored()], [1, 2, 3])
+
+    def test_playlists_are_kept_apart(self):
+        save_playlist_videos('PL1', [video(1)])
+        save_playlist_videos('PL2', [video(1, 'Other')])
+
+        self.assertEqual(self.stored('PL1'), [(1, 'Video 1')])
+        self.assertEqual(self.stored('PL2'), [(1, 'Other')])
+
+
+class NormalizePlaylistIdsTests(TestCase):
+    def add_rows(self, playlist_id, count):
+        for position in range(1, count + 1):
+            PlaylistVideo.objects.create(playlist_id=playlist_id, position=position, **{
+                field: value for field, value in video(position).items() if field != 'position'
+            })
+
+    def test_rows_are_keyed_by_list_id(self):
+        self.add_rows('https://www.youtube.com/playlist?list=PL1', 3)
+        self.add_rows('PL2', 2)
+
+        normalize_playlist_ids(apps, None)
+
+        self.assertEqual(PlaylistVideo.objects.filter(playlist_id='PL1').count(), 3)
+        self.assertEqual(PlaylistVideo.objects.filter(playlist_id='PL2').count(), 2)
+
+    def test_copies_under_other_urls_are_dropped(self):
+        self.add_rows('https://www.youtube.com/playlist?list=PL1', 3)
+        self.add_rows('https://www.youtube.com/watch?v=video1&list=PL1', 3)
+
+        normalize_playlist_ids(apps, None)
+
+        self.assertEqual(list(PlaylistVideo.objects.values_list('playlist_id', flat=True).order_by().distinct()), ['PL1'])
+        self.assertEqual(PlaylistVideo.objects.count(), 3)
@@ -0,0 +1,119 @@
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from ..progress import (
+    MemoryProgressStore, ProgressStore, RedisProgressStore, SQLiteProgressStore, get_progress_store
+)
+
+
+class ProgressStoreContract:
+    """What every backend does, run against each of them"""
+
+    def make_store(self, ttl=3600, stale_ttl=24 * 3600):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def test_set_and_get(self):
+        entry = {'status': 'downloading', 'progress': 10}
+        self.store.set('job', entry)
+        entry['progress'] = 20
+
+        self.assertEqual(self.store.get('job'), {'status': 'downloading', 'progress': 10})
+        self.assertIsNone(self.store.get('unknown'))
+
+    def test_add_only_creates_missing_entries(self):
+        self.assertTrue(self.store.add('job', {'status': 'queued'}))
+        self.assertFalse(self.store.add('job', {'status': 'downloading'}))
+
+        self.assertEqual(self.store.get('job'), {'status': 'queued'})
+
+    def test_update_merges_fields(self):
+        self.store.set('job', {'status': 'downloading', 'progress': 10})
+
+        self.assertTrue(self.store.update('job', progress=50, speed=1000))
+        self.assertFalse(self.store.update('unknown', progress=50))
+
+        self.assertEqual(self.store.get('job'), {'status': 'downloading', 'progress': 50, 'speed': 1000})
+        self.assertIsNone(self.store.get('unknown'))
+
+    def test_delete(self):
+        self.store.set('job', {'status': 'queued'})
+
+        self.store.delete('job')
+
+        self.assertIsNone(self.store.get('job'))
+
+    def test_final_entries_expire_after_ttl(self):
+        store = self.make_store(ttl=1, stale_ttl=3600)
+        store.set('done', {'status': 'completed'})
+        store.set('running', {'status': 'downloading'})
+
+        with mock.patch('time.time', return_value=time.time() + 2):
+            self.assertIsNone(store.get('done'))
+            self.assertEqual(store.get('running'), {'status': 'downloading'})
+            # an expired entry can be created again
+            self.assertTrue(store.add('done', {'status': 'queued'}))
+            store.expire()
+            self.assertEqual(store.get('done'), {'status': 'queued'})
+
+    def test_updating_to_a_final_state_shortens_the_lifetime(self):
+        store = self.make_store(ttl=1, stale_ttl=3600)
+        store.set('job', {'status': 'downloading'})
+
+        store.update('job', status='failed')
+
+        with mock.patch('time.time', return_value=time.time() + 2):
+            self.assertIsNone(store.get('job'))
+            self.assertFalse(store.update('job', status='failed'))
+
+
+class MemoryProgressStoreTests(ProgressStoreContract, SimpleTestCase):
+    def make_store(self, ttl=3600, stale_ttl=24 * 3600):
+        return MemoryProgressStore(ttl, stale_ttl)
+
+
+class SQLiteProgressStoreTests(ProgressStoreContract, SimpleTestCase):
+    def make_store(self, ttl=3600, stale_ttl=24 * 3600):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return SQLiteProgressStore(os.path.join(tmp.name, 'progress.sqlite3'), ttl, stale_ttl)
+
+    def test_shared_between_connections(self):
+        other = SQLiteProgressStore(self.store.path)
+        self.store.add('job', {'status': 'queued'})
+
+        self.assertFalse(other.add('job', {'status': 'queued'}))
+        other.update('job', status='downloading')
+        self.assertEqual(self.store.get('job'), {'status': 'downloading'})
+
+
+class ProgressBackendTests(SimpleTestCase):
+    def test_backends_must_implement_every_method(self):
+        class Partial(ProgressStore):
+            def get(self, job_id):
+                return None
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+    def test_redis_backend_without_the_package(self):
+        with mock.patch.dict(sys.modules, {'redis': None}):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'pip install redis'):
+                RedisProgressStore('redis://localhost:6379/0')
+
+    @override_settings(PROGRESS_BACKEND='memcached')
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_progress_store()
+
+    @override_settings(PROGRESS_BACKEND='memory')
+    def test_memory_backend(self):
+        self.assertIsInstance(get_progress_store(), MemoryProgressStore)
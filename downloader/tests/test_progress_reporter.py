@@ -0,0 +1,73 @@
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..progress import MemoryProgressStore, ProgressReporter
+
+
+class ProgressReporterTests(SimpleTestCase):
+    def setUp(self):
+        self.store = MemoryProgressStore()
+        self.store.set('job', {'status': 'downloading', 'progress': 0})
+        self.now = 1000.0
+        # the module's own clock, patching time itself would stop it for every thread
+        patcher = mock.patch('downloader.progress.time', mock.Mock(time=time.time, monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.reporter = ProgressReporter('job', max_rate=2, window=5.0, store=self.store)
+
+    def test_reports_are_rate_limited(self):
+        self.assertTrue(self.reporter.report(100, 1000))
+        self.now += 0.1
+        self.assertFalse(self.reporter.report(200, 1000))
+        self.assertEqual(self.store.get('job')['progress'], 10)
+
+        self.now += 0.5
+        self.assertTrue(self.reporter.report(300, 1000))
+        self.assertEqual(self.store.get('job')['progress'], 30)
+
+    def test_speed_and_eta_over_the_window(self):
+        downloaded = 0
+        self.reporter.report(downloaded, 10000)
+        for _ in range(4):
+            self.now += 1
+            downloaded += 1000
+            self.reporter.report(downloaded, 10000)
+
+        entry = self.store.get('job')
+        self.assertEqual(entry['speed'], 1000)
+        self.assertEqual(entry['eta'], 6)
+
+        # samples older than the window stop counting
+        self.now += 10
+        self.reporter.report(9000, 10000)
+        self.now += 1
+        self.reporter.report(9500, 10000)
+        self.assertEqual(self.store.get('job')['speed'], 500)
+
+    def test_scale_and_extra_fields(self):
+        self.reporter.report(500, 1000, scale=90, stage='download')
+
+        entry = self.store.get('job')
+        self.assertEqual(entry['progress'], 45)
+        self.assertEqual(entry['stage'], 'download')
+
+    def test_unknown_total(self):
+        self.reporter.report(500, 0)
+
+        entry = self.store.get('job')
+        self.assertEqual((entry['progress'], entry['eta']), (0, 0))
+
+    def test_publish_is_never_throttled(self):
+        self.reporter.report(100, 1000)
+        self.reporter.publish(status='finished', progress=100)
+
+        self.assertEqual(self.store.get('job')['status'], 'finished')
+        # and a report right after it waits its turn
+        self.assertFalse(self.reporter.report(1000, 1000))
+
+    def test_store_failures_dont_reach_the_download(self):
+        with mock.patch.object(self.store, 'update', side_effect=OSError('disk full')):
+            self.assertTrue(self.reporter.report(100, 1000))
+            self.reporter.publish(status='finished')
@@ -0,0 +1,104 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from ..scheduler import PRIORITY_PLAYLIST, PRIORITY_VIDEO, JobScheduler, QueueFull
+
+
+class JobSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def block(self, started=None):
+        if started:
+            started.set()
+        self.release.wait(5)
+
+    def start_blocking_job(self, scheduler, job_id='running'):
+        started = threading.Event()
+        scheduler.submit(job_id, self.block, started)
+        self.assertTrue(started.wait(5))
+
+    def test_runs_jobs(self):
+        done = threading.Event()
+        scheduler = JobScheduler(workers=1)
+
+        scheduler.submit('job', done.set)
+
+        self.assertTrue(done.wait(5))
+
+    def test_queue_positions_follow_priority_then_submission(self):
+        scheduler = JobScheduler(workers=1)
+        self.start_blocking_job(scheduler)
+
+        self.assertEqual(scheduler.submit('playlist', self.block, priority=PRIORITY_PLAYLIST), 1)
+        self.assertEqual(scheduler.submit('video1', self.block, priority=PRIORITY_VIDEO), 1)
+        self.assertEqual(scheduler.submit('video2', self.block, priority=PRIORITY_VIDEO), 2)
+
+        self.assertEqual(scheduler.position('running'), 0)
+        self.assertEqual(scheduler.position('playlist'), 3)
+        self.assertIsNone(scheduler.position('unknown'))
+        self.assertEqual(scheduler.stats(), {'queued': 3, 'running': 1, 'workers': 1})
+
+    def test_queue_full(self):
+        scheduler = JobScheduler(workers=1, max_queued=1)
+        self.start_blocking_job(scheduler)
+        scheduler.submit('queued', self.block)
+
+        with self.assertRaises(QueueFull):
+            scheduler.submit('rejected', self.block)
+
+    def test_admission_holds_jobs_back(self):
+        room = threading.Event()
+        done = threading.Event()
+        scheduler = JobScheduler(workers=1, admit=room.is_set)
+
+        scheduler.submit('job', done.set)
+        self.assertFalse(done.wait(0.2))
+        self.assertEqual(scheduler.position('job'), 1)
+
+        # re-checked every second while jobs wait
+        room.set()
+        self.assertTrue(done.wait(5))
+
+    def test_failing_jobs_free_their_worker(self):
+        done = threading.Event()
+        scheduler = JobScheduler(workers=1)
+
+        scheduler.submit('broken', lambda: 1 / 0)
+        scheduler.submit('next', done.set)
+
+        self.assertTrue(done.wait(5))
+
+    def test_reserve_for_jobs_run_by_the_caller(self):
+        scheduler = JobScheduler(workers=1, admit=lambda: False)
+        with self.assertRaises(QueueFull):
+            scheduler.reserve('stream')
+
+        scheduler = JobScheduler(workers=1)
+        scheduler.reserve('stream')
+        self.assertEqual(scheduler.position('stream'), 0)
+        scheduler.release('stream')
+        self.assertIsNone(scheduler.position('stream'))
+
+    def test_slots_bound_concurrent_stages(self):
+        scheduler = JobScheduler(download_slots=1)
+        holding = threading.Event()
+        second = threading.Event()
+
+        def hold():
+            with scheduler.download_slot():
+                holding.set()
+                self.release.wait(5)
+
+        def take():
+            with scheduler.download_slot():
+                second.set()
+
+        threading.Thread(target=hold, daemon=True).start()
+        self.assertTrue(holding.wait(5))
+        threading.Thread(target=take, daemon=True).start()
+        self.assertFalse(second.wait(0.2))
+        self.release.set()
+        self.assertTrue(second.wait(5))
@@ -0,0 +1,152 @@
+import functools
+import json
+import os
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.test import SimpleTestCase
+from yt_dlp.postprocessor import FFmpegFixupM4aPP
+from yt_dlp.utils import DownloadError
+
+from .. import utils
+from ..benchmarks.media import MediaServer
+from ..segmented import READ_SIZE, RangeNotSupported, SegmentedDownload, can_segment
+
+SIZE = READ_SIZE * 6 + 1000
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    # whole files only, it ignores Range
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SegmentedDownloadTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.media_dir = os.path.join(self.tmp.name, 'media')
+        os.makedirs(self.media_dir)
+        self.data = os.urandom(SIZE)
+        with open(os.path.join(self.media_dir, 'audio.m4a'), 'wb') as f:
+            f.write(self.data)
+        self.server = MediaServer(self.media_dir).__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.path = os.path.join(self.tmp.name, 'out', 'audio.m4a')
+
+    def download(self, hooks=(), **kwargs):
+        return SegmentedDownload(
+            f"{self.server.url}/audio.m4a",
+            connections=3,
+            segment_size=READ_SIZE,
+            retries=0,
+            progress_hooks=list(hooks),
+            **kwargs
+        ).download(self.path)
+
+    def test_downloads_the_whole_file(self):
+        reports = []
+
+        self.assertEqual(self.download([reports.append]), self.path)
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(f"{self.path}.part"))
+        self.assertFalse(os.path.exists(f"{self.path}.ranges.part"))
+        self.assertEqual(reports[-1]['status'], 'finished')
+        self.assertEqual(reports[-1]['downloaded_bytes'], SIZE)
+
+    def test_continues_where_an_interrupted_run_stopped(self):
+        calls = []
+
+        def interrupt(d):
+            calls.append(d)
+            if len(calls) == 4:
+                raise OSError('connection reset')
+
+        with self.assertRaises(DownloadError):
+            self.download([interrupt])
+        with open(f"{self.path}.ranges.part") as f:
+            self.assertEqual(json.loads(f.readline()), {'total': SIZE, 'segment_size': READ_SIZE})
+
+        reports = []
+        download = SegmentedDownload(
+            f"{self.server.url}/audio.m4a", connections=3, segment_size=READ_SIZE, progress_hooks=[reports.append]
+        )
+        download.download(self.path)
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertGreater(download.restored, 0)
+        # speed only counts what this run fetched
+        last = reports[-1]
+        self.assertAlmostEqual(last['speed'] * last['elapsed'], SIZE - download.restored, delta=1)
+
+    def test_finished_file_is_not_fetched_again(self):
+        self.download()
+        reports = []
+
+        with mock.patch.object(SegmentedDownload, '_probe') as probe:
+            self.download([reports.append])
+
+        probe.assert_not_called()
+        self.assertEqual([d['status'] for d in reports], ['finished'])
+
+    def test_server_without_ranges(self):
+        handler = functools.partial(QuietHandler, directory=self.media_dir)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        # the probe hangs up after the headers
+        server.handle_error = lambda *args: None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        host, port = server.server_address[:2]
+
+        with self.assertRaises(RangeNotSupported):
+            SegmentedDownload(f"http://{host}:{port}/audio.m4a").download(self.path)
+        self.assertFalse(os.path.exists(f"{self.path}.part"))
+
+    def test_can_segment(self):
+        format = {'protocol': 'https', 'url': 'https://media.example/a', 'filesize': 10 * 1024 * 1024}
+
+        self.assertTrue(can_segment(format, 4, 4 * 1024 * 1024))
+        self.assertFalse(can_segment(format, 1, 4 * 1024 * 1024))
+        self.assertFalse(can_segment(format, 4, 8 * 1024 * 1024))
+        self.assertFalse(can_segment({**format, 'protocol': 'http_dash_segments'}, 4, 4 * 1024 * 1024))
+        self.assertFalse(can_segment({**format, 'fragments': [{}]}, 4, 4 * 1024 * 1024))
+
+    @mock.patch.object(FFmpegFixupM4aPP, 'available', True)
+    @mock.patch.object(FFmpegFixupM4aPP, 'run', side_effect=lambda info: ([], info))
+    def test_segmented_streams_get_the_fixups(self, fixup):
+        info_dict = {
+            'id': 'dQw4w9WgXcQ',
+            'title': 'Video',
+            'extractor': 'youtube',
+            'extractor_key': 'Youtube',
+            'webpage_url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+            'formats': [{
+                'format_id': '140',
+                'url': f"{self.server.url}/audio.m4a",
+                'protocol': 'http',
+                'ext': 'm4a',
+                'container': 'm4a_dash',
+                'acodec': 'mp4a.40.2',
+                'vcodec': 'none',
+                'filesize': SIZE,
+            }],
+        }
+        outtmpl = os.path.join(self.tmp.name, 'out', '%(title)s_audio.%(ext)s')
+
+        with mock.patch.object(SegmentedDownload, 'download', autospec=True,
+                               side_effect=SegmentedDownload.download) as segmented:
+            path = utils._fetch_stream(info_dict, '140', outtmpl, lambda d: None, 'audio',
+                                       transport={'connections': 3, 'segment_size': READ_SIZE})
+
+        segmented.assert_called_once()
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        fixup.assert_called_once()
+        self.assertEqual(fixup.call_args.args[0]['filepath'], path)
@@ -0,0 +1,117 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase
+from django.utils.http import http_date
+
+from .. import serving
+from ..serving import ClosingContent, serve_file
+
+DATA = bytes(range(256)) * 4
+
+
+class ServeFileTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        tmp = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
+        tmp.write(DATA)
+        tmp.close()
+        self.path = tmp.name
+        self.addCleanup(os.remove, self.path)
+        self.mtime = os.stat(self.path).st_mtime
+
+    def serve(self, **headers):
+        response = serve_file(self.factory.get('/', headers=headers), self.path, 'Video.mp4')
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file(self):
+        response = self.serve()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(DATA)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(self.body(response), DATA)
+
+    def test_range(self):
+        response = self.serve(Range='bytes=10-19')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(DATA)}')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), DATA[10:20])
+
+    def test_open_ended_and_suffix_ranges(self):
+        response = self.serve(Range='bytes=1000-')
+        self.assertEqual(self.body(response), DATA[1000:])
+
+        response = self.serve(Range='bytes=-5')
+        self.assertEqual(response['Content-Range'], f'bytes {len(DATA) - 5}-{len(DATA) - 1}/{len(DATA)}')
+        self.assertEqual(self.body(response), DATA[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.serve(Range=f'bytes={len(DATA)}-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(DATA)}')
+
+    def test_multiple_ranges_get_the_whole_file(self):
+        self.assertEqual(self.serve(Range='bytes=0-1,5-6').status_code, 200)
+
+    def test_if_range(self):
+        etag = self.serve()['ETag']
+
+        self.assertEqual(self.serve(Range='bytes=0-9', **{'If-Range': etag}).status_code, 206)
+        self.assertEqual(self.serve(Range='bytes=0-9', **{'If-Range': '"stale"'}).status_code, 200)
+        self.assertEqual(self.serve(Range='bytes=0-9', **{'If-Range': http_date(self.mtime + 60)}).status_code, 206)
+        self.assertEqual(self.serve(Range='bytes=0-9', **{'If-Range': http_date(self.mtime - 60)}).status_code, 200)
+
+    def test_if_none_match(self):
+        etag = self.serve()['ETag']
+
+        response = self.serve(**{'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_offload(self):
+        with mock.patch.object(serving, 'FILE_SERVING_OFFLOAD', 'x-sendfile'):
+            response = self.serve(Range='bytes=0-9')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], os.path.abspath(self.path))
+        self.assertEqual(response.content, b'')
+
+
+class ClosingContentTests(SimpleTestCase):
+    def test_on_close_runs_once(self):
+        content = mock.Mock()
+        on_close = mock.Mock()
+        closing = ClosingContent(content, on_close)
+
+        closing.close()
+        closing.close()
+
+        content.close.assert_called_with()
+        on_close.assert_called_once_with()
+
+    def test_on_close_runs_when_closing_the_content_fails(self):
+        content = mock.Mock()
+        content.close.side_effect = OSError
+        on_close = mock.Mock()
+
+        with self.assertRaises(OSError):
+            ClosingContent(content, on_close).close()
+        on_close.assert_called_once_with()
+
+    def test_unstarted_generators(self):
+        on_close = mock.Mock()
+
+        ClosingContent(iter([b'a']), on_close).close()
+
+        on_close.assert_called_once_with()
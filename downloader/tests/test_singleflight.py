@@ -0,0 +1,87 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from ..singleflight import SingleFlight
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.calls = 0
+
+    def slow(self, value):
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def run_callers(self, count, key, value):
+        results = [None] * count
+        threads = []
+
+        def caller(index):
+            try:
+                results[index] = self.flight.do(key, self.slow, value)
+            except Exception as e:
+                results[index] = e
+
+        for index in range(count):
+            thread = threading.Thread(target=caller, args=(index,))
+            thread.start()
+            threads.append(thread)
+        return results, threads
+
+    def wait_for_flight(self, key):
+        for _ in range(500):
+            if self.flight.in_flight(key):
+                return
+            threading.Event().wait(0.01)
+        self.fail(f"{key} never started")
+
+    def test_concurrent_callers_share_one_call(self):
+        results, threads = self.run_callers(1, 'key', 'value')
+        self.wait_for_flight('key')
+        followers, more_threads = self.run_callers(4, 'key', 'value')
+        # give the followers time to reach do()
+        threading.Event().wait(0.2)
+
+        self.release.set()
+        for thread in threads + more_threads:
+            thread.join(5)
+
+        self.assertEqual(results + followers, ['value'] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertFalse(self.flight.in_flight())
+
+    def test_errors_reach_every_waiting_caller(self):
+        error = ValueError('extraction failed')
+        results, threads = self.run_callers(1, 'key', error)
+        self.wait_for_flight('key')
+        followers, more_threads = self.run_callers(2, 'key', error)
+        threading.Event().wait(0.2)
+
+        self.release.set()
+        for thread in threads + more_threads:
+            thread.join(5)
+
+        for result in results + followers:
+            self.assertIs(result, error)
+        self.assertEqual(self.calls, 1)
+
+    def test_nothing_is_remembered(self):
+        self.release.set()
+
+        self.assertEqual(self.flight.do('key', self.slow, 1), 1)
+        self.assertEqual(self.flight.do('key', self.slow, 2), 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_keys_are_independent(self):
+        self.release.set()
+
+        self.assertEqual(self.flight.do('a', self.slow, 'a'), 'a')
+        self.assertEqual(self.flight.do('b', self.slow, 'b'), 'b')
+        self.assertFalse(self.flight.in_flight('a'))
@@ -0,0 +1,116 @@
+import io
+import os
+import tempfile
+import zipfile
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from .. import views
+from ..models import PlaylistVideo
+from ..progress import progress_store
+from ..scheduler import job_scheduler
+from ..utils import iter_zip_stream
+
+
+class ZipStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_file(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_archive_holds_the_files(self):
+        first = self.make_file('a.mp4', b'a' * 3000)
+        second = self.make_file('b.mp4', os.urandom(2500))
+        with open(second, 'rb') as f:
+            second_data = f.read()
+
+        archive = b''.join(iter_zip_stream([(first, '001 - a.mp4'), (second, '002 - b.mp4')], chunk_size=1024))
+
+        with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(zip_file.namelist(), ['001 - a.mp4', '002 - b.mp4'])
+            self.assertEqual(zip_file.read('001 - a.mp4'), b'a' * 3000)
+            self.assertEqual(zip_file.read('002 - b.mp4'), second_data)
+            self.assertEqual(zip_file.getinfo('001 - a.mp4').compress_type, zipfile.ZIP_STORED)
+        # zipped files are removed
+        self.assertFalse(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+    def test_files_are_read_as_they_arrive(self):
+        path = self.make_file('a.mp4', b'a' * 10)
+        stream = iter_zip_stream(iter([(path, 'a.mp4')]))
+
+        # the first member is sent before the generator asks for the next file
+        self.assertTrue(next(stream))
+
+    def test_empty_archive(self):
+        archive = b''.join(iter_zip_stream([]))
+
+        with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+            self.assertEqual(zip_file.namelist(), [])
+
+
+class StreamPlaylistTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        for position in (1, 2):
+            PlaylistVideo.objects.create(
+                playlist_id='PL1',
+                title=f'Video {position}',
+                url=f'https://www.youtube.com/watch?v=video{position}',
+                thumbnail='https://i.ytimg.com/vi/x/default.jpg',
+                position=position
+            )
+        patcher = mock.patch.object(views, 'load_playlist')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_downloads(self, job_id, videos, format_type, temp_dir, audio_output=None):
+        for video in videos:
+            path = os.path.join(temp_dir, f'{video.position}.mp4')
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            yield video, path
+
+    def stream(self, stream_id):
+        return views.stream_playlist(self.factory.get('/', {'playlist_id': 'PL1', 'stream_id': stream_id}))
+
+    def test_progress_is_kept_under_the_stream_id(self):
+        with mock.patch.object(views, 'iter_playlist_downloads', side_effect=self.fake_downloads) as downloads:
+            response = self.stream('0123456789abcdef')
+            archive = b''.join(response.streaming_content)
+            response.close()
+
+        self.assertEqual(downloads.call_args.args[0], 'stream_0123456789abcdef')
+        self.assertEqual(progress_store.get('stream_0123456789abcdef')['status'], 'completed')
+        self.assertIsNone(progress_store.get('PL1'))
+        self.assertIsNone(job_scheduler.position('stream_0123456789abcdef'))
+        with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+            self.assertEqual(zip_file.namelist(), ['001 - 1.mp4', '002 - 2.mp4'])
+
+    def test_concurrent_streams_keep_their_own_progress(self):
+        with mock.patch.object(views, 'iter_playlist_downloads', side_effect=self.fake_downloads):
+            first = self.stream('1111111111111111')
+            second = self.stream('2222222222222222')
+            next(iter(first.streaming_content))
+            b''.join(second.streaming_content)
+            second.close()
+            # the first client goes away before its archive is complete
+            first.close()
+
+        self.assertEqual(progress_store.get('stream_2222222222222222')['status'], 'completed')
+        self.assertEqual(progress_store.get('stream_1111111111111111')['status'], 'failed')
+
+    def test_stream_id_is_checked(self):
+        self.assertEqual(self.stream('../../etc').status_code, 400)
+
+        with mock.patch.object(views, 'iter_playlist_downloads', side_effect=self.fake_downloads):
+            response = self.stream('3333333333333333')
+            self.assertEqual(self.stream('3333333333333333').status_code, 409)
+            response.close()
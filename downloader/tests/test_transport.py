@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..scheduler import PRIORITY_PLAYLIST, PRIORITY_VIDEO
+from ..transport import BandwidthShaper, get_transport, get_transport_opts
+
+
+class BandwidthShaperTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.sleeps = []
+        # the module's own clock, patching time itself would catch other threads' sleeps
+        clock = mock.Mock(monotonic=lambda: self.now, sleep=self.sleeps.append)
+        patcher = mock.patch('downloader.transport.time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shaper = BandwidthShaper(rate=1000, burst=1.0, weights={PRIORITY_VIDEO: 4, PRIORITY_PLAYLIST: 1})
+
+    def test_no_limit(self):
+        shaper = BandwidthShaper()
+        with shaper.flow('job') as flow:
+            shaper.consume(flow, 10 ** 9)
+
+        self.assertEqual(self.sleeps, [])
+
+    def test_limit_is_shared_by_weight(self):
+        with self.shaper.flow('video', PRIORITY_VIDEO) as video:
+            self.assertEqual(self.shaper.share(video), 1000)
+            with self.shaper.flow('playlist', PRIORITY_PLAYLIST) as playlist:
+                self.assertEqual(self.shaper.share(video), 800)
+                self.assertEqual(self.shaper.share(playlist), 200)
+            self.assertEqual(self.shaper.share(video), 1000)
+
+    def test_streams_of_one_job_share_a_flow(self):
+        with self.shaper.flow('job') as video_stream, self.shaper.flow('job') as audio_stream:
+            self.assertIs(video_stream, audio_stream)
+            self.assertEqual(video_stream.users, 2)
+        self.assertEqual(self.shaper._flows, {})
+
+    def test_burst_then_paced(self):
+        with self.shaper.flow('job') as flow:
+            self.shaper.consume(flow, 1000)
+            self.assertEqual(self.sleeps, [])
+
+            self.shaper.consume(flow, 500)
+            self.assertEqual(self.sleeps, [1.0])
+
+            # the bucket refills with time
+            self.now += 10
+            self.sleeps.clear()
+            self.shaper.consume(flow, 1000)
+            self.assertEqual(self.sleeps, [])
+
+    def test_idle_link_can_be_borrowed(self):
+        with self.shaper.flow('video', PRIORITY_VIDEO), self.shaper.flow('playlist', PRIORITY_PLAYLIST) as playlist:
+            # over its 200 B/s share, but the video leaves the link unused
+            self.shaper.consume(playlist, 800)
+
+        self.assertEqual(self.sleeps, [])
+
+    def test_progress_hook_pays_for_new_bytes_only(self):
+        with self.shaper.flow('job') as flow, mock.patch.object(self.shaper, 'consume') as consume:
+            hook = flow.progress_hook()
+            hook({'status': 'downloading', 'downloaded_bytes': 300})
+            hook({'status': 'downloading', 'downloaded_bytes': 200})
+            hook({'status': 'downloading', 'downloaded_bytes': 700})
+            hook({'status': 'finished', 'downloaded_bytes': 1000})
+
+        self.assertEqual([c.args[1] for c in consume.call_args_list], [300, 400])
+
+
+class TransportTests(SimpleTestCase):
+    def test_overrides(self):
+        transport = get_transport({'connections': 1})
+
+        self.assertEqual(transport['connections'], 1)
+        self.assertIn('segment_size', transport)
+
+    def test_yt_dlp_options(self):
+        opts = get_transport_opts({'concurrent_fragments': 0, 'http_chunk_size': 1024})
+
+        self.assertEqual(opts['concurrent_fragment_downloads'], 1)
+        self.assertEqual(opts['http_chunk_size'], 1024)
+        self.assertNotIn('http_chunk_size', get_transport_opts({'http_chunk_size': None}))
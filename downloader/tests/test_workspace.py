@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+import time
+
+from django.test import SimpleTestCase
+
+from ..workspace import MARKER, WorkspaceManager
+
+
+class WorkspaceManagerTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.manager = self.make_manager()
+
+    def make_manager(self, **kwargs):
+        manager = WorkspaceManager(self.tmp.name, **{'quota_bytes': 10 ** 9, 'artifact_ttl': 3600, **kwargs})
+        # sweeps are run by hand
+        manager._start_janitor = lambda: None
+        return manager
+
+    def write(self, path, size=100, age=0):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        if age:
+            past = time.time() - age
+            os.utime(path, (past, past))
+        return path
+
+    def marker(self, path):
+        with open(os.path.join(path, MARKER)) as f:
+            return json.load(f)
+
+    def expire(self, path):
+        marker = self.marker(path)
+        marker['expires_at'] = time.time() - 1
+        with open(os.path.join(path, MARKER), 'w') as f:
+            json.dump(marker, f)
+
+    def test_workspaces_are_unique_and_marked(self):
+        first = self.manager.create('video/../1')
+        second = self.manager.create('video/../1')
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(os.path.dirname(first), self.tmp.name)
+        self.assertEqual(self.marker(first)['state'], 'running')
+        self.assertEqual(self.marker(first)['job_id'], 'video/../1')
+
+    def test_keep_and_resolve(self):
+        path = self.manager.create('playlist')
+        self.write(os.path.join(path, 'playlist.zip'))
+
+        self.manager.keep(path, ttl=60)
+
+        self.assertEqual(self.marker(path)['state'], 'kept')
+        name = os.path.basename(path)
+        self.assertEqual(self.manager.resolve(name, 'playlist.zip'), os.path.join(path, 'playlist.zip'))
+        self.assertIsNone(self.manager.resolve('..', 'playlist.zip'))
+        self.assertIsNone(self.manager.resolve(name, '../playlist.zip'))
+        self.assertIsNone(self.manager.resolve(name, 'missing.zip'))
+
+    def test_release(self):
+        path = self.manager.create('video')
+
+        self.manager.release(path)
+
+        self.assertFalse(os.path.exists(path))
+
+    def test_sweep_removes_expired_workspaces_only(self):
+        other_process = self.make_manager()
+        expired = other_process.create('dead')
+        self.expire(expired)
+        running = other_process.create('running')
+        kept = self.manager.create('kept')
+        self.manager.keep(kept)
+
+        result = self.manager.sweep()
+
+        self.assertEqual(result['removed'], 1)
+        self.assertFalse(os.path.exists(expired))
+        self.assertTrue(os.path.exists(running))
+        self.assertTrue(os.path.exists(kept))
+
+    def test_sweep_keeps_our_running_workspaces_alive(self):
+        path = self.manager.create('video')
+        self.expire(path)
+
+        self.manager.sweep()
+
+        self.assertTrue(os.path.exists(path))
+        self.assertGreater(self.marker(path)['expires_at'], time.time())
+
+    def test_stale_partials_are_removed_from_kept_workspaces(self):
+        path = self.manager.create('playlist')
+        stale = self.write(os.path.join(path, '1', 'video.mp4.part'), age=self.manager.stale_ttl + 60)
+        fresh = self.write(os.path.join(path, '2', 'video.mp4.part'))
+        fragment = self.write(os.path.join(path, '3', 'video.mp4.part-Frag12'), age=self.manager.stale_ttl + 60)
+        artifact = self.write(os.path.join(path, 'playlist.zip'), age=self.manager.stale_ttl + 60)
+        self.manager.keep(path)
+
+        self.manager.sweep()
+
+        self.assertFalse(os.path.exists(stale))
+        self.assertFalse(os.path.exists(fragment))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(artifact))
+        self.assertEqual(self.manager.partial_files(path), {os.path.join('2', 'video.mp4.part'): 100})
+
+    def test_leftovers_from_before_workspaces(self):
+        old = self.write(os.path.join(self.tmp.name, 'old.mp4'), age=7200)
+        recent = self.write(os.path.join(self.tmp.name, 'recent.mp4'))
+
+        self.manager.sweep()
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+
+    def test_over_the_watermark_kept_artifacts_go_soonest_expiring_first(self):
+        manager = self.make_manager(quota_bytes=1000, high_watermark=0.5)
+        first = manager.create('first')
+        self.write(os.path.join(first, 'a.zip'), size=300)
+        manager.keep(first, ttl=60)
+        second = manager.create('second')
+        self.write(os.path.join(second, 'b.zip'), size=300)
+        manager.keep(second, ttl=600)
+        self.assertFalse(manager.has_room())
+
+        manager.sweep()
+
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+        self.assertTrue(manager.has_room())
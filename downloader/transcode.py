@@ -0,0 +1,163 @@
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+from django.conf import settings
+
+from .metrics import time_stage
+from .scheduler import job_scheduler
+
+# codecs playlists can be converted to, by the name the page sends
+AUDIO_CODECS = {
+    'mp3': {'acodec': 'libmp3lame', 'ext': 'mp3', 'ar': 44100},
+    # libopus only takes 48 kHz and below, and loudnorm resamples to 192 kHz
+    'opus': {'acodec': 'libopus', 'ext': 'opus', 'ar': 48000},
+}
+AUDIO_BITRATES = getattr(settings, 'AUDIO_BITRATES', (96, 128, 160, 192, 256, 320))
+AUDIO_DEFAULT_BITRATE = getattr(settings, 'AUDIO_DEFAULT_BITRATE', 192)
+# EBU R128 targets of the loudnorm filter, None keeps the original loudness
+AUDIO_LOUDNORM = getattr(settings, 'AUDIO_LOUDNORM', {'I': -16, 'TP': -1.5, 'LRA': 11})
+TRANSCODE_WORKERS = getattr(settings, 'TRANSCODE_WORKERS', None) or os.cpu_count() or 2
+
+
+def get_audio_output(codec: str, bitrate=None) -> dict:
+    """
+    Validate the audio output the user asked for.
+
+    Args:
+        codec (str): Key of AUDIO_CODECS, empty or 'original' to keep the downloaded stream
+        bitrate: Bitrate in kbps, one of AUDIO_BITRATES, defaults to AUDIO_DEFAULT_BITRATE
+
+    Returns:
+        dict: 'codec' and 'bitrate', or None to keep the downloaded stream
+
+    Raises:
+        ValueError: If the codec or bitrate isn't supported
+    """
+    if not codec or codec == 'original':
+        return None
+    if codec not in AUDIO_CODECS:
+        raise ValueError(f"Unknown audio codec {codec}")
+    bitrate = int(bitrate or AUDIO_DEFAULT_BITRATE)
+    if bitrate not in AUDIO_BITRATES:
+        raise ValueError(f"Unsupported audio bitrate {bitrate}")
+    return {'codec': codec, 'bitrate': bitrate}
+
+
+def get_audio_tags(info_dict: dict, position: int = None, album: str = None) -> dict:
+    """
+    Metadata written into a converted file, from a yt-dlp info dict.
+
+    Args:
+        info_dict (dict): yt-dlp info dict of the video
+        position (int): Track number, the position in the playlist
+        album (str): Album name, e.g. the playlist title
+
+    Returns:
+        dict: ffmpeg metadata keys and values, empty ones left out
+    """
+    upload_date = info_dict.get('upload_date') or ''
+    tags = {
+        'title': info_dict.get('track') or info_dict.get('title'),
+        'artist': info_dict.get('artist') or info_dict.get('uploader') or info_dict.get('channel'),
+        'album': info_dict.get('album') or album,
+        'track': position,
+        'date': upload_date[:4],
+        'comment': info_dict.get('webpage_url'),
+    }
+    return {key: str(value) for key, value in tags.items() if value}
+
+
+def transcode_audio(source_path: str, codec: str, bitrate: int, tags: dict = None) -> str:
+    """
+    Convert a downloaded audio (or video) file in a single ffmpeg pass.
+
+    Loudness normalization and tagging happen in the same pass as the
+    encode, so every file is decoded exactly once. The source is removed
+    once the conversion succeeded.
+
+    Args:
+        source_path (str): Downloaded file
+        codec (str): Key of AUDIO_CODECS
+        bitrate (int): Target bitrate in kbps
+        tags (dict): Metadata to write, see get_audio_tags
+
+    Returns:
+        str: Path of the converted file, next to the source
+
+    Raises:
+        ffmpeg.Error: If ffmpeg failed
+    """
+    encoder = AUDIO_CODECS[codec]
+    output_path = f"{os.path.splitext(source_path)[0]}.{encoder['ext']}"
+    if output_path == source_path:
+        output_path = f"{os.path.splitext(source_path)[0]}_{bitrate}k.{encoder['ext']}"
+
+    audio = ffmpeg.input(source_path).audio
+    if AUDIO_LOUDNORM:
+        audio = audio.filter('loudnorm', **AUDIO_LOUDNORM)
+    output_args = {
+        'acodec': encoder['acodec'],
+        'audio_bitrate': f"{bitrate}k",
+        'ar': encoder['ar'],
+        # tags of the source (often odd ones from the uploader) are replaced, not merged
+        'map_metadata': -1,
+        'loglevel': 'error',
+    }
+    if codec == 'mp3':
+        # the ID3 version most players read
+        output_args['id3v2_version'] = 3
+    for index, (key, value) in enumerate((tags or {}).items()):
+        # ffmpeg-python needs distinct keys for a repeated option
+        output_args[f'metadata:g:{index}'] = f"{key}={value}"
+
+    stream = ffmpeg.output(audio, output_path, **output_args)
+    with job_scheduler.merge_slot(), time_stage('transcode'):
+        ffmpeg.run(stream, overwrite_output=True, capture_stderr=True)
+    os.remove(source_path)
+    return output_path
+
+
+class AudioTranscoder:
+    """
+    Pool of ffmpeg audio conversions shared by every playlist job.
+
+    Conversions run next to the downloads of the same playlist, each item
+    being converted as soon as it has been downloaded. At most max_workers
+    ffmpeg processes are started by the pool, and each one holds one of the
+    scheduler's CPU-bound slots, so conversions and merges together never
+    run more encoders than there are cores.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, source_path: str, codec: str, bitrate: int, tags: dict = None):
+        """
+        Queue a conversion.
+
+        Returns:
+            Future: Resolves to the converted file's path, or None if the conversion failed
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='audio-transcode'
+                )
+        return self._executor.submit(self._transcode, source_path, codec, bitrate, tags)
+
+    def _transcode(self, source_path, codec, bitrate, tags):
+        try:
+            return transcode_audio(source_path, codec, bitrate, tags)
+        except Exception as e:
+            stderr = getattr(e, 'stderr', None)
+            print(f"Transcode error: {stderr.decode(errors='replace') if stderr else ''}\n{traceback.format_exc()}")
+            return None
+
+
+audio_transcoder = AudioTranscoder(max_workers=TRANSCODE_WORKERS)
@@ -0,0 +1,206 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .metrics import THROTTLED_SECONDS
+from .scheduler import PRIORITY_PLAYLIST, PRIORITY_VIDEO
+
+# bytes per second shared by every download of the process, None for no limit
+DOWNLOAD_BANDWIDTH_LIMIT = getattr(settings, 'DOWNLOAD_BANDWIDTH_LIMIT', None)
+# seconds of the limit a bucket can save up and spend at once
+DOWNLOAD_BANDWIDTH_BURST = getattr(settings, 'DOWNLOAD_BANDWIDTH_BURST', 1.0)
+# share of the limit a job gets, relative to the other jobs downloading, by scheduler priority
+DOWNLOAD_PRIORITY_WEIGHTS = getattr(settings, 'DOWNLOAD_PRIORITY_WEIGHTS', {PRIORITY_VIDEO: 4, PRIORITY_PLAYLIST: 1})
+DOWNLOAD_TRANSPORT = {
+    'concurrent_fragments': 4,
+    'http_chunk_size': 10 * 1024 * 1024,
+    'connections': 4,
+    'segment_size': 4 * 1024 * 1024,
+    'segment_retries': 3,
+    **getattr(settings, 'DOWNLOAD_TRANSPORT', {}),
+}
+
+
+def get_transport(transport: dict = None) -> dict:
+    """
+    Transport settings of one job.
+
+    Args:
+        transport (dict): Overrides of DOWNLOAD_TRANSPORT for the job, with the keys
+            'concurrent_fragments' (fragments of a DASH/HLS stream fetched at the same time),
+            'http_chunk_size' (bytes per ranged request, None or 0 for a single request),
+            'connections' (connections a plain HTTP stream is fetched over, 1 to leave it to yt-dlp),
+            'segment_size' (bytes per range of those connections) and
+            'segment_retries' (attempts per range after the first one)
+
+    Returns:
+        dict: Every key of DOWNLOAD_TRANSPORT
+    """
+    return {**DOWNLOAD_TRANSPORT, **(transport or {})}
+
+
+def get_transport_opts(transport: dict = None) -> dict:
+    """
+    yt-dlp options of the download transport.
+
+    Args:
+        transport (dict): Overrides of DOWNLOAD_TRANSPORT for one job, see get_transport()
+
+    Returns:
+        dict: yt-dlp options
+    """
+    transport = get_transport(transport)
+    opts = {'concurrent_fragment_downloads': max(1, int(transport.get('concurrent_fragments') or 1))}
+    if transport.get('http_chunk_size'):
+        opts['http_chunk_size'] = int(transport['http_chunk_size'])
+    return opts
+
+
+class Flow:
+    """
+    One job's share of the bandwidth, see BandwidthShaper.flow().
+
+    Both streams of a video download draw from the same flow, so a job
+    fetching video and audio side by side isn't counted twice.
+    """
+
+    def __init__(self, shaper, job_id: str, priority: int, weight: float):
+        self.shaper = shaper
+        self.job_id = job_id
+        self.priority = priority
+        self.weight = weight
+        self.users = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def progress_hook(self):
+        """
+        yt-dlp progress hook that paces a download to the flow.
+
+        yt-dlp calls its hooks from the download loop after every block (of
+        every fragment, with concurrent fragments), so sleeping in the hook
+        holds back the next read.
+
+        Returns:
+            callable: Progress hook, one per stream since it tracks the stream's downloaded bytes
+        """
+        lock = threading.Lock()
+        seen = [0]
+
+        def hook(d):
+            if self.shaper.rate is None or d.get('status') != 'downloading':
+                return
+            with lock:
+                downloaded = d.get('downloaded_bytes') or 0
+                # fragment hooks of concurrent threads can arrive out of order
+                amount = downloaded - seen[0]
+                if amount <= 0:
+                    return
+                seen[0] = downloaded
+            self.shaper.consume(self, amount)
+        return hook
+
+
+class BandwidthShaper:
+    """
+    Token bucket bandwidth limit shared by every download job of the process.
+
+    The limit is split between the jobs currently downloading by weight
+    (DOWNLOAD_PRIORITY_WEIGHTS, so single videos someone is waiting on get
+    more than playlist items), each job pacing itself to its share with a
+    bucket of its own. A job may go over its share while the shared bucket
+    has tokens left, i.e. while other jobs leave part of the limit unused,
+    so the link stays full; once the shared bucket runs dry, every job falls
+    back to its share until what it borrowed is paid back.
+
+    Bytes are paid for after they have been read, the bucket going into debt
+    and the reader sleeping until it's even again, so blocks of any size
+    can be paced.
+
+    Args:
+        rate (float): Bytes per second, None for no limit
+        burst (float): Seconds of the rate a bucket can save up
+        weights (dict): Weight by scheduler priority, unknown priorities weigh 1
+    """
+
+    def __init__(self, rate: float = None, burst: float = 1.0, weights: dict = None):
+        self.rate = rate
+        self.burst = burst
+        self.weights = weights or {}
+        self._flows = {}
+        self._tokens = (rate or 0) * burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def flow(self, job_id: str, priority: int = PRIORITY_VIDEO):
+        """
+        Register a job as downloading for the duration of the block.
+
+        Args:
+            job_id (str): Download ID, the same ID used twice shares one flow
+            priority (int): Scheduler priority of the job
+
+        Yields:
+            Flow: The job's flow
+        """
+        with self._lock:
+            flow = self._flows.get(job_id)
+            if flow is None:
+                flow = Flow(self, job_id, priority, self.weights.get(priority, 1))
+                self._flows[job_id] = flow
+            flow.users += 1
+        try:
+            yield flow
+        finally:
+            with self._lock:
+                flow.users -= 1
+                if flow.users <= 0:
+                    self._flows.pop(job_id, None)
+
+    def share(self, flow: Flow) -> float:
+        """Bytes per second the flow gets while every registered job is downloading"""
+        with self._lock:
+            return self._share(flow)
+
+    def consume(self, flow: Flow, amount: int):
+        """
+        Pay for bytes a flow has read, sleeping if it went over the limit.
+
+        Args:
+            flow (Flow): Flow the bytes were read by
+            amount (int): Bytes read
+        """
+        rate = self.rate
+        if rate is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            share = self._share(flow)
+            self._tokens = min(rate * self.burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            flow.tokens = min(share * self.burst, flow.tokens + (now - flow.updated) * share)
+            flow.updated = now
+
+            self._tokens -= amount
+            # borrowing is capped, a job that had the link to itself isn't punished for long
+            flow.tokens = max(-share * self.burst, flow.tokens - amount)
+            if self._tokens >= 0 or flow.tokens >= 0:
+                return
+            delay = max(-flow.tokens / share, -self._tokens / rate)
+        THROTTLED_SECONDS.inc(delay, priority=flow.priority)
+        time.sleep(delay)
+
+    def _share(self, flow):
+        # caller holds self._lock
+        total = sum(other.weight for other in self._flows.values()) or flow.weight
+        return self.rate * flow.weight / total if self.rate else 0
+
+
+bandwidth = BandwidthShaper(
+    rate=DOWNLOAD_BANDWIDTH_LIMIT,
+    burst=DOWNLOAD_BANDWIDTH_BURST,
+    weights=DOWNLOAD_PRIORITY_WEIGHTS,
+)
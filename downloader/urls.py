@@ -7,8 +7,14 @@ urlpatterns = [
     path('download/', views.download_vid, name='download'),
     path('download-playlist/', views.download_playlist, name='download_playlist'),
     path('check-progress/', views.check_download_progress, name='check_progress'),
-    path('download-zip/<str:filename>/', views.download_zip, name='download_zip'),
+    path('download-zip/<str:workspace>/<str:filename>/', views.download_zip, name='download_zip'),
+    path('stream-playlist/', views.stream_playlist, name='stream_playlist'),
+    path('playlist-page/', views.playlist_page, name='playlist_page'),
+    path('playlist-formats/', views.playlist_formats, name='playlist_formats'),
+    path('cancel-prefetch/', views.cancel_prefetch, name='cancel_prefetch'),
     path('check-video-progress/', views.check_video_progress, name='check_video_progress'),
+    path('progress-events/', views.progress_events, name='progress_events'),
     path('start-download/', views.start_download, name='start_download'),
     path('get-download-file/', views.get_download_file, name='get_download_file'),
+    path('metrics', views.export_metrics, name='metrics'),
 ]
\ No newline at end of file
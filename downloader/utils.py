@@ -1,15 +1,46 @@
+import copy
 import os
-import subprocess
+import re
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-from django.http import FileResponse
-from django.shortcuts import render
-from django.contrib import messages
+from django.conf import settings
 import yt_dlp
-import json
+import zipfile
 import ffmpeg
 
-download_progress = {}
+from .cache import video_info_cache
+from .formats import CONTAINER_CODECS, FormatIndex, codec_family, container_fits
+from .metrics import DOWNLOADED_BYTES, SERVED_BYTES, time_stage
+from .progress import progress_store, ProgressReporter
+from .scheduler import job_scheduler, PRIORITY_VIDEO
+from .singleflight import extraction_flight
+from .segmented import RangeNotSupported, SegmentedDownload, can_segment
+from .transport import bandwidth, get_transport, get_transport_opts
+
+VIDEO_ID_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/|/v/)([0-9A-Za-z_-]{11})')
+PLAYLIST_ID_PATTERN = re.compile(r'[?&]list=([\w-]+)')
+
+TRANSCODE_ENCODERS = {
+    'mp4': {'video': 'libx264', 'audio': 'aac'},
+    'webm': {'video': 'libvpx-vp9', 'audio': 'libopus'},
+    'mkv': {'video': 'libx264', 'audio': 'aac'},
+}
+MERGE_CONTAINER = getattr(settings, 'MERGE_CONTAINER', None)
+PLAYLIST_PAGE_SIZE = getattr(settings, 'PLAYLIST_PAGE_SIZE', 50)
+# ffmpeg muxers that can write to a pipe
+PIPE_FORMATS = {
+    'mp4': 'mp4',
+    'webm': 'webm',
+    'mkv': 'matroska',
+}
+
+# never rendered or needed to download, and they make up most of the info dict
+UNUSED_INFO_KEYS = {
+    'automatic_captions', 'subtitles', 'thumbnails', 'heatmap', 'description',
+    'tags', 'categories', 'chapters', 'requested_formats', 'requested_subtitles',
+}
 
 def validate_youtube_url(url: str) -> str:
     """validates the url put by the user.
@@ -30,200 +61,628 @@ def validate_youtube_url(url: str) -> str:
         print(f"URL validation failed: \n{traceback.format_exc()}")
         return "Invalid url"
 
-def extract_video_info(url: str) -> dict:
+def get_video_id(url: str) -> str:
+    """
+    Canonical video ID for a YouTube URL, used as the cache key.
+
+    Args:
+        url (str): YouTube video URL
+
+    Returns:
+        str: The 11 character video ID, or the URL itself if none was found
+    """
+    match = VIDEO_ID_PATTERN.search(url or '')
+    return match.group(1) if match else url
+
+def get_playlist_id(url: str) -> str:
+    """
+    Canonical playlist ID for a YouTube URL, so the same playlist opened
+    through different URLs is stored once.
+
+    Args:
+        url (str): YouTube playlist URL
+
+    Returns:
+        str: The list ID, or the URL itself if none was found
+    """
+    match = PLAYLIST_ID_PATTERN.search(url or '')
+    return match.group(1) if match else url
+
+def _trim_info_dict(info_dict: dict) -> dict:
+    """Drop the bulky parts of a yt-dlp info dict that we never use"""
+    info_dict = yt_dlp.YoutubeDL.sanitize_info(info_dict)
+    return {key: value for key, value in info_dict.items() if key not in UNUSED_INFO_KEYS}
+
+def get_video_info_dict(url: str, use_cache: bool = True) -> dict:
+    """
+    Raw yt-dlp info dict for a video, served from the metadata cache when possible.
+
+    Args:
+        url (str): YouTube video URL
+        use_cache (bool): Set to False to force a fresh extraction
+
+    Returns:
+        dict: Cache entry with 'info' and 'video_details' keys
+    """
+    video_id = get_video_id(url)
+    if use_cache:
+        entry = video_info_cache.get(video_id)
+        if entry is not None:
+            return entry
+
+    # concurrent misses for the same video share a single extraction
+    return extraction_flight.do(video_id, _extract_info_entry, url, video_id)
+
+def _extract_info_entry(url: str, video_id: str) -> dict:
+    """Run yt-dlp for a video and cache the result"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'nooverwrites': True,
+        'no_color': True,
+    }
+
+    with time_stage('extract'), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info_dict = _trim_info_dict(ydl.extract_info(url, download=False))
+
+    entry = {
+        'info': info_dict,
+        'video_details': build_video_details(info_dict, url),
+    }
+    video_info_cache.set(video_id, entry)
+    return entry
+
+def extract_video_info(url: str, use_cache: bool = True) -> dict:
     """
     Gets video info.
     
     Args:
         url (str): YouTube video URL
+        use_cache (bool): Set to False to bypass the metadata cache
     
     Returns:
         dict: Video information or None if it encoutered an error
     """
     try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'nooverwrites': True,
-            'no_color': True,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=False)
-            
-            video_details = {
-                'title': info_dict.get('title', 'Unknown Title'),
-                'thumbnail': info_dict.get('thumbnail', ''),
-                'formats': [],
-                'url': url
-            }
-            
-            video_formats = []
-            audio_formats = []
-            video_dictionary = {}
-            
-            for format in info_dict.get('formats', []):
-                if format.get('ext') in ['mp4', 'webm', 'm4a']:
-                    format_info = {
-                        'format_id': format.get('format_id', ''),
-                        'resolution': format.get('resolution', 'Unknown'),
-                        'ext': format.get('ext', ''),
-                        'filesize': get_filesize(format.get('filesize', 0)),
-                        'tbr': format.get('tbr', 0),
-                        'vcodec': format.get('vcodec', 'None'),
-                        'acodec': format.get('acodec', 'None'),
-                    }
-                    
-                    if format_info['filesize'] == "Unknown":
-                        continue
-                    
-                    if format_info['vcodec'] != 'none' and format_info['acodec'] == 'none':
-                        video_formats.append(format_info)
-                    elif format_info['acodec'] != 'none' and format_info['vcodec'] == 'none':
-                        audio_formats.append(format_info)
-            
-            video_formats = [i for i in video_formats if i['ext'] == 'mp4']
-            actual_videos = []
-            for video in video_formats:
-                video_dictionary[video['resolution'] + "-" + video['filesize']] = 1
-            
-            for v in video_dictionary.keys():
-                temp_videos = []
-                for video in video_formats:
-                    if video['resolution'] == v.split('-')[0] and video['filesize'] == v.split('-')[1]:
-                        temp_videos.append(video)
-                actual_videos.append(temp_videos[-1])
-            
-            audio_dictionary = {}
-            actual_audios = []
-            for audio in audio_formats:
-                audio_dictionary[audio['ext']] = 1
-            for v in audio_dictionary.keys():
-                temp_audios = []
-                for audio in audio_formats:
-                    if audio['ext'] == v.split('-')[0]:
-                        temp_audios.append(audio)
-                actual_audios.append(temp_audios[-1])
-            
-            video_formats = actual_videos
-            audio_formats = actual_audios
-            for video in video_formats:
-                for audio in audio_formats[-1:]:
-                    combined_format = video.copy()
-                    combined_format['format_id'] = f"{video['format_id']}+{audio['format_id']}"
-                    combined_format['audio_format_id'] = audio['format_id']
-                    combined_format['type'] = 'video'
-                    video_details['formats'].append(combined_format)
-            for audio in audio_formats[:]:
-                combined_format = audio.copy()
-                combined_format['format_id'] = f"{audio['format_id']}"
-                combined_format['audio_format_id'] = audio['format_id']
-                combined_format['type'] = 'audio'
-                video_details['formats'].append(combined_format)
-            return video_details
+        video_details = get_video_info_dict(url, use_cache)['video_details']
+        return {**video_details, 'url': url, 'formats': [dict(f) for f in video_details['formats']]}
     
     except Exception as e:
         print(f"Error while extracting video info: {traceback.format_exc()}")
         return None
 
-def download_video(url: str, format_id: str, download_dir: str, audio_format_id: str = None) -> tuple:
+def _format_row(indexed, resolution: str) -> dict:
+    """Fields of a format shown in the format table"""
+    format = indexed.format
+    return {
+        'format_id': indexed.format_id,
+        'resolution': format.get('resolution') or resolution,
+        'ext': indexed.ext,
+        'filesize': get_filesize(indexed.size),
+        'tbr': format.get('tbr', 0),
+        'vcodec': format.get('vcodec', 'None'),
+        'acodec': format.get('acodec', 'None'),
+    }
+
+def build_video_details(info_dict: dict, url: str) -> dict:
     """
-    Download video after use selects format and resolution
+    Turns a yt-dlp info dict into the format list shown to the user.
+
+    Args:
+        info_dict (dict): yt-dlp info dict
+        url (str): YouTube video URL
+
+    Returns:
+        dict: Video title, thumbnail and downloadable formats
+    """
+    video_details = {
+        'title': info_dict.get('title', 'Unknown Title'),
+        'thumbnail': info_dict.get('thumbnail', ''),
+        'formats': [],
+        'url': url
+    }
+    
+    index = FormatIndex.from_info(info_dict)
+    
+    # one row per resolution: its highest bitrate mp4 stream, merged with
+    # the best audio mp4 can hold
+    videos = {}
+    for video in index.video:
+        if video.ext != 'mp4':
+            continue
+        resolution = video.format.get('resolution', 'Unknown')
+        if resolution not in videos or video.tbr >= videos[resolution].tbr:
+            videos[resolution] = video
+    audio = index.best_audio(container='mp4')
+    
+    # and one per audio container
+    audios = {}
+    for candidate in index.audio:
+        if candidate.ext in ('m4a', 'webm') and (candidate.ext not in audios or candidate.abr >= audios[candidate.ext].abr):
+            audios[candidate.ext] = candidate
+    
+    for resolution, video in videos.items():
+        format_info = _format_row(video, resolution)
+        format_info['filesize'] = get_filesize(video.size + (audio.size if audio else 0))
+        format_info['format_id'] = f"{video.format_id}+{audio.format_id}" if audio else video.format_id
+        format_info['audio_format_id'] = audio.format_id if audio else None
+        format_info['type'] = 'video'
+        video_details['formats'].append(format_info)
+    for candidate in audios.values():
+        format_info = _format_row(candidate, 'audio only')
+        format_info['audio_format_id'] = candidate.format_id
+        format_info['type'] = 'audio'
+        video_details['formats'].append(format_info)
+    return video_details
+
+def get_format(url: str, format_id: str) -> dict:
+    """
+    Raw yt-dlp format dict, looked up in the cached info dict.
+
+    Args:
+        url (str): YouTube video URL
+        format_id (str): yt-dlp format ID
+
+    Returns:
+        dict: The format, or an empty dict if it is unknown
     """
     try:
-        download_id = f"{url}_{format_id}+{audio_format_id}"
+        for format in get_video_info_dict(url)['info'].get('formats', []):
+            if format.get('format_id') == format_id:
+                return format
+    except Exception as e:
+        print(f"Error while looking up format: {traceback.format_exc()}")
+    return {}
+
+def get_format_ext(url: str, format_id: str) -> str:
+    """
+    File extension yt-dlp will use for a format.
+
+    Args:
+        url (str): YouTube video URL
+        format_id (str): yt-dlp format ID
+
+    Returns:
+        str: Extension like 'mp4', or '' if the format is unknown
+    """
+    return get_format(url, format_id).get('ext', '')
+
+def plan_merge(video_format: dict, audio_format: dict, container: str = None) -> dict:
+    """
+    Picks the cheapest way to merge a video and an audio stream.
+
+    Stream copy is always preferred: into the video's own container if it can
+    hold both codecs, otherwise into the first of mp4, webm and mkv that can.
+    Streams are only transcoded when a container is forced and can't hold the codec.
 
-        def progress_hook(d):
-            if d['status'] == 'downloading':
+    Args:
+        video_format (dict): yt-dlp format dict of the video stream
+        audio_format (dict): yt-dlp format dict of the audio stream
+        container (str): Output container to force, None to pick automatically
+
+    Returns:
+        dict: 'container', 'vcodec' and 'acodec' (ffmpeg encoder or 'copy') and
+            'operation' ('remux' or 'transcode')
+    """
+    vcodec = codec_family(video_format.get('vcodec'))
+    acodec = codec_family(audio_format.get('acodec'))
+
+    if container:
+        candidates = [container]
+    else:
+        candidates = []
+        for ext in [video_format.get('ext'), 'mp4', 'webm', 'mkv']:
+            ext = 'mp4' if ext == 'm4a' else ext
+            if ext in CONTAINER_CODECS and ext not in candidates:
+                candidates.append(ext)
+
+    for candidate in candidates:
+        if container_fits(candidate, 'video', vcodec) and container_fits(candidate, 'audio', acodec):
+            return {
+                'container': candidate,
+                'vcodec': 'copy',
+                'acodec': 'copy',
+                'operation': 'remux',
+                'video_codec': vcodec,
+                'audio_codec': acodec,
+            }
+
+    encoders = TRANSCODE_ENCODERS.get(container, TRANSCODE_ENCODERS['mp4'])
+    return {
+        'container': container,
+        'vcodec': 'copy' if container_fits(container, 'video', vcodec) else encoders['video'],
+        'acodec': 'copy' if container_fits(container, 'audio', acodec) else encoders['audio'],
+        'operation': 'transcode',
+        'video_codec': vcodec,
+        'audio_codec': acodec,
+    }
+
+def get_output_plan(url: str, video_format_id: str, audio_format_id: str = None) -> dict:
+    """
+    Output container and merge plan for a download, from the cached format metadata.
+
+    Args:
+        url (str): YouTube video URL
+        video_format_id (str): yt-dlp video (or audio only) format ID
+        audio_format_id (str): yt-dlp audio format ID, None for single stream downloads
+
+    Returns:
+        dict: plan_merge result, or just 'container' and operation 'none' for single streams
+    """
+    video_format = get_format(url, video_format_id)
+    if not audio_format_id:
+        return {
+            'container': video_format.get('ext', ''),
+            'operation': 'none',
+        }
+    return plan_merge(video_format, get_format(url, audio_format_id), MERGE_CONTAINER)
+
+def _fetch_stream(info_dict: dict, format_id: str, outtmpl: str, progress_hook, stream: str = 'video',
+                  transport: dict = None, flow=None) -> str:
+    """
+    Download one stream of an already extracted video.
+
+    Plain HTTP streams of a known size are fetched in byte ranges over
+    several connections (see SegmentedDownload), everything else by yt-dlp.
+    Either way the file gets yt-dlp's fixups.
+
+    Args:
+        info_dict (dict): yt-dlp info dict, it is copied so it can be shared between threads
+        format_id (str): yt-dlp format ID
+        outtmpl (str): yt-dlp output template
+        progress_hook (callable): yt-dlp progress hook
+        stream (str): 'video' or 'audio', the stage the download is timed as
+        transport (dict): Per job overrides of DOWNLOAD_TRANSPORT, see get_transport()
+        flow (Flow): Bandwidth flow of the job the download is paced to, None for no pacing
+
+    Returns:
+        str: Path of the downloaded file
+    """
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'format': format_id,
+        'outtmpl': outtmpl,
+        'progress_hooks': [progress_hook] + ([flow.progress_hook()] if flow else []),
+        **get_transport_opts(transport),
+    }
+    transport = get_transport(transport)
+    format = next((f for f in info_dict.get('formats', []) if f.get('format_id') == format_id), {})
+    with job_scheduler.download_slot():
+        with time_stage(f'{stream}_fetch'), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            segmented = can_segment(format, transport['connections'], transport['segment_size'])
+            if segmented:
+                result = ydl.process_ie_result(copy.deepcopy(info_dict), download=False)
+                path = ydl.prepare_filename(result)
                 try:
-                    total = d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0)
-                    downloaded = d.get('downloaded_bytes', 0)
-                    if total > 0:
-                        
-                        
-                        base_percentage = 45 if audio_format_id else 100
-                        percentage = (downloaded / total) * base_percentage
-                        
-                        
-                        stage = download_progress[download_id].get('stage', 'video')
-                        if stage == 'audio':
-                            percentage += 45  
-                        
-                        download_progress[download_id].update({
-                            'status': 'downloading',
-                            'progress': percentage,
-                            'speed': d.get('speed', 0),
-                            'eta': d.get('eta', 0),
-                            'stage': stage
-                        })
-                except:
-                    pass
-            elif d['status'] == 'finished':
-                stage = download_progress[download_id].get('stage', 'video')
-                if stage == 'video' and audio_format_id:
-                    
-                    download_progress[download_id].update({
-                        'status': 'downloading',
-                        'progress': 45,
-                        'stage': 'audio'
-                    })
-                elif stage == 'audio':
-                    
-                    download_progress[download_id].update({
-                        'status': 'downloading',
-                        'progress': 90,
-                        'stage': 'merging'
-                    })
+                    SegmentedDownload(
+                        result['url'],
+                        headers=result.get('http_headers'),
+                        connections=transport['connections'],
+                        segment_size=transport['segment_size'],
+                        retries=transport['segment_retries'],
+                        progress_hooks=ydl_opts['progress_hooks'],
+                    ).download(path, result)
+                except RangeNotSupported:
+                    # the host serves whole files only, one connection it is
+                    segmented = False
                 else:
-                    
-                    download_progress[download_id].update({
-                        'status': 'finished',
-                        'progress': 100,
-                        'stage': 'complete'
-                    })
+                    # yt-dlp finds the file in place and only runs what follows a download
+                    # (FFmpegFixupM4aPP & co), which its default policy skips for files it didn't fetch
+                    fixup_opts = {**ydl_opts, 'progress_hooks': [], 'noprogress': True, 'fixup': 'force'}
+                    with yt_dlp.YoutubeDL(fixup_opts) as fixup_ydl:
+                        fixup_ydl.process_ie_result(copy.deepcopy(info_dict), download=True)
+            if not segmented:
+                result = ydl.process_ie_result(copy.deepcopy(info_dict), download=True)
+                path = ydl.prepare_filename(result)
+    if os.path.exists(path):
+        DOWNLOADED_BYTES.inc(os.path.getsize(path), stream=stream)
+    return path
 
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'format': format_id,
-            'outtmpl': os.path.join(download_dir, '%(title)s_video.%(ext)s'),
-            'progress_hooks': [progress_hook],
-        }
+def make_download_id(url: str, format_id: str, audio_format_id: str = None) -> str:
+    """
+    Progress store key of a single video download, the same one the page listens on.
+
+    It only depends on the canonical video ID and the formats, so every
+    request for the same file ends up on the same key.
+
+    Args:
+        url (str): YouTube video URL
+        format_id (str): yt-dlp video (or audio only) format ID
+        audio_format_id (str): yt-dlp audio format ID, None for single stream downloads
+
+    Returns:
+        str: Download ID
+    """
+    video_id = get_video_id(url)
+    if audio_format_id:
+        return f"{video_id}_{format_id}+{audio_format_id}"
+    return f"{video_id}_{format_id}"
+
+def make_playlist_job_id(playlist_id: str, format_type: str, audio_output: dict = None) -> str:
+    """
+    Scheduler job and progress store key of a playlist download.
+
+    Like make_download_id it only depends on what ends up in the ZIP, so
+    asking for the same playlist in the same format twice lands on the
+    running job, while a different format or conversion is a job of its own.
+
+    Args:
+        playlist_id (str): Canonical playlist ID
+        format_type (str): Key of PLAYLIST_FORMAT_RULES
+        audio_output (dict): get_audio_output result, None to keep the downloaded files
+
+    Returns:
+        str: Job ID
+    """
+    if audio_output:
+        return f"playlist_{playlist_id}_{format_type}_{audio_output['codec']}{audio_output['bitrate']}"
+    return f"playlist_{playlist_id}_{format_type}"
+
+def download_video(url: str, format_id: str, download_dir: str, audio_format_id: str = None,
+                   download_id: str = None, priority: int = PRIORITY_VIDEO, transport: dict = None) -> tuple:
+    """
+    Download video after use selects format and resolution
+
+    The video is extracted once (usually a metadata cache hit) and the video and
+    audio streams are then fetched at the same time from that info dict.
+    Progress is weighted by the bytes of each stream.
+
+    Both streams are paced to the job's share of DOWNLOAD_BANDWIDTH_LIMIT,
+    which depends on its priority.
+
+    Args:
+        download_id (str): Progress store key, defaults to make_download_id()
+        priority (int): Scheduler priority of the job, PRIORITY_VIDEO or PRIORITY_PLAYLIST
+        transport (dict): Per job overrides of DOWNLOAD_TRANSPORT, see get_transport()
+    """
+    download_id = download_id or make_download_id(url, format_id, audio_format_id)
+    try:
+        streams = {'video': (format_id, '%(title)s_video.%(ext)s')}
+        if audio_format_id:
+            streams['audio'] = (audio_format_id, '%(title)s_audio.%(ext)s')
+        # the last 10% is left for merging
+        download_share = 90 if audio_format_id else 100
+        reporter = ProgressReporter(download_id)
         
         
-        download_progress[download_id] = {
+        progress_store.set(download_id, {
             'status': 'downloading',
             'progress': 0,
-            'stage': 'video',
+            'stage': 'download',
             'speed': 0,
             'eta': 0
-        }
+        })
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=True)
-            video_filename = ydl.prepare_filename(info_dict)
+        for attempt in range(2):
+            entry = get_video_info_dict(url, use_cache=attempt == 0)
+            info_dict = entry['info']
+            formats = {f.get('format_id'): f for f in info_dict.get('formats', [])}
+            totals = {
+                name: formats.get(stream_format_id, {}).get('filesize')
+                or formats.get(stream_format_id, {}).get('filesize_approx') or 0
+                for name, (stream_format_id, _) in streams.items()
+            }
+            downloaded = dict.fromkeys(streams, 0)
+            lock = threading.Lock()
+            
+            def make_hook(name):
+                def progress_hook(d):
+                    with lock:
+                        if d['status'] == 'downloading':
+                            totals[name] = d.get('total_bytes') or d.get('total_bytes_estimate') or totals[name]
+                            downloaded[name] = d.get('downloaded_bytes', 0)
+                        elif d['status'] == 'finished':
+                            totals[name] = downloaded[name] = d.get('total_bytes') or downloaded[name] or totals[name]
+                        total = sum(totals.values())
+                        done = sum(downloaded.values())
+                    reporter.report(done, total, scale=download_share, stage='download')
+                return progress_hook
+            
+            try:
+                with bandwidth.flow(download_id, priority) as flow, \
+                        ThreadPoolExecutor(max_workers=len(streams)) as executor:
+                    futures = {
+                        name: executor.submit(
+                            _fetch_stream,
+                            info_dict,
+                            stream_format_id,
+                            os.path.join(download_dir, outtmpl),
+                            make_hook(name),
+                            name,
+                            transport,
+                            flow
+                        )
+                        for name, (stream_format_id, outtmpl) in streams.items()
+                    }
+                    filenames = {name: future.result() for name, future in futures.items()}
+                break
+            except yt_dlp.utils.DownloadError:
+                if attempt == 1:
+                    raise
+                # signed stream URLs in the cached info dict may have expired
+                video_info_cache.invalidate(get_video_id(url))
         
-        audio_filename = None
         if audio_format_id:
-            ydl_opts['format'] = audio_format_id
-            ydl_opts['outtmpl'] = os.path.join(download_dir, '%(title)s_audio.%(ext)s')
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_dict = ydl.extract_info(url, download=True)
-                audio_filename = ydl.prepare_filename(info_dict)
+            reporter.publish(
+                status='downloading',
+                progress=download_share,
+                stage='merging'
+            )
+        else:
+            reporter.publish(
+                status='finished',
+                progress=100,
+                stage='complete'
+            )
         
-        return video_filename, audio_filename
+        return filenames['video'], filenames.get('audio')
     
     except Exception as e:
         print(f"Download error: {traceback.format_exc()}")
-        download_progress[download_id] = {
+        progress_store.set(download_id, {
             'status': 'error',
             'error': str(e)
-        }
+        })
         return None, None
 
 
 
+def _ffmpeg_input(format: dict):
+    """ffmpeg input reading a stream straight from its URL, with the headers yt-dlp would send"""
+    headers = ''.join(f"{key}: {value}\r\n" for key, value in (format.get('http_headers') or {}).items())
+    if headers:
+        return ffmpeg.input(format['url'], headers=headers)
+    return ffmpeg.input(format['url'])
+
+class PipeFailed(Exception):
+    """Raised when a piped download can't be started"""
+
+
+class PipedDownload:
+    """
+    Stream a download through ffmpeg without touching the disk.
+
+    ffmpeg reads the video (and audio) stream URLs directly and writes the
+    merged result, fragmented MP4 for mp4 output, to stdout, which is yielded
+    as it is produced. The file can't be seeked so it is never cached.
+
+    start() runs ffmpeg and waits for its first output while the caller can
+    still answer with an error status; once the response has started a
+    failure can only cut the body short. close() stops ffmpeg and frees the
+    download slot, also when the client went away mid-stream.
+    """
+
+    def __init__(self, url: str, format_id: str, audio_format_id: str = None, chunk_size: int = 64 * 1024):
+        """
+        Args:
+            url (str): YouTube video URL
+            format_id (str): yt-dlp video (or audio only) format ID
+            audio_format_id (str): yt-dlp audio format ID, None for single stream downloads
+            chunk_size (int): Size of the chunks read from ffmpeg
+        """
+        self.url = url
+        self.format_id = format_id
+        self.audio_format_id = audio_format_id
+        self.chunk_size = chunk_size
+        self.download_id = make_download_id(url, format_id, audio_format_id)
+        self.plan = None
+        self._process = None
+        self._first_chunk = b''
+        self._total = 0
+        self._slot = None
+
+    def start(self):
+        """
+        Start ffmpeg and wait until it has produced output.
+
+        A download that fails before that is retried once with freshly
+        extracted metadata, since the signed stream URLs in the cached info
+        dict may have expired.
+
+        Raises:
+            PipeFailed: If a format is unknown or ffmpeg failed without output
+        """
+        self._slot = job_scheduler.download_slot()
+        self._slot.__enter__()
+        progress_store.set(self.download_id, {
+            'status': 'downloading',
+            'progress': 0,
+            'stage': 'download',
+            'speed': 0,
+            'eta': 0
+        })
+        try:
+            for attempt in range(2):
+                try:
+                    self._run_ffmpeg(use_cache=attempt == 0)
+                    break
+                except PipeFailed as e:
+                    if attempt == 1:
+                        raise
+                    print(f"Piped download failed, retrying with fresh metadata: {e}")
+                    video_info_cache.invalidate(get_video_id(self.url))
+        except Exception as e:
+            progress_store.set(self.download_id, {
+                'status': 'error',
+                'error': str(e)
+            })
+            self.close()
+            raise PipeFailed(str(e)) from e
+
+    def _run_ffmpeg(self, use_cache: bool):
+        formats = {
+            f.get('format_id'): f
+            for f in get_video_info_dict(self.url, use_cache=use_cache)['info'].get('formats', [])
+        }
+        stream_formats = []
+        for format_id in filter(None, [self.format_id, self.audio_format_id]):
+            if not formats.get(format_id, {}).get('url'):
+                raise PipeFailed(f"Unknown format {format_id}")
+            stream_formats.append(formats[format_id])
+        self.plan = get_output_plan(self.url, self.format_id, self.audio_format_id)
+        self._total = sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in stream_formats)
+
+        container = 'mp4' if self.plan['container'] == 'm4a' else self.plan['container']
+        output_args = {
+            'format': PIPE_FORMATS.get(container, 'matroska'),
+            'vcodec': self.plan.get('vcodec', 'copy'),
+            'acodec': self.plan.get('acodec', 'copy'),
+            'loglevel': 'error',
+        }
+        if container == 'mp4':
+            # an mp4 can only be written front to back when it is fragmented
+            output_args['movflags'] = 'frag_keyframe+empty_moov+default_base_moof'
+        stream = ffmpeg.output(*[_ffmpeg_input(f) for f in stream_formats], 'pipe:1', **output_args)
+
+        self._process = ffmpeg.run_async(stream, pipe_stdout=True)
+        self._first_chunk = self._process.stdout.read(self.chunk_size)
+        if not self._first_chunk:
+            returncode = self._process.wait()
+            self._process = None
+            raise PipeFailed(f"ffmpeg exited with {returncode} before producing output")
+
+    def __iter__(self):
+        """
+        Yields:
+            bytes: Next piece of the output file
+        """
+        reporter = ProgressReporter(self.download_id)
+        chunk = self._first_chunk
+        sent = 0
+        try:
+            with time_stage('pipe'):
+                while chunk:
+                    sent += len(chunk)
+                    reporter.report(sent, self._total, scale=99)
+                    SERVED_BYTES.inc(len(chunk), kind='pipe')
+                    yield chunk
+                    chunk = self._process.stdout.read(self.chunk_size)
+                if self._process.wait() != 0:
+                    raise Exception(f"ffmpeg exited with {self._process.returncode}")
+            reporter.publish(
+                status='finished',
+                progress=100,
+                stage='complete'
+            )
+        except Exception as e:
+            print(f"Piped download error: {traceback.format_exc()}")
+            progress_store.set(self.download_id, {
+                'status': 'error',
+                'error': str(e)
+            })
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop ffmpeg if it still runs and free the download slot, safe to call more than once"""
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        if self._slot is not None:
+            slot, self._slot = self._slot, None
+            slot.__exit__(None, None, None)
+
 def get_filesize(size: float) -> float:
     """
     Make file size easy to read
@@ -243,96 +702,193 @@ def get_filesize(size: float) -> float:
         size /= 1024.0
 
 
-def merge_video_audio(video_path: str, audio_path: str, output_path: str, download_id: str) -> bool:
+def get_merged_path(video_path: str, container: str = None) -> str:
+    """
+    Output path for merging a downloaded video stream with its audio.
+
+    Args:
+        video_path (str): Path of the downloaded video stream
+        container (str): Output extension, defaults to the video's
+
+    Returns:
+        str: Sibling path without the '_video' suffix, never equal to video_path
+    """
+    root, ext = os.path.splitext(video_path)
+    if container:
+        ext = f".{container}"
+    if root.endswith('_video'):
+        root = root[:-len('_video')]
+    else:
+        root += '_merged'
+    return root + ext
+
+def merge_video_audio(video_path: str, audio_path: str, output_path: str, download_id: str, plan: dict = None) -> bool:
     """
     Merge video and audio using ffmpeg-python
+
+    Args:
+        video_path (str): Downloaded video stream
+        audio_path (str): Downloaded audio stream
+        output_path (str): Merged file, its extension has to match the plan's container
+        download_id (str): Progress entry to update
+        plan (dict): plan_merge result, defaults to copying the video and encoding the audio to AAC
     """
+    plan = plan or {'vcodec': 'copy', 'acodec': 'aac', 'operation': 'transcode'}
     try:
         
-        if download_id in download_progress:
-            download_progress[download_id].update({
-                'status': 'downloading',
-                'progress': 90,
-                'stage': 'merging'
-            })
+        progress_store.update(
+            download_id,
+            status='downloading',
+            progress=90,
+            stage='merging',
+            merge_plan=plan
+        )
 
         video = ffmpeg.input(video_path)
         audio = ffmpeg.input(audio_path)
-        print(video_path, audio_path)
-        stream = ffmpeg.output(
-            video,
-            audio,
-            output_path,
-            vcodec='copy',
-            acodec='aac',
-            preset='ultrafast',
-            threads=4,
-            loglevel='quiet'
-        )
-        try:
+        output_args = {
+            'vcodec': plan['vcodec'],
+            'acodec': plan['acodec'],
+            'loglevel': 'error',
+        }
+        if plan['operation'] == 'transcode':
+            output_args['threads'] = 4
+            if plan['vcodec'] != 'copy':
+                output_args['preset'] = 'ultrafast'
+        stream = ffmpeg.output(video, audio, output_path, **output_args)
+        with job_scheduler.merge_slot(), time_stage('merge'):
             ffmpeg.run(stream, overwrite_output=True, capture_stderr=True)
-        except Exception as e:
-            print(e)
-            print(traceback.format_exc())
         
-        if download_id in download_progress:
-            download_progress[download_id].update({
-                'status': 'finished',
-                'progress': 100,
-                'stage': 'complete'
-            })
+        progress_store.update(
+            download_id,
+            status='finished',
+            progress=100,
+            stage='complete'
+        )
 
         return True
     
     except Exception as e:
-        print(e)
-        print(f"Merge error: {traceback.format_exc()}")
-        if download_id in download_progress:
-            download_progress[download_id].update({
-                'status': 'error',
-                'error': 'Merging failed: ' + str(e)
-            })
+        stderr = getattr(e, 'stderr', None)
+        print(f"Merge error: {stderr.decode(errors='replace') if stderr else ''}\n{traceback.format_exc()}")
+        progress_store.update(
+            download_id,
+            status='error',
+            error='Merging failed: ' + str(e)
+        )
         return False
 
-def extract_playlist_info(url: str) -> dict:
+class _ZipStreamBuffer:
+    """Write-only file object that collects what zipfile writes until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_zip_stream(files, chunk_size: int = 1024 * 1024):
+    """
+    Build a ZIP archive on the fly, without ever writing it to disk.
+
+    Members are stored, not deflated, since media files don't compress. The
+    archive is written with data descriptors, so it can be produced
+    front to back while the files are still arriving.
+
+    Args:
+        files (iterable): (path, arcname) tuples, each file is deleted once it is in the archive
+        chunk_size (int): Read size for member files
+
+    Yields:
+        bytes: Next piece of the archive
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as zip_file:
+        for path, arcname in files:
+            # file_size is known up front so zipfile picks zip64 for big members
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as source, zip_file.open(zinfo, 'w') as dest:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+            try:
+                os.remove(path)
+            except OSError:
+                print(f"Error removing zipped file: \n{traceback.format_exc()}")
+    # central directory
+    yield buffer.drain()
+
+def extract_playlist_info(url: str, start: int = 1, count: int = PLAYLIST_PAGE_SIZE) -> dict:
     """
-    Extracts information about all videos in a playlist
+    Extracts one page of a playlist's videos
+    
+    Only the requested range is fetched (yt-dlp's playlist_items), so the
+    time to list the first page doesn't depend on the playlist's length.
     
     Args:
         url (str): YouTube playlist URL
+        start (int): 1-based position of the first video to fetch
+        count (int): Number of videos to fetch, None for everything from start on
     
     Returns:
-        dict: Playlist information or None if error
+        dict: Playlist information, with has_more and next_start telling
+            whether and where the next page starts, or None if error
     """
     try:
         ydl_opts = {
             'quiet': True,
             
             'extract_flat': True,
+            # one item more than asked for tells whether there is another page
+            'playlist_items': f'{start}:{start + count}' if count else f'{start}:',
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with time_stage('playlist_extract'), yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info_dict = ydl.extract_info(url, download=False)
             
             if 'entries' not in info_dict:
                 info_dict = ydl.extract_info(info_dict['url'], download=False)
-                print(json.dumps(info_dict, indent=4 ))                
                 
                 if 'entries' not in info_dict:
                     return None
                 
                 
             playlist_details = {
+                'id': get_playlist_id(url),
                 'title': info_dict.get('title', 'Unknown Playlist'),
-                'videos': []
+                'total': info_dict.get('playlist_count'),
+                'videos': [],
+                'has_more': False,
+                'next_start': None,
             }
             
-            for idx, entry in enumerate(info_dict['entries'], 1):
+            for idx, entry in enumerate(info_dict['entries'] or [], start):
+                if not entry:
+                    continue
+                position = entry.get('playlist_index') or idx
+                if count and position >= start + count:
+                    playlist_details['has_more'] = True
+                    playlist_details['next_start'] = position
+                    break
                 video_info = {
                     'title': entry.get('title', 'Unknown Title'),
                     'url': f"https://www.youtube.com/watch?v={entry['id']}",
                     'thumbnail': entry.get('thumbnail', ''),
-                    'position': idx
+                    'position': position
                 }
                 playlist_details['videos'].append(video_info)
                 
@@ -342,6 +898,12 @@ def extract_playlist_info(url: str) -> dict:
         print(f"Error extracting playlist info: {traceback.format_exc()}")
         return None
 
+def get_playlist_url(playlist_id: str) -> str:
+    """URL to fetch a playlist from, reverse of get_playlist_id"""
+    if playlist_id.startswith(('http://', 'https://')):
+        return playlist_id
+    return f"https://www.youtube.com/playlist?list={playlist_id}"
+
 def is_playlist_url(url: str) -> bool:
     """
     Check if URL is a playlist
@@ -1,138 +1,571 @@
 
+import asyncio
+import mimetypes
 import os
+import re
 import shutil
-import tempfile
+import uuid
 import zipfile
 from datetime import datetime
-from django.utils import timezone
-from django.core.paginator import Paginator
-from django.http import FileResponse, HttpRequest, HttpResponse
+from django.utils.http import content_disposition_header
+from django.http import FileResponse, HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.urls import reverse
 from django.conf import settings
+from asgiref.sync import sync_to_async
 
 from . import utils
-from .models import VideoHistory, PlaylistVideo
+from .cache import download_cache
+from .formats import select_format
+from .history import render_history, touch_history
+from .jobs import job_journal
+from .metrics import REGISTRY, SERVED_BYTES, time_stage
+from .prefetch import PLAYLIST_PREFETCH, format_prefetcher, get_resolutions
+from .models import DownloadJob, PlaylistVideo
+from .progress import progress_store, FINAL_STATUSES
+from .scheduler import job_scheduler, QueueFull, PRIORITY_PLAYLIST, PRIORITY_VIDEO
+from .serving import ClosingContent, serve_file
+from .singleflight import download_flight
+from .transcode import (
+    AUDIO_BITRATES, AUDIO_CODECS, AUDIO_DEFAULT_BITRATE, audio_transcoder, get_audio_output, get_audio_tags
+)
+from .workspace import workspaces
 
 
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import json
-import threading
-import queue
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.db import connection, transaction
+from django.db.models import Max
 
 
-download_progress = {}
+def save_playlist_videos(playlist_id: str, videos: list, last_page: bool = True):
+    """
+    Bring the stored entries of a playlist in line with a fresh extraction.
+
+    Rows are matched by position and diffed, so reopening an unchanged
+    playlist writes nothing; new, changed and removed entries are written
+    in bulk within a single transaction. Only the positions the page covers
+    are touched, pages can be saved one at a time as they are fetched.
+
+    Args:
+        playlist_id (str): Canonical playlist ID
+        videos (list): Video dicts from extract_playlist_info, one page of them
+        last_page (bool): Whether the playlist ends with this page, anything
+            stored past it is dropped
+    """
+    positions = [video['position'] for video in videos]
+    first = min(positions, default=None)
+    last = max(positions, default=None)
+    with transaction.atomic():
+        rows = PlaylistVideo.objects.filter(playlist_id=playlist_id)
+        existing = {}
+        if videos:
+            existing = {video.position: video for video in rows.filter(position__gte=first, position__lte=last)}
+        to_create = []
+        to_update = []
+        for video in videos:
+            fields = {field: video[field] for field in PLAYLIST_VIDEO_FIELDS}
+            row = existing.pop(video['position'], None)
+            if row is None:
+                to_create.append(PlaylistVideo(playlist_id=playlist_id, position=video['position'], **fields))
+            elif any(getattr(row, field) != value for field, value in fields.items()):
+                for field, value in fields.items():
+                    setattr(row, field, value)
+                to_update.append(row)
+        
+        # entries that dropped out of the playlist
+        stale = [row.pk for row in existing.values()]
+        for start in range(0, len(stale), PLAYLIST_BATCH_SIZE):
+            PlaylistVideo.objects.filter(pk__in=stale[start:start + PLAYLIST_BATCH_SIZE]).delete()
+        # checked first, an empty DELETE still takes SQLite's write lock
+        if last_page and last is not None and rows.filter(position__gt=last).exists():
+            rows.filter(position__gt=last).delete()
+        PlaylistVideo.objects.bulk_update(to_update, PLAYLIST_VIDEO_FIELDS, batch_size=PLAYLIST_BATCH_SIZE)
+        PlaylistVideo.objects.bulk_create(to_create, batch_size=PLAYLIST_BATCH_SIZE)
+
+def load_playlist(playlist_id: str) -> bool:
+    """
+    Fetch and store the entries of a playlist that weren't paged in yet.
+
+    The page only lists the first entries; a download needs all of them.
+    Everything after the last stored position is fetched in one go.
+
+    Args:
+        playlist_id (str): Canonical playlist ID
+
+    Returns:
+        bool: False if the playlist couldn't be extracted
+    """
+    last = PlaylistVideo.objects.filter(playlist_id=playlist_id).aggregate(last=Max('position'))['last'] or 0
+    playlist_details = utils.extract_playlist_info(utils.get_playlist_url(playlist_id), start=last + 1, count=None)
+    if not playlist_details:
+        return False
+    save_playlist_videos(playlist_id, playlist_details['videos'], last_page=True)
+    return True
+
+def download_playlist_item(video: PlaylistVideo, format_type: str, download_dir: str, job_id: str) -> str:
+    """
+    Extract, download and merge a single playlist video.
+
+    Args:
+        video (PlaylistVideo): Playlist entry
+        format_type (str): 'video' or 'audio'
+        download_dir (str): Directory the files are written to
+        job_id (str): Playlist job the video is downloaded for
 
-def start_playlist_download(playlist_id, format_type, temp_dir):
-    """Background task for downloading playlist"""
-    global download_progress
+    Returns:
+        str: Path of the finished file, or None if the video failed
+    """
+    try:
+        info_dict = utils.get_video_info_dict(video.url)['info']
+    except Exception as e:
+        print(f"Error while extracting video info: {e}")
+        return None
     
-    videos = PlaylistVideo.objects.filter(playlist_id=playlist_id)
-    total_videos = videos.count()
-    download_progress[playlist_id] = {
-        'current': 0,
-        'total': total_videos,
+    # the same rule picks the format of every video in the playlist
+    selected_format = select_format(info_dict, PLAYLIST_FORMAT_RULES[format_type])
+    if not selected_format:
+        return None
+    
+    
+    video_format_id = selected_format['video_format_id']
+    audio_format_id = selected_format['audio_format_id']
+    # per video progress lives under its own ID, the playlist entry only counts videos
+    download_id = f"{job_id}_{utils.make_download_id(video.url, video_format_id, audio_format_id)}"
+    video_path, audio_path = utils.download_video(
+        video.url,
+        video_format_id,
+        download_dir,
+        audio_format_id,
+        download_id,
+        priority=PRIORITY_PLAYLIST
+    )
+    if not video_path:
+        return None
+    
+    if format_type == 'video' and audio_path and os.path.exists(audio_path):
+        plan = utils.get_output_plan(video.url, video_format_id, audio_format_id)
+        output_path = utils.get_merged_path(video_path, plan['container'])
+        if utils.merge_video_audio(video_path, audio_path, output_path, download_id, plan):
+            os.remove(video_path)
+            os.remove(audio_path)
+            video_path = output_path
+    
+    return video_path
+
+def iter_playlist_downloads(job_id, videos, format_type, temp_dir, audio_output=None):
+    """
+    Download playlist videos side by side, yielding them as they finish.
+
+    Videos run on PLAYLIST_VIDEO_WORKERS threads, so while one is merging the
+    next ones are already downloading or extracting; the scheduler's download
+    and merge slots still bound the total work across all jobs. With an
+    audio output, every downloaded item is handed to the transcode pool and
+    converted while the next ones download. The progress counters are only
+    touched from the consuming thread.
+
+    Args:
+        job_id (str): Progress entry counting the videos
+        audio_output (dict): get_audio_output result, None to keep the downloaded files as they are
+
+    Yields:
+        tuple: (PlaylistVideo, finished file path) in completion order
+    """
+    progress = progress_store.get(job_id)
+    
+    def process_item(video):
+        # each video gets its own directory so equal titles can't collide
+        item_dir = os.path.join(temp_dir, str(video.position))
+        os.makedirs(item_dir, exist_ok=True)
+        try:
+            return video, download_playlist_item(video, format_type, item_dir, job_id)
+        except Exception as e:
+            print(f"Error downloading playlist item {video.url}: {e}")
+            return video, None
+        finally:
+            connection.close()
+    
+    executor = ThreadPoolExecutor(max_workers=PLAYLIST_VIDEO_WORKERS)
+    # conversions in flight, by the video they convert
+    transcodes = {}
+    try:
+        pending = {executor.submit(process_item, video) for video in videos}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in transcodes:
+                    video, file_path = transcodes.pop(future), future.result()
+                else:
+                    video, file_path = future.result()
+                    if file_path and audio_output:
+                        transcode = audio_transcoder.submit(
+                            file_path,
+                            audio_output['codec'],
+                            audio_output['bitrate'],
+                            get_item_tags(video)
+                        )
+                        transcodes[transcode] = video
+                        pending.add(transcode)
+                        continue
+                if file_path:
+                    progress['completed_videos'].append(video.title)
+                else:
+                    progress['failed_videos'].append(video.title)
+                progress['current'] += 1
+                progress_store.set(job_id, progress)
+                if file_path:
+                    yield video, file_path
+    finally:
+        # the consumer may stop early (e.g. the client went away)
+        for transcode in transcodes:
+            transcode.cancel()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def get_item_tags(video: PlaylistVideo) -> dict:
+    """Tags of a converted playlist item, from its (cached) metadata"""
+    try:
+        info_dict = utils.get_video_info_dict(video.url)['info']
+    except Exception as e:
+        print(f"Error while extracting video info: {e}")
+        info_dict = {'title': video.title}
+    return get_audio_tags(info_dict, video.position)
+
+def start_playlist_download(job_id, playlist_id, format_type, temp_dir, audio_output=None):
+    """
+    Background task for downloading playlist
+
+    Videos an earlier, interrupted run of the job completed (see
+    jobs.JobJournal) are taken as they are, only the others are downloaded.
+
+    Args:
+        job_id (str): make_playlist_job_id of the download, its progress entry and journal row
+        playlist_id (str): Canonical playlist ID
+    """
+    job_journal.running(job_id, stage='download')
+    load_playlist(playlist_id)
+    videos = list(PlaylistVideo.objects.filter(playlist_id=playlist_id))
+    job_journal.set_items(job_id, videos)
+    finished_files = {
+        position: file_path
+        for position, file_path in job_journal.completed_items(job_id).items()
+        if position in {video.position for video in videos}
+    }
+    progress_store.set(job_id, {
+        'current': len(finished_files),
+        'total': len(videos),
         'status': 'downloading',
-        'completed_videos': [],
+        'completed_videos': [video.title for video in videos if video.position in finished_files],
         'failed_videos': []
-    }
+    })
     
     try:
-        for video in videos:
-            video_details = utils.extract_video_info(video.url)
-            if not video_details or not video_details['formats']:
-                download_progress[playlist_id]['failed_videos'].append(video.title)
-                continue
-            
-            
-            selected_format = None
-            for fmt in video_details['formats']:
-                if format_type == 'audio' and fmt['type'] == 'audio':
-                    selected_format = fmt
-                    
-                    selected_format['audio_format_id'] = None
-                    break
-                elif format_type == 'video' and fmt['type'] == 'video':
-                    selected_format = fmt
-                    break
-            
-            if not selected_format:
-                download_progress[playlist_id]['failed_videos'].append(video.title)
-                continue
-            
-            
-            video_path, audio_path = utils.download_video(
-                video.url,
-                selected_format['format_id'],
-                temp_dir,
-                selected_format.get('audio_format_id')  
-            )
-            
-            if video_path:
-                
-                if format_type == 'video' and audio_path and os.path.exists(audio_path):
-                    output_path = os.path.join(temp_dir, f"{os.path.basename(video_path)}")
-                    if utils.merge_video_audio(video_path, audio_path, output_path, playlist_id):
-                        os.remove(video_path)
-                        os.remove(audio_path)
-                
-                download_progress[playlist_id]['completed_videos'].append(video.title)
-            else:
-                download_progress[playlist_id]['failed_videos'].append(video.title)
-            
-            download_progress[playlist_id]['current'] += 1
+        remaining = [video for video in videos if video.position not in finished_files]
+        for video, file_path in iter_playlist_downloads(job_id, remaining, format_type, temp_dir, audio_output):
+            finished_files[video.position] = file_path
+            job_journal.item_done(job_id, video.position, file_path)
         
+        job_journal.update(job_id, stage='zip')
+        zip_filename = os.path.join(temp_dir, f'playlist_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip')
+        with time_stage('zip'), zipfile.ZipFile(zip_filename, 'w') as zip_file:
+            for position in sorted(finished_files):
+                file_path = finished_files[position]
+                zip_file.write(file_path, f"{position:03d} - {os.path.basename(file_path)}")
         
-        zip_filename = os.path.join(TEMP_DIR, f'playlist_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip')
-        with zipfile.ZipFile(zip_filename, 'w') as zip_file:
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    zip_file.write(file_path, os.path.basename(file_path))
-        
-        download_progress[playlist_id]['status'] = 'completed'
-        download_progress[playlist_id]['zip_file'] = zip_filename
+        # only the ZIP is kept, until it has been fetched or expires
+        for video in videos:
+            shutil.rmtree(os.path.join(temp_dir, str(video.position)), ignore_errors=True)
+        workspaces.keep(temp_dir)
+        progress_store.update(job_id, status='completed', zip_file=zip_filename)
+        job_journal.finish(job_id, {'zip_file': zip_filename})
         
     except Exception as e:
         print(f"Error in background download: {e}")
-        download_progress[playlist_id]['status'] = 'failed'
+        progress_store.update(job_id, status='failed')
+        job_journal.fail(job_id, str(e))
+        workspaces.release(temp_dir)
+
+def stream_playlist_download(job_id, playlist_id, format_type, temp_dir, audio_output=None):
+    """
+    Generator behind stream_playlist, downloads the playlist while the ZIP is being sent.
+
+    The workspace and the scheduler reservation are released by stream_playlist
+    once the response is closed.
+
+    Args:
+        job_id (str): ID stream_playlist reserved the stream under, its progress entry
+
+    Yields:
+        bytes: Next piece of the ZIP archive
+    """
+    load_playlist(playlist_id)
+    videos = list(PlaylistVideo.objects.filter(playlist_id=playlist_id))
+    progress_store.set(job_id, {
+        'current': 0,
+        'total': len(videos),
+        'status': 'downloading',
+        'completed_videos': [],
+        'failed_videos': []
+    })
+    completed = False
+    
+    try:
+        # members are added in completion order, the position prefix keeps
+        # them sorted once extracted
+        finished_files = (
+            (file_path, f"{video.position:03d} - {os.path.basename(file_path)}")
+            for video, file_path in iter_playlist_downloads(job_id, videos, format_type, temp_dir, audio_output)
+        )
+        for piece in utils.iter_zip_stream(finished_files):
+            SERVED_BYTES.inc(len(piece), kind='zip_stream')
+            yield piece
+        completed = True
+        progress_store.update(job_id, status='completed')
+    except Exception as e:
+        print(f"Error in streamed playlist download: {e}")
     finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        if not completed:
+            # failed, or the client disconnected before the archive was complete
+            progress_store.update(job_id, status='failed')
+
+def get_playlist_audio_output(params, format_type: str) -> dict:
+    """
+    Audio conversion asked for with a playlist download (audio_codec and audio_bitrate parameters).
+
+    Returns:
+        dict: get_audio_output result, None for video downloads or to keep the downloaded audio
+
+    Raises:
+        ValueError: If the codec or bitrate isn't supported
+    """
+    if format_type != 'audio':
+        return None
+    bitrate = params.get('audio_bitrate')
+    if bitrate and not bitrate.isdigit():
+        raise ValueError(f"Unsupported audio bitrate {bitrate}")
+    return get_audio_output(params.get('audio_codec'), bitrate)
+
+def stream_playlist(request: HttpRequest) -> HttpResponse:
+    """
+    Download a playlist as a ZIP that is streamed while the videos are being downloaded.
+    """
+    playlist_id = request.GET.get('playlist_id')
+    format_type = request.GET.get('format_type', 'video')
+    
+    if not playlist_id:
+        return JsonResponse({'error': 'Missing playlist ID'}, status=400)
+    
+    if format_type not in PLAYLIST_FORMAT_RULES:
+        return JsonResponse({'error': 'Unknown format type'}, status=400)
+    
+    try:
+        audio_output = get_playlist_audio_output(request.GET, format_type)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    if not PlaylistVideo.objects.filter(playlist_id=playlist_id).exists():
+        return JsonResponse({'error': 'No videos found in playlist'}, status=400)
+    
+    # the page picks the stream ID, as it can't read the response of a navigation
+    # but has to know which progress entry to watch
+    stream_id = request.GET.get('stream_id') or uuid.uuid4().hex
+    if not re.fullmatch(r'[0-9a-f]{16,32}', stream_id):
+        return JsonResponse({'error': 'Invalid stream ID'}, status=400)
+    job_id = f"stream_{stream_id}"
+    if job_scheduler.position(job_id) is not None:
+        return JsonResponse({'error': 'Stream ID already in use'}, status=409)
+    
+    # the download runs on this request's thread, so it has to be admitted before the response starts
+    try:
+        job_scheduler.reserve(job_id)
+    except QueueFull:
+        return JsonResponse({'error': 'Too many downloads in progress, try again later'}, status=429)
+    playlist_temp_dir = workspaces.create(f'playlist_{playlist_id}')
+    
+    def finished():
+        job_scheduler.release(job_id)
+        workspaces.release(playlist_temp_dir)
+    
+    response = StreamingHttpResponse(
+        ClosingContent(stream_playlist_download(job_id, playlist_id, format_type, playlist_temp_dir, audio_output), finished),
+        content_type='application/zip'
+    )
+    response['Content-Disposition'] = f'attachment; filename="playlist_{format_type}.zip"'
+    return response
+
+def playlist_page(request: HttpRequest) -> JsonResponse:
+    """
+    Next page of a playlist's videos, fetched when the user scrolls past the
+    ones listed so far. The page is stored before it is returned.
+    """
+    playlist_id = request.GET.get('playlist_id')
+    try:
+        start = int(request.GET.get('start', 1))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start'}, status=400)
+    if not playlist_id or start < 1:
+        return JsonResponse({'error': 'Missing playlist ID'}, status=400)
+    
+    playlist_details = utils.extract_playlist_info(utils.get_playlist_url(playlist_id), start=start)
+    if not playlist_details:
+        return JsonResponse({'error': 'Failed to extract playlist information'}, status=502)
+    
+    save_playlist_videos(playlist_id, playlist_details['videos'], last_page=not playlist_details['has_more'])
+    if PLAYLIST_PREFETCH:
+        format_prefetcher.submit(playlist_id, [video['url'] for video in playlist_details['videos']])
+    return JsonResponse({
+        'videos': playlist_details['videos'],
+        'has_more': playlist_details['has_more'],
+        'next_start': playlist_details['next_start'],
+    })
+
+def playlist_formats(request: HttpRequest) -> JsonResponse:
+    """
+    Resolutions of the playlist videos whose formats were prefetched.
+
+    Takes playlist_id and the start/end positions the page still waits for;
+    videos not fetched yet are counted in pending.
+    """
+    playlist_id = request.GET.get('playlist_id')
+    try:
+        start = int(request.GET.get('start', 1))
+        end = int(request.GET.get('end', start + utils.PLAYLIST_PAGE_SIZE - 1))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid range'}, status=400)
+    if not playlist_id:
+        return JsonResponse({'error': 'Missing playlist ID'}, status=400)
+    
+    resolutions = {}
+    pending = 0
+    videos = PlaylistVideo.objects.filter(
+        playlist_id=playlist_id, position__gte=start, position__lte=end
+    ).only('url', 'position')
+    cached = get_resolutions([video.url for video in videos])
+    for video in videos:
+        if video.url in cached:
+            resolutions[video.position] = cached[video.url]
+        else:
+            pending += 1
+    return JsonResponse({
+        'resolutions': resolutions,
+        'pending': 0 if format_prefetcher.is_cancelled(playlist_id) else pending,
+    })
+
+@csrf_exempt
+def cancel_prefetch(request: HttpRequest) -> JsonResponse:
+    """Stop prefetching formats for a playlist, sent when the user leaves its page"""
+    playlist_id = request.POST.get('playlist_id')
+    if request.method != 'POST' or not playlist_id:
+        return JsonResponse({'error': 'Missing playlist ID'}, status=400)
+    format_prefetcher.cancel(playlist_id)
+    return JsonResponse({'status': 'cancelled'})
+
+def get_playlist_progress(job_id: str) -> dict:
+    """
+    Progress of a playlist download, with its queue position or ZIP link filled in.
+
+    Args:
+        job_id (str): Job ID download_playlist returned, or the stream job ID of a streamed download
+
+    Returns:
+        dict: Progress entry, or None if the playlist isn't being downloaded
+    """
+    progress = progress_store.get(job_id) if job_id else None
+    if progress is None:
+        return None
+    if progress['status'] == 'queued':
+        progress['queue_position'] = job_scheduler.position(job_id)
+    
+    
+    if progress['status'] == 'completed':
+        zip_path = progress.get('zip_file')
+        if zip_path and os.path.exists(zip_path):
+            workspace = os.path.basename(os.path.dirname(zip_path))
+            progress['download_url'] = reverse('download_zip', args=[workspace, os.path.basename(zip_path)])
+    return progress
+
+def get_video_progress(download_id: str) -> dict:
+    """
+    Progress of a single video download, with its queue position filled in.
+
+    Returns:
+        dict: Progress entry, or None if the download is unknown
+    """
+    progress = progress_store.get(download_id) if download_id else None
+    if progress is None:
+        return None
+    if progress.get('status') == 'queued':
+        progress['queue_position'] = job_scheduler.position(download_id)
+    return progress
 
 @csrf_exempt
 def check_download_progress(request):
     """API endpoint to check download progress"""
     if request.method == 'POST':
         data = json.loads(request.body)
-        playlist_id = data.get('playlist_id')
-        
-        if playlist_id in download_progress:
-            progress = download_progress[playlist_id]
-            
-            
-            if progress['status'] == 'completed':
-                zip_path = progress.get('zip_file')
-                if zip_path and os.path.exists(zip_path):
-                    progress['download_url'] = reverse('download_zip', args=[os.path.basename(zip_path)])
-            
+        progress = get_playlist_progress(data.get('job_id') or data.get('playlist_id'))
+        if progress is not None:
             return JsonResponse(progress)
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
-def download_zip(request, filename):
+async def progress_events(request: HttpRequest) -> HttpResponse:
+    """
+    Server-Sent Events stream of a download's progress.
+
+    Takes a download_id (single video) or job_id (playlist, or stream_<stream_id>
+    of a streamed playlist) query parameter and
+    pushes the progress entry every time it changes, until the download
+    reaches a final state. Meant to be served over ASGI, where an open
+    stream doesn't hold a worker thread.
+    """
+    download_id = request.GET.get('download_id')
+    playlist_id = request.GET.get('job_id')
+    if not download_id and not playlist_id:
+        return JsonResponse({'error': 'Missing download or playlist ID'}, status=400)
+    
+    async def event_stream():
+        last_payload = None
+        idle = 0
+        while True:
+            # the progress store may do blocking I/O (sqlite, redis)
+            if playlist_id:
+                progress = await sync_to_async(get_playlist_progress, thread_sensitive=False)(playlist_id)
+            else:
+                progress = await sync_to_async(get_video_progress, thread_sensitive=False)(download_id)
+            # the download may not have been registered yet
+            progress = progress or {'status': 'not_found'}
+            payload = json.dumps(progress)
+            if payload != last_payload:
+                last_payload = payload
+                idle = 0
+                yield f"data: {payload}\n\n"
+                if progress.get('status') in FINAL_STATUSES:
+                    return
+            else:
+                idle += PROGRESS_EVENTS_INTERVAL
+                if idle >= 15:
+                    # keeps proxies from closing an idle connection
+                    idle = 0
+                    yield ": keep-alive\n\n"
+            await asyncio.sleep(PROGRESS_EVENTS_INTERVAL)
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def export_metrics(request: HttpRequest) -> HttpResponse:
+    """Prometheus scrape endpoint, aggregated over every worker process sharing the metrics store"""
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def download_zip(request, workspace, filename):
     """Download the completed ZIP file"""
-    file_path = os.path.join(TEMP_DIR, filename)
-    if os.path.exists(file_path):
-        response = FileResponse(
-            open(file_path, 'rb'),
-            as_attachment=True,
-            filename=filename
-        )
-        response['Content-Length'] = os.path.getsize(file_path)
-        return response
+    file_path = workspaces.resolve(workspace, filename)
+    if file_path:
+        return serve_file(request, file_path, filename)
     return HttpResponse('File not found', status=404)
 
 def download_playlist(request: HttpRequest) -> HttpResponse:
@@ -148,30 +581,94 @@ def download_playlist(request: HttpRequest) -> HttpResponse:
     if not playlist_id:
         return JsonResponse({'error': 'Missing playlist ID'}, status=400)
     
+    if format_type not in PLAYLIST_FORMAT_RULES:
+        return JsonResponse({'error': 'Unknown format type'}, status=400)
+    
+    try:
+        audio_output = get_playlist_audio_output(request.POST, format_type)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
     videos = PlaylistVideo.objects.filter(playlist_id=playlist_id)
     if not videos.exists():
         return JsonResponse({'error': 'No videos found in playlist'}, status=400)
     
     
-    playlist_temp_dir = os.path.join(TEMP_DIR, f'playlist_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
-    os.makedirs(playlist_temp_dir, exist_ok=True)
-    
+    job_id = utils.make_playlist_job_id(playlist_id, format_type, audio_output)
+    progress = {
+        'current': 0,
+        'total': videos.count(),
+        'status': 'queued',
+        'completed_videos': [],
+        'failed_videos': []
+    }
+    # as in start_download, only the request that creates the entry starts the job
+    if not progress_store.add(job_id, progress):
+        existing = progress_store.get(job_id)
+        if existing and existing['status'] != 'failed' and (
+            existing['status'] != 'completed' or os.path.exists(existing.get('zip_file', ''))
+        ):
+            return JsonResponse({
+                'status': 'started',
+                'message': 'Download already in progress',
+                'job_id': job_id,
+                'queue_position': job_scheduler.position(job_id)
+            })
+        progress_store.set(job_id, progress)
     
-    thread = threading.Thread(
-        target=start_playlist_download,
-        args=(playlist_id, format_type, playlist_temp_dir)
-    )
-    thread.start()
+    playlist_temp_dir = workspaces.create(job_id)
+    if not job_journal.record(
+        job_id,
+        'playlist',
+        priority=PRIORITY_PLAYLIST,
+        url=utils.get_playlist_url(playlist_id),
+        format_type=format_type,
+        audio_output=audio_output,
+        workspace=playlist_temp_dir
+    ):
+        # still running somewhere, e.g. taken over after a restart
+        workspaces.release(playlist_temp_dir)
+        return JsonResponse({
+            'status': 'started',
+            'message': 'Download already in progress',
+            'job_id': job_id,
+            'queue_position': job_scheduler.position(job_id)
+        })
+    try:
+        queue_position = job_scheduler.submit(
+            job_id,
+            start_playlist_download,
+            job_id, playlist_id, format_type, playlist_temp_dir, audio_output,
+            priority=PRIORITY_PLAYLIST
+        )
+    except QueueFull:
+        job_journal.discard(job_id)
+        progress_store.delete(job_id)
+        workspaces.release(playlist_temp_dir)
+        return JsonResponse({'error': 'Too many downloads in progress, try again later'}, status=429)
     
     return JsonResponse({
         'status': 'started',
-        'message': 'Download started'
+        'message': 'Download started',
+        'job_id': job_id,
+        'queue_position': queue_position
     })
 
 
 
-TEMP_DIR = os.path.join(settings.BASE_DIR, 'temp_downloads')
-os.makedirs(TEMP_DIR, exist_ok=True)
+PLAYLIST_VIDEO_WORKERS = getattr(settings, 'PLAYLIST_VIDEO_WORKERS', 3)
+PLAYLIST_STREAMING_ZIP = getattr(settings, 'PLAYLIST_STREAMING_ZIP', False)
+DOWNLOAD_PIPE_MODE = getattr(settings, 'DOWNLOAD_PIPE_MODE', False)
+PROGRESS_EVENTS_INTERVAL = getattr(settings, 'PROGRESS_EVENTS_INTERVAL', 0.5)
+
+PLAYLIST_FORMAT_RULES = getattr(settings, 'PLAYLIST_FORMAT_RULES', {
+    'video': {'type': 'video', 'max_height': 1080, 'container': 'mp4'},
+    'audio': {'type': 'audio', 'container': 'mp4'},
+})
+
+PLAYLIST_VIDEO_FIELDS = ['title', 'url', 'thumbnail']
+# stays under SQLite's limit on query parameters
+PLAYLIST_BATCH_SIZE = 500
 
 def process_url(request: HttpRequest) -> HttpResponse:
     """
@@ -181,10 +678,7 @@ def process_url(request: HttpRequest) -> HttpResponse:
     context = {}
     
     
-    history_list = VideoHistory.objects.all()
-    paginator = Paginator(history_list, 10)
-    page = request.GET.get('page')
-    context['history'] = paginator.get_page(page)
+    context['history_html'] = render_history(request.GET.get('before'), request.GET.get('after'))
     
     
     url = request.GET.get('url')
@@ -204,25 +698,28 @@ def process_url(request: HttpRequest) -> HttpResponse:
         
         
         if utils.is_playlist_url(url):
+            # only the first page, the rest is loaded on demand
             playlist_details = utils.extract_playlist_info(url)
-            print(playlist_details)
             if not playlist_details:
                 messages.error(request, "Failed to extract playlist information")
                 return render(request, 'downloader/index.html', context)
             
             
-            PlaylistVideo.objects.filter(playlist_id=url).delete()
-            for video in playlist_details['videos']:
-                PlaylistVideo.objects.create(
-                    playlist_id=url,
-                    title=video['title'],
-                    url=video['url'],
-                    thumbnail=video['thumbnail'],
-                    position=video['position']
-                )
+            save_playlist_videos(
+                playlist_details['id'],
+                playlist_details['videos'],
+                last_page=not playlist_details['has_more']
+            )
+            if PLAYLIST_PREFETCH:
+                format_prefetcher.submit(playlist_details['id'], [video['url'] for video in playlist_details['videos']])
             
             context['playlist'] = playlist_details
-            context['playlist_id'] = url
+            context['playlist_id'] = playlist_details['id']
+            context['streaming_zip'] = PLAYLIST_STREAMING_ZIP
+            context['prefetch'] = PLAYLIST_PREFETCH
+            context['audio_codecs'] = list(AUDIO_CODECS)
+            context['audio_bitrates'] = AUDIO_BITRATES
+            context['audio_default_bitrate'] = AUDIO_DEFAULT_BITRATE
             
         
         else:
@@ -232,20 +729,16 @@ def process_url(request: HttpRequest) -> HttpResponse:
                 return render(request, 'downloader/index.html', context)
             
             
-            existing_video = VideoHistory.objects.filter(url=url).first()
-            if existing_video:
-                
-                existing_video.lookup_date = timezone.now()
-                existing_video.save()
-            else:
-                
-                VideoHistory.objects.create(
-                    title=video_details['title'],
-                    url=url,
-                    thumbnail=video_details['thumbnail']
-                )
+            touch_history(
+                utils.get_video_id(url),
+                url,
+                video_details['title'],
+                video_details['thumbnail']
+            )
+            context['history_html'] = render_history()
             
             context.update(video_details)
+            context['video_id'] = utils.get_video_id(url)
     
     return render(request, 'downloader/index.html', context)
 
@@ -255,16 +748,6 @@ def download_vid(request: HttpRequest) -> FileResponse:
     Supports both video and audio downloads.
     """
     
-    for file in os.listdir(TEMP_DIR):
-        file_path = os.path.join(TEMP_DIR, file)
-        try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print(f"Error cleaning temporary files: {e}")
-    
     if request.method != 'POST':
         return redirect('index')
     
@@ -280,34 +763,38 @@ def download_vid(request: HttpRequest) -> FileResponse:
     audio_format_id = format_id.split('+')[1] if '+' in format_id else None
     
     
-    video_path, audio_path = utils.download_video(
-        url, video_format_id, TEMP_DIR, audio_format_id
-    )
-    
-    if not video_path or not os.path.exists(video_path):
-        messages.error(request, "Download failed")
-        return redirect('index')
-    
-    try:
-        output_filename = os.path.basename(video_path)
-        
-        
-        if audio_path and os.path.exists(audio_path):
-            output_path = os.path.join(TEMP_DIR, f"{output_filename}")
-            download_id = f"{url}_{format_id}"  
-            if utils.merge_video_audio(video_path, audio_path, output_path, download_id):
-                video_path = output_path
-                output_filename = os.path.basename(output_path)
+    video_id = utils.get_video_id(url)
+    if DOWNLOAD_PIPE_MODE:
+        merge_plan = utils.get_output_plan(url, video_format_id, audio_format_id)
+        container = merge_plan['container']
+        if not container:
+            return HttpResponse('Unknown format', status=400)
+        cached = download_cache.lookup(video_id, video_format_id, audio_format_id, container)
+        if cached:
+            return serve_file(request, cached.file_path, cached.filename)
         
+        # started before the response, a failure past this point can only cut the file short
+        pipe = utils.PipedDownload(url, video_format_id, audio_format_id)
+        try:
+            pipe.start()
+        except utils.PipeFailed as e:
+            return HttpResponse(f'Download failed: {e}', status=502)
         
-        response = FileResponse(
-            open(video_path, 'rb'),
-            as_attachment=True,
-            filename=output_filename
+        video_details = utils.extract_video_info(url)
+        filename = f"{video_details['title'] if video_details else video_id}.{container}"
+        response = StreamingHttpResponse(
+            pipe,
+            content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
         )
-        response['Content-Length'] = os.path.getsize(video_path)
+        response['Content-Disposition'] = content_disposition_header(True, filename)
         return response
     
+    
+    download_id = utils.make_download_id(url, video_format_id, audio_format_id)
+    try:
+        result = download_flight.do(download_id, fetch_download, url, video_format_id, audio_format_id, download_id)
+        return serve_file(request, result['file_path'], result['filename'])
+    
     except Exception as e:
         print(f"Error serving file: {e}")
         messages.error(request, "Error processing download")
@@ -318,10 +805,9 @@ def check_video_progress(request):
     """API endpoint to check individual video download progress"""
     if request.method == 'POST':
         data = json.loads(request.body)
-        download_id = data.get('download_id')
-        print(utils.download_progress)
-        if download_id in utils.download_progress:  
-            return JsonResponse(utils.download_progress[download_id])
+        progress = get_video_progress(data.get('download_id'))
+        if progress is not None:
+            return JsonResponse(progress)
     
     return JsonResponse({'status': 'not_found'})
 
@@ -337,104 +823,203 @@ def start_download(request: HttpRequest) -> HttpResponse:
     if request.method == 'POST':
         url = request.POST.get('url')
         format_id = request.POST.get('format_id')
-        print(request.POST)
         
         if not url or not format_id:
             return JsonResponse({'error': 'Missing URL or format selection'}, status=400)
         
         
-        download_id = f"{url}_{format_id}+"
-        
+        video_format_id = format_id.split('+')[0]
+        audio_format_id = format_id.split('+')[1] if '+' in format_id else None
+        download_id = utils.make_download_id(url, video_format_id, audio_format_id)
         
-        thread = threading.Thread(
-            target=process_download,
-            args=(url, format_id, download_id)
-        )
-        thread.start()
+        # the entry doubles as a lock: only the request that creates it starts a job,
+        # everyone else asking for the same file follows that job
+        if not progress_store.add(download_id, {'status': 'queued', 'progress': 0}):
+            progress = progress_store.get(download_id)
+            if progress and progress['status'] not in ('error', 'failed') and (
+                progress['status'] != 'completed' or os.path.exists(progress.get('file_path', ''))
+            ):
+                return JsonResponse({
+                    'status': 'started',
+                    'download_id': download_id,
+                    'queue_position': job_scheduler.position(download_id)
+                })
+            # retrying a failed download, or the finished file is gone
+            progress_store.set(download_id, {
+                'status': 'queued',
+                'progress': 0
+            })
+        if not job_journal.record(
+            download_id,
+            'video',
+            priority=PRIORITY_VIDEO,
+            url=url,
+            video_format_id=video_format_id,
+            audio_format_id=audio_format_id or ''
+        ):
+            # still running somewhere, e.g. taken over after a restart
+            return JsonResponse({
+                'status': 'started',
+                'download_id': download_id,
+                'queue_position': job_scheduler.position(download_id)
+            })
+        try:
+            queue_position = job_scheduler.submit(
+                download_id,
+                process_download,
+                url, format_id, download_id,
+                priority=PRIORITY_VIDEO
+            )
+        except QueueFull:
+            job_journal.discard(download_id)
+            progress_store.delete(download_id)
+            return JsonResponse({'error': 'Too many downloads in progress, try again later'}, status=429)
         
         return JsonResponse({
             'status': 'started',
-            'download_id': download_id
+            'download_id': download_id,
+            'queue_position': queue_position
         })
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
-def process_download(url: str, format_id: str, download_id: str):
-    """Process the download in background"""
+def fetch_download(url: str, video_format_id: str, audio_format_id: str, download_id: str,
+                   workspace: str = None) -> dict:
+    """
+    Download, merge and cache a video, or take it from the download cache.
+
+    Callers go through download_flight so concurrent requests for the same
+    download share one run (and its progress entry) and get the same file.
+
+    Args:
+        url (str): YouTube video URL
+        video_format_id (str): yt-dlp video (or audio only) format ID
+        audio_format_id (str): yt-dlp audio format ID, None for single stream downloads
+        download_id (str): Progress entry to update
+        workspace (str): Workspace of an interrupted run to continue in, a new one is created by default
+
+    Returns:
+        dict: file_path, filename and merge_plan of the finished file
+
+    Raises:
+        Exception: If the download or the merge failed
+    """
+    video_id = utils.get_video_id(url)
+    merge_plan = utils.get_output_plan(url, video_format_id, audio_format_id)
+    container = merge_plan['container']
+    cached = download_cache.lookup(video_id, video_format_id, audio_format_id, container)
+    if cached:
+        return {'file_path': cached.file_path, 'filename': cached.filename, 'merge_plan': merge_plan}
+    
+    workspace = workspace or workspaces.create(download_id)
+    job_journal.update(download_id, workspace=workspace, stage='download')
     try:
+        video_path, audio_path = utils.download_video(
+            url, video_format_id, workspace, audio_format_id, download_id
+        )
+        if not video_path or not os.path.exists(video_path):
+            raise Exception('Download failed')
         
-        for file in os.listdir(TEMP_DIR):
-            file_path = os.path.join(TEMP_DIR, file)
-            try:
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                print(f"Error cleaning temporary files: {e}")
-        
+        output_filename = os.path.basename(video_path)
+        if audio_path and os.path.exists(audio_path) and audio_format_id:
+            job_journal.update(download_id, stage='merge')
+            output_path = utils.get_merged_path(video_path, container)
+            if not utils.merge_video_audio(video_path, audio_path, output_path, download_id, merge_plan):
+                raise Exception('Merging failed')
+            os.remove(video_path)
+            os.remove(audio_path)
+            video_path = output_path
+            output_filename = os.path.basename(output_path)
         
+        cached = download_cache.store(
+            video_id, video_format_id, audio_format_id, container, video_path, output_filename
+        )
+    except Exception:
+        workspaces.release(workspace)
+        raise
+    
+    if cached:
+        # the file moved into the cache, nothing left in the workspace
+        workspaces.release(workspace)
+        video_path = cached.file_path
+    else:
+        # served from the workspace until it expires
+        workspaces.keep(workspace)
+    return {'file_path': video_path, 'filename': output_filename, 'merge_plan': merge_plan}
+
+def process_download(url: str, format_id: str, download_id: str, workspace: str = None):
+    """Process the download in background, in the workspace of an interrupted run if given"""
+    try:
+        job_journal.running(download_id)
         video_format_id = format_id.split('+')[0]
         audio_format_id = format_id.split('+')[1] if '+' in format_id else None
         
-        
-        video_path, audio_path = utils.download_video(
-            url, video_format_id, TEMP_DIR, audio_format_id
+        result = download_flight.do(
+            download_id, fetch_download, url, video_format_id, audio_format_id, download_id, workspace
         )
-        
-        if not video_path or not os.path.exists(video_path):
-            utils.download_progress[download_id] = {
-                'status': 'error',
-                'error': 'Download failed'
-            }
-            return
-        
-        try:
-            output_filename = os.path.basename(video_path)
-            
-            
-            if audio_path and os.path.exists(audio_path) and audio_format_id:
-                output_path = os.path.join(TEMP_DIR, f"{output_filename}")
-                if utils.merge_video_audio(video_path, audio_path, output_path, download_id):
-                    os.remove(video_path)
-                    os.remove(audio_path)
-                    video_path = output_path
-                    output_filename = os.path.basename(output_path)
-            
-            utils.download_progress[download_id] = {
-                'status': 'completed',
-                'file_path': video_path,
-                'filename': output_filename
-            }
-            
-        except Exception as e:
-            print(f"Error processing file: {e}")
-            utils.download_progress[download_id] = {
-                'status': 'error',
-                'error': str(e)
-            }
+        progress_store.set(download_id, {
+            'status': 'completed',
+            **result
+        })
+        job_journal.finish(download_id, {'file_path': result['file_path'], 'filename': result['filename']})
             
     except Exception as e:
         print(f"Download process error: {e}")
-        utils.download_progress[download_id] = {
+        progress_store.set(download_id, {
             'status': 'error',
             'error': str(e)
+        })
+        job_journal.fail(download_id, str(e))
+
+def resume_job(job: DownloadJob):
+    """
+    Queue an interrupted job again, called by jobs.JobJournal for jobs whose process is gone.
+
+    The job continues in its old workspace if that is still there, so the
+    partial downloads and finished playlist items in it are picked up.
+
+    Args:
+        job (DownloadJob): Job claimed by this process
+
+    Raises:
+        QueueFull: If the scheduler can't take the job right now
+    """
+    workspace = job.workspace if workspaces.adopt(job.workspace, job.job_id) else None
+    if job.kind == 'playlist':
+        workspace = workspace or workspaces.create(job.job_id)
+        playlist_id = utils.get_playlist_id(job.url)
+        args = (start_playlist_download, job.job_id, playlist_id, job.format_type, workspace, job.audio_output)
+        progress = {
+            'current': 0,
+            'total': job.items.count(),
+            'status': 'queued',
+            'completed_videos': [],
+            'failed_videos': []
         }
+    else:
+        format_id = '+'.join(filter(None, [job.video_format_id, job.audio_format_id]))
+        args = (process_download, job.url, format_id, job.job_id, workspace)
+        progress = {'status': 'queued', 'progress': 0}
+    
+    job_journal.update(job.job_id, state='queued', workspace=workspace or '')
+    progress_store.set(job.job_id, progress)
+    try:
+        job_scheduler.submit(job.job_id, *args, priority=job.priority)
+    except QueueFull:
+        if workspace:
+            # not ours any more, kept around for the next attempt
+            workspaces.keep(workspace, workspaces.stale_ttl)
+        progress_store.delete(job.job_id)
+        raise
 
 @csrf_exempt
 def get_download_file(request: HttpRequest) -> FileResponse:
     """Get the downloaded file"""
-    if request.method == 'POST':
-        download_id = request.POST.get('download_id')
-        if download_id in utils.download_progress:
-            progress = utils.download_progress[download_id]
-            if progress['status'] == 'completed':
-                response = FileResponse(
-                    open(progress['file_path'], 'rb'),
-                    as_attachment=True,
-                    filename=progress['filename']
-                )
-                response['Content-Length'] = os.path.getsize(progress['file_path'])
-                return response
+    # GET is accepted too so browsers and download managers can resume with Range
+    download_id = request.POST.get('download_id') or request.GET.get('download_id')
+    progress = progress_store.get(download_id) if download_id else None
+    if progress is not None:
+        if progress['status'] == 'completed':
+            return serve_file(request, progress['file_path'], progress['filename'])
     
     return JsonResponse({'error': 'File not found'}, status=404)
\ No newline at end of file
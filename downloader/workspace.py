@@ -0,0 +1,327 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import traceback
+import uuid
+
+from django.conf import settings
+
+TEMP_DIR = os.path.join(settings.BASE_DIR, 'temp_downloads')
+
+WORKSPACE_QUOTA_BYTES = getattr(settings, 'WORKSPACE_QUOTA_BYTES', 20 * 1024 ** 3)
+WORKSPACE_HIGH_WATERMARK = getattr(settings, 'WORKSPACE_HIGH_WATERMARK', 0.9)
+WORKSPACE_ARTIFACT_TTL = getattr(settings, 'WORKSPACE_ARTIFACT_TTL', 60 * 60)
+WORKSPACE_SWEEP_INTERVAL = getattr(settings, 'WORKSPACE_SWEEP_INTERVAL', 60)
+
+MARKER = '.workspace.json'
+# what yt-dlp leaves behind when a download is interrupted
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+PARTIAL_FRAGMENT = re.compile(r'\.part-Frag\d+')
+
+
+class WorkspaceManager:
+    """
+    Per-job scratch directories with a lifetime, under a shared root.
+
+    Every job downloads into its own workspace, so jobs never see each
+    other's files and equal titles can't collide. A workspace records its
+    job and expiry in a marker file: while the job runs the owning process
+    keeps pushing the expiry forward, once it finishes the workspace is
+    either released right away or kept for its artifacts' lifetime (e.g. a
+    playlist ZIP waiting to be fetched).
+
+    A janitor thread in every process sweeps the root, removing expired
+    workspaces (including those of killed processes, whose expiry stops
+    moving), stale partial downloads and leftovers from before workspaces,
+    and evicting kept artifacts soonest-expiring first while the root is
+    over its high watermark. has_room() is what the scheduler checks before
+    starting a job, so a full disk makes jobs queue instead of fail.
+
+    Workspaces in_use returns are never swept, whatever their marker says:
+    jobs.py points it at the journal, so the workspace of a job whose process
+    died keeps its partial downloads until the job is resumed in it, however
+    long the server was down.
+
+    Args:
+        root (str): Directory workspaces are created in
+        quota_bytes (int): Scratch disk budget for everything under root
+        high_watermark (float): Share of the quota above which new jobs wait
+        artifact_ttl (int): Default lifetime of kept workspaces, in seconds
+        sweep_interval (int): Seconds between janitor sweeps
+        in_use (callable): Returns the paths of workspaces that must not be swept, None if there are none
+    """
+
+    def __init__(self, root: str, quota_bytes: int, high_watermark: float = 0.9,
+                 artifact_ttl: int = 3600, sweep_interval: int = 60, in_use=None):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.high_watermark = high_watermark
+        self.artifact_ttl = artifact_ttl
+        self.sweep_interval = sweep_interval
+        self.in_use = in_use
+        # a running job's expiry is refreshed every sweep, so it only lapses when its process is gone
+        self.stale_ttl = max(sweep_interval * 5, 300)
+        self._active = {}
+        self._usage = None
+        self._usage_at = 0.0
+        self._lock = threading.Lock()
+        self._janitor = None
+
+    def create(self, job_id: str) -> str:
+        """
+        New workspace for a job.
+
+        The directory name starts with the job ID (made filesystem safe) and
+        ends with a random suffix, so the same job running twice still gets
+        two workspaces.
+
+        Args:
+            job_id (str): Download or playlist ID
+
+        Returns:
+            str: Path of the empty workspace
+        """
+        name = f"{re.sub(r'[^0-9A-Za-z_+.-]', '_', job_id)[:80]}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        with self._lock:
+            self._active[path] = job_id
+            self._start_janitor()
+        self._write_marker(path, job_id, time.time() + self.stale_ttl, 'running')
+        return path
+
+    def adopt(self, path: str, job_id: str) -> bool:
+        """
+        Take over the workspace of an interrupted job, e.g. after a restart.
+
+        Args:
+            path (str): Workspace the job was using
+            job_id (str): Download or playlist ID
+
+        Returns:
+            bool: False if the workspace is gone (swept, or not under the root), the job then starts over
+        """
+        if not path or os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.root) or not os.path.isdir(path):
+            return False
+        with self._lock:
+            self._active[path] = job_id
+            self._start_janitor()
+        self._write_marker(path, job_id, time.time() + self.stale_ttl, 'running')
+        return True
+
+    def partial_files(self, path: str) -> dict:
+        """
+        Interrupted downloads in a workspace.
+
+        Returns:
+            dict: Size in bytes by path relative to the workspace
+        """
+        partials = {}
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                if filename.endswith(PARTIAL_SUFFIXES) or PARTIAL_FRAGMENT.search(filename):
+                    file_path = os.path.join(dirpath, filename)
+                    partials[os.path.relpath(file_path, path)] = _file_size(file_path)
+        return partials
+
+    def keep(self, path: str, ttl: int = None):
+        """
+        Keep a finished job's workspace for its artifacts.
+
+        Args:
+            path (str): Workspace returned by create()
+            ttl (int): Seconds to keep it, defaults to the artifact TTL
+        """
+        with self._lock:
+            job_id = self._active.pop(path, None)
+        self._write_marker(path, job_id, time.time() + (ttl or self.artifact_ttl), 'kept')
+
+    def release(self, path: str):
+        """Remove a workspace that's no longer needed"""
+        with self._lock:
+            self._active.pop(path, None)
+        shutil.rmtree(path, ignore_errors=True)
+        self._usage = None
+
+    def resolve(self, name: str, filename: str) -> str:
+        """
+        Path of an artifact inside a workspace, from names taken from a URL.
+
+        Returns:
+            str: The path, or None if it would point outside the workspace or doesn't exist
+        """
+        if name != os.path.basename(name) or filename != os.path.basename(filename) or name in ('', '.', '..'):
+            return None
+        path = os.path.join(self.root, name, filename)
+        return path if os.path.isfile(path) else None
+
+    def usage(self, max_age: float = 2.0) -> int:
+        """
+        Bytes used under the root, cached for max_age seconds.
+
+        Returns:
+            int: Total size of every file under the root
+        """
+        if self._usage is None or time.monotonic() - self._usage_at > max_age:
+            self._usage = _tree_size(self.root)
+            self._usage_at = time.monotonic()
+        return self._usage
+
+    def has_room(self) -> bool:
+        """Whether the root is below its high watermark, checked before a job starts"""
+        # a full root is only emptied by the janitor, which no workspace may have started yet
+        with self._lock:
+            self._start_janitor()
+        return self.usage() < self.quota_bytes * self.high_watermark
+
+    def sweep(self) -> dict:
+        """
+        Reclaim disk space: expired workspaces, stale partial files and, while
+        over the high watermark, kept artifacts.
+
+        Returns:
+            dict: Number of workspaces removed and bytes freed
+        """
+        now = time.time()
+        removed = 0
+        freed = 0
+        with self._lock:
+            active = dict(self._active)
+        # a failing lookup fails the sweep, rather than sweeping what may be in use
+        in_use = {os.path.abspath(path) for path in self.in_use()} if self.in_use else set()
+        kept = []
+
+        for entry in _scandir(self.root):
+            if entry.path in active:
+                # ours and still running, push its expiry forward
+                self._write_marker(entry.path, active[entry.path], now + self.stale_ttl, 'running')
+                continue
+            if os.path.abspath(entry.path) in in_use:
+                # another process's job, or one waiting to be resumed
+                continue
+            marker = self._read_marker(entry.path) if entry.is_dir(follow_symlinks=False) else None
+            if marker is None:
+                # files and directories from before workspaces, or a workspace being created
+                if now - entry.stat(follow_symlinks=False).st_mtime > self.artifact_ttl:
+                    freed += self._remove(entry.path)
+                    removed += 1
+                continue
+            if marker['expires_at'] < now:
+                freed += self._remove(entry.path)
+                removed += 1
+                continue
+            freed += self._remove_partials(entry.path, now)
+            if marker['state'] == 'kept':
+                kept.append((marker['expires_at'], entry.path))
+
+        usage = _tree_size(self.root)
+        limit = self.quota_bytes * self.high_watermark
+        for _, path in sorted(kept):
+            if usage < limit:
+                break
+            size = self._remove(path)
+            usage -= size
+            freed += size
+            removed += 1
+
+        self._usage = usage
+        self._usage_at = time.monotonic()
+        return {'removed': removed, 'freed': freed, 'usage': usage}
+
+    def _remove(self, path):
+        size = _tree_size(path) if os.path.isdir(path) else _file_size(path)
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            # another process's janitor got there first
+            pass
+        except OSError:
+            print(f"Error removing workspace: \n{traceback.format_exc()}")
+            return 0
+        return size
+
+    def _remove_partials(self, path, now):
+        # downloads that died half way in a workspace that's otherwise kept
+        freed = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                if not filename.endswith(PARTIAL_SUFFIXES) and not PARTIAL_FRAGMENT.search(filename):
+                    continue
+                file_path = os.path.join(dirpath, filename)
+                try:
+                    if now - os.path.getmtime(file_path) > self.stale_ttl:
+                        freed += self._remove(file_path)
+                except OSError:
+                    continue
+        return freed
+
+    def _write_marker(self, path, job_id, expires_at, state):
+        marker = os.path.join(path, MARKER)
+        try:
+            # written whole then renamed, so the janitor never reads half a marker
+            with open(f"{marker}.tmp", 'w') as file:
+                json.dump({'job_id': job_id, 'expires_at': expires_at, 'state': state}, file)
+            os.replace(f"{marker}.tmp", marker)
+        except FileNotFoundError:
+            # released in the meantime
+            pass
+
+    def _read_marker(self, path):
+        try:
+            with open(os.path.join(path, MARKER)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _start_janitor(self):
+        # caller holds self._lock
+        if self._janitor is None or not self._janitor.is_alive():
+            self._janitor = threading.Thread(target=self._sweep_forever, name='workspace-janitor', daemon=True)
+            self._janitor.start()
+
+    def _sweep_forever(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                print(f"Workspace sweep failed: \n{traceback.format_exc()}")
+            time.sleep(self.sweep_interval)
+
+
+def _scandir(path):
+    try:
+        return list(os.scandir(path))
+    except FileNotFoundError:
+        return []
+
+
+def _file_size(path):
+    try:
+        return os.lstat(path).st_size
+    except OSError:
+        return 0
+
+
+def _tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            total += _file_size(os.path.join(dirpath, filename))
+    return total
+
+
+os.makedirs(TEMP_DIR, exist_ok=True)
+
+workspaces = WorkspaceManager(
+    root=TEMP_DIR,
+    quota_bytes=WORKSPACE_QUOTA_BYTES,
+    high_watermark=WORKSPACE_HIGH_WATERMARK,
+    artifact_ttl=WORKSPACE_ARTIFACT_TTL,
+    sweep_interval=WORKSPACE_SWEEP_INTERVAL,
+)
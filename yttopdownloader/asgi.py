@@ -3,6 +3,9 @@ ASGI config for yttopdownloader project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project through this module (e.g. ``uvicorn yttopdownloader.asgi:application``)
+so the open progress-events streams don't each hold a worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -80,6 +81,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # background workers write concurrently, IMMEDIATE takes the write lock
+        # up front so they wait for each other instead of failing with "database is locked"
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -124,3 +131,161 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Downloader
+
+# Extracted video metadata is cached per video ID. Stream URLs inside the
+# format list are signed by YouTube and expire after ~6 hours, keep the TTL below that.
+VIDEO_INFO_CACHE_TTL = 60 * 60 * 3
+VIDEO_INFO_CACHE_MAX_ENTRIES = 256
+VIDEO_INFO_CACHE_DB_MAX_ENTRIES = 5000
+
+# Finished downloads are kept here and served again without re-downloading,
+# least recently served files are evicted once the budget is exceeded.
+# Files served in the last DOWNLOAD_CACHE_PIN_SECONDS are never evicted, so a
+# worker about to open one doesn't find it gone.
+DOWNLOAD_CACHE_DIR = BASE_DIR / 'download_cache'
+DOWNLOAD_CACHE_MAX_BYTES = 10 * 1024 ** 3
+DOWNLOAD_CACHE_PIN_SECONDS = 60
+
+# Background jobs run on a fixed pool of workers, with separate limits for
+# concurrent yt-dlp downloads and ffmpeg merges. Requests beyond
+# DOWNLOAD_QUEUE_MAX queued jobs are rejected with a 429.
+# Merges are CPU bound, one per core; downloads are network bound, raise
+# DOWNLOAD_SLOTS with the uplink. There are enough workers to fill both.
+DOWNLOAD_SLOTS = 4
+MERGE_SLOTS = os.cpu_count() or 2
+DOWNLOAD_WORKERS = DOWNLOAD_SLOTS + MERGE_SLOTS
+DOWNLOAD_QUEUE_MAX = 100
+
+# Number of videos of a single playlist that are processed side by side.
+PLAYLIST_VIDEO_WORKERS = 3
+
+# Stream playlist ZIPs to the client while the videos are downloading instead
+# of building the whole archive on disk first.
+PLAYLIST_STREAMING_ZIP = False
+
+# Merges stream-copy into whichever of mp4, webm or mkv can hold the selected
+# codecs. Set to e.g. 'mp4' to always produce that container, transcoding
+# only the streams it can't hold.
+MERGE_CONTAINER = None
+
+# Pipe single video downloads from the stream URLs through ffmpeg straight
+# into the response (fragmented MP4), nothing is written to TEMP_DIR.
+# Piped files have no Content-Length and are not added to the download cache.
+DOWNLOAD_PIPE_MODE = False
+
+# Let the web server in front of Django send finished files:
+# 'x-accel-redirect' for nginx (an internal location at X_ACCEL_REDIRECT_PREFIX
+# has to alias BASE_DIR) or 'x-sendfile' for apache/lighttpd. None serves them
+# from Django with Range support.
+FILE_SERVING_OFFLOAD = None
+X_ACCEL_REDIRECT_PREFIX = '/protected/'
+
+# How often (seconds) the progress event streams check for changes.
+PROGRESS_EVENTS_INTERVAL = 0.5
+
+# Where download progress and job state is kept:
+# 'memory' only works with a single worker process, 'sqlite' (a WAL mode
+# database at PROGRESS_SQLITE_PATH) is shared by all workers on the host and
+# 'redis' (needs the redis package, pip install redis) by all hosts using
+# PROGRESS_REDIS_URL. A backend that can't be set up stops the app from starting.
+# Finished jobs are forgotten PROGRESS_TTL seconds after they complete.
+PROGRESS_BACKEND = 'memory'
+PROGRESS_SQLITE_PATH = BASE_DIR / 'progress.sqlite3'
+PROGRESS_REDIS_URL = 'redis://localhost:6379/0'
+PROGRESS_TTL = 60 * 60
+
+# Progress hooks fire for every downloaded chunk, updates are coalesced so a
+# job writes to the progress store at most this many times per second.
+PROGRESS_PUBLISH_RATE = 2
+
+# History entries per page on the index page, and how long a rendered page
+# is cached (lookups made by any worker invalidate it right away).
+HISTORY_PAGE_SIZE = 10
+HISTORY_CACHE_TTL = 30
+
+# Playlist entries listed per page, further pages are fetched on demand.
+PLAYLIST_PAGE_SIZE = 50
+
+# Fetch the formats of listed playlist videos in the background, with at most
+# PLAYLIST_PREFETCH_WORKERS extractions at a time across all playlists.
+PLAYLIST_PREFETCH = True
+PLAYLIST_PREFETCH_WORKERS = 2
+
+# Format picked for every video of a playlist download, by format type. See
+# downloader.formats.FormatIndex.select for the rule keys, e.g. the best video
+# under 50 MB is {'type': 'video', 'max_size': 50 * 1024 * 1024}.
+PLAYLIST_FORMAT_RULES = {
+    'video': {'type': 'video', 'max_height': 1080, 'container': 'mp4'},
+    'audio': {'type': 'audio', 'container': 'mp4'},
+}
+
+# Prometheus metrics served at /metrics. With 'sqlite' every worker process
+# pushes its samples to the database at METRICS_SQLITE_PATH every
+# METRICS_FLUSH_INTERVAL seconds, so a scrape answered by any worker covers
+# the whole host; 'memory' only reports the worker that answers the scrape.
+METRICS_BACKEND = 'sqlite'
+METRICS_SQLITE_PATH = BASE_DIR / 'metrics.sqlite3'
+METRICS_FLUSH_INTERVAL = 5
+
+# Every job downloads into its own workspace under temp_downloads/. Finished
+# artifacts (playlist ZIPs, files the download cache couldn't take) are kept
+# for WORKSPACE_ARTIFACT_TTL seconds. A janitor sweeps every
+# WORKSPACE_SWEEP_INTERVAL seconds, removing expired workspaces, those of
+# killed workers and stale .part files. While temp_downloads/ uses more than
+# WORKSPACE_HIGH_WATERMARK of WORKSPACE_QUOTA_BYTES, kept artifacts are
+# evicted and queued jobs wait before starting.
+WORKSPACE_QUOTA_BYTES = 20 * 1024 ** 3
+WORKSPACE_HIGH_WATERMARK = 0.9
+WORKSPACE_ARTIFACT_TTL = 60 * 60
+WORKSPACE_SWEEP_INTERVAL = 60
+
+# Audio playlist downloads can be converted to MP3 or Opus at one of
+# AUDIO_BITRATES (kbps), loudness normalized to the AUDIO_LOUDNORM targets
+# (None to skip) and tagged, all in one ffmpeg pass per file. Conversions run
+# on TRANSCODE_WORKERS ffmpeg processes (None for one per core) while the
+# next videos download, and share the MERGE_SLOTS CPU budget with merges.
+AUDIO_BITRATES = (96, 128, 160, 192, 256, 320)
+AUDIO_DEFAULT_BITRATE = 192
+AUDIO_LOUDNORM = {'I': -16, 'TP': -1.5, 'LRA': 11}
+TRANSCODE_WORKERS = None
+
+# Downloads of every job share DOWNLOAD_BANDWIDTH_LIMIT bytes per second
+# (None for no limit), set it below the uplink so pages and file responses
+# keep some headroom. Jobs downloading at the same time split the limit by
+# DOWNLOAD_PRIORITY_WEIGHTS (keyed by scheduler priority: 0 single videos,
+# 10 playlist items) and may use what the others leave idle.
+# DOWNLOAD_TRANSPORT sets how many fragments of a DASH/HLS stream are fetched
+# at once and the size of each ranged HTTP request. Plain HTTP streams of a
+# known size are instead split in segment_size byte ranges fetched over
+# 'connections' keep-alive connections (1 leaves them to yt-dlp), each range
+# retried segment_retries times on its own. download_video() takes per-job
+# overrides.
+DOWNLOAD_BANDWIDTH_LIMIT = None
+DOWNLOAD_BANDWIDTH_BURST = 1.0
+DOWNLOAD_PRIORITY_WEIGHTS = {0: 4, 10: 1}
+DOWNLOAD_TRANSPORT = {
+    'concurrent_fragments': 4,
+    'http_chunk_size': 10 * 1024 * 1024,
+    'connections': 4,
+    'segment_size': 4 * 1024 * 1024,
+    'segment_retries': 3,
+}
+
+# Scheduled downloads are recorded in the database (downloader.jobs). The
+# process running a job refreshes its heartbeat every JOB_HEARTBEAT_INTERVAL
+# seconds; web server processes take over the jobs of processes that are
+# gone (no heartbeat for JOB_STALE_AFTER seconds, or a dead pid on this
+# host) on startup and while running, and continue them in their old
+# workspace from the partial files and finished playlist items. A job is
+# given up after JOB_MAX_ATTEMPTS takeovers. Finished jobs are kept for
+# JOB_RETENTION seconds.
+# Only gunicorn, uvicorn, daphne, hypercorn and runserver count as web
+# servers; start any other server with JOB_RESUME=1 in its environment.
+JOB_RESUME_ON_STARTUP = True
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_STALE_AFTER = 120
+JOB_MAX_ATTEMPTS = 3
+JOB_RETENTION = 7 * 24 * 60 * 60